@@ -0,0 +1,116 @@
+# app/aesthetic_heads.py
+# Aesthetic ヘッド (CLIP 埋め込み → スコアの小さな全結合層) だけを保存済み埋め込みに適用する「ヘッドのみ再スコア」。
+# ViT-L の再実行なしで、別チェックポイントの試用や複数スコアの並列記録ができます。
+import re
+from pathlib import Path
+
+import numpy as np
+
+from . import scoring as scoring_module
+from .embedding_store import get_embedding_store
+
+HEAD_SCORES_KEY = "score_aesthetic_heads"  # score_data に書く {ヘッド名: スコア}
+HEAD_RESCORE_CHUNK = 8192  # 1 回の行列積で処理する画像数
+_LAYER_KEY_RE = re.compile(r"^(?:.*\.)?layers(?:\.(\d+))?\.(weight|bias)$")
+
+class AestheticHead:
+    """
+    Linear 層 (と任意の ReLU) の列を numpy で保持するヘッド。
+    layers: [(W (out, in), b (out,)), ...]。relu=True なら最終層以外の出力に ReLU を挟む (V2ReLU 相当)。
+    """
+    def __init__(self, name, layers, relu=False):
+        self.name = name; self.layers = [(np.asarray(w, dtype=np.float32), np.asarray(b, dtype=np.float32)) for w, b in layers]; self.relu = relu
+
+    @property
+    def input_dim(self): return self.layers[0][0].shape[1]
+
+    def logits(self, embeddings):
+        x = np.asarray(embeddings, dtype=np.float32)
+        for idx, (w, b) in enumerate(self.layers):
+            x = x @ w.T + b
+            if self.relu and idx < len(self.layers) - 1: np.maximum(x, 0.0, out=x)
+        return x
+
+    def scores(self, embeddings):
+        return scoring_module.logits_to_aesthetic_score(self.logits(embeddings))
+
+def _layers_from_state_dict(state_dict):
+    """layers.N.weight / layers.N.bias (または layers.weight) のキーから Linear 層の列を作る。"""
+    found = {}
+    for key, value in state_dict.items():
+        m = _LAYER_KEY_RE.match(key)
+        if m: found.setdefault(int(m.group(1) or 0), {})[m.group(2)] = np.asarray(value, dtype=np.float32)
+    layers = [(found[i]["weight"], found[i].get("bias", np.zeros(found[i]["weight"].shape[0], dtype=np.float32)))
+              for i in sorted(found) if "weight" in found[i] and found[i]["weight"].ndim == 2]
+    if not layers: raise ValueError("チェックポイントに layers.*.weight が見つかりません")
+    return layers
+
+def head_from_predictor(name="current"):
+    """ロード済み STD_AESTHETIC_PREDICTOR の .layers (ONNX 使用中は保存済みヘッド重み) からヘッドを作る (未ロード/非対応なら None)。"""
+    predictor = scoring_module.STD_AESTHETIC_PREDICTOR; torch = scoring_module.torch
+    if predictor is None and scoring_module.STD_AESTHETIC_ONNX is not None:
+        # ONNX バックエンド使用中は、エクスポート時に保存したヘッド重みを使う
+        from . import onnx_aesthetic as onnx_aesthetic_module
+        saved = onnx_aesthetic_module.load_head_state(scoring_module.AESTHETIC_MODEL_CACHE_DIR, scoring_module._aesthetic_model_id())
+        return AestheticHead(name, _layers_from_state_dict(saved[0]), relu=saved[1]) if saved else None
+    if predictor is None or torch is None or not hasattr(predictor, "layers"): return None
+    state = {f"layers.{k}": v.detach().float().cpu().numpy() for k, v in predictor.layers.state_dict().items()}
+    relu = any(isinstance(m, torch.nn.ReLU) for m in predictor.layers.modules())
+    return AestheticHead(name, _layers_from_state_dict(state), relu=relu)
+
+def load_head(spec):
+    """
+    ヘッド指定文字列からヘッドを読み込む。
+      "current"            ロード済み predictor のヘッド
+      "<HF repo id>"       Hugging Face のチェックポイントからヘッドの重みだけ取り出す (repo id に relu を含めば ReLU 版)
+      "<path>.safetensors" / "<path>.bin" / "<path>.pt"  ローカルの state_dict
+    """
+    if spec == "current":
+        head = head_from_predictor()
+        if head is None: raise RuntimeError("Aesthetic Predictor が未ロードのため current ヘッドは使えません")
+        return head
+    path = Path(spec)
+    if not path.exists():
+        from huggingface_hub import hf_hub_download
+        cache_dir = str(scoring_module.AESTHETIC_MODEL_CACHE_DIR / "aesthetic_heads"); last_error = None
+        for filename in ("model.safetensors", "pytorch_model.bin"):
+            try: path = Path(hf_hub_download(spec, filename, cache_dir=cache_dir)); break
+            except Exception as e_dl: last_error = e_dl
+        else: raise RuntimeError(f"{spec} のチェックポイントを取得できません: {last_error}")
+    if path.suffix == ".safetensors":
+        from safetensors.numpy import load_file
+        state = load_file(str(path))
+    else:
+        import torch
+        state = {k: v.float().numpy() for k, v in torch.load(str(path), map_location="cpu").items() if hasattr(v, "numpy")}
+    return AestheticHead(spec, _layers_from_state_dict(state), relu="relu" in spec.lower())
+
+def rescore_with_heads(scores_data, heads, primary=None, progress_callback=None):
+    """
+    保存済み埋め込みに各ヘッドを適用し、score_data[HEAD_SCORES_KEY][ヘッド名] に書き込む (インプレース)。
+    primary にヘッド名を渡すと、そのスコアで score_moe / score_aesthetic_clip も置き換える
+    (呼び出し側で tag_store.repenalize を実行して score_final を作り直すこと)。置き換えた画像からはカスケードの仮スコアの印 (score_stage) を外す。
+    Returns: (スコアを書いた画像数, 埋め込みがなく飛ばした画像数)
+    """
+    store = get_embedding_store()
+    hash_to_ids = {}
+    for image_id, score_data in scores_data.items():
+        if score_data.get("content_hash"): hash_to_ids.setdefault(score_data["content_hash"], []).append(image_id)
+    found, matrix = store.get_matrix(list(hash_to_ids))
+    if not found: return 0, len(scores_data)
+    for head in heads:
+        if head.input_dim != matrix.shape[1]: raise ValueError(f"ヘッド {head.name} の入力次元 {head.input_dim} が埋め込み次元 {matrix.shape[1]} と一致しません")
+    written = 0
+    for start in range(0, len(found), HEAD_RESCORE_CHUNK):
+        chunk_hashes = found[start:start + HEAD_RESCORE_CHUNK]; chunk = matrix[start:start + HEAD_RESCORE_CHUNK].astype(np.float32)
+        head_scores = {head.name: head.scores(chunk) for head in heads}
+        for k, content_hash in enumerate(chunk_hashes):
+            for image_id in hash_to_ids[content_hash]:
+                score_data = scores_data[image_id]; per_head = score_data.setdefault(HEAD_SCORES_KEY, {})
+                for name, values in head_scores.items(): per_head[name] = round(float(values[k]), 2)
+                if primary in head_scores:
+                    score_data["score_moe"] = per_head[primary]; score_data["score_aesthetic_clip"] = round(per_head[primary] / 10.0, 3)
+                    if score_data.get("score_stage") == scoring_module.CASCADE_STAGE_PRIOR: score_data.pop("score_stage")  # 埋め込みから出した本来のスコアになった
+                written += 1
+        if progress_callback: progress_callback(min(start + HEAD_RESCORE_CHUNK, len(found)), len(found))
+    return written, len(scores_data) - written
@@ -0,0 +1,124 @@
+# app/autotune.py
+# 起動時の自動チューニング。モデル読込後に合成入力でいくつかの構成 (推論バッチサイズ・torch スレッド数・デコードワーカー数) を測り、
+# 1 バッチの推論時間が上限以内で最もスループットの高い構成を選びます。
+# 結果はマシンとモデル/バックエンドの指紋付きで保存し (GUI は QSettings)、指紋が変わったときだけ測り直します。
+# ONNX Runtime / TensorFlow のスレッド数はセッション作成後に変えられないため、ここでは測りません (設定値と CONCURRENT_INFERENCE の配分のまま)。
+import datetime
+import io
+import os
+import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+AUTOTUNE_ENABLED = True
+AUTOTUNE_LATENCY_CAP_MS = 3000.0  # 1 バッチの推論がこれを超える構成は選ばない (スコアがギャラリーに出るまでの待ちの上限)
+AUTOTUNE_BATCH_SIZES = (1, 4, 8, 16, 32)
+AUTOTUNE_REPEAT = 2  # 構成ごとの計測回数 (最速値を使う)
+AUTOTUNE_DECODE_IMAGES = 24  # デコードワーカー数の計測に使う合成 JPEG の枚数
+AUTOTUNE_DECODE_TOLERANCE = 0.05  # 最速からこの割合以内なら少ないワーカー数を選ぶ (コアを推論に残す)
+_SYNTHETIC_SIZE = (1536, 1024)
+
+def machine_fingerprint(scoring_module):
+    """マシン・モデル・バックエンドの組。どれかが変わったら測り直す。"""
+    scorer_id, model_version = scoring_module.current_scorer_identity()
+    return "|".join([platform.node(), platform.machine(), f"cpu={os.cpu_count()}", f"{scorer_id}:{model_version}", f"device={scoring_module.DEVICE}",
+                     f"aesthetic={scoring_module.AESTHETIC_BACKEND}/{scoring_module.TORCH_ACCEL_PROFILE}", f"ddb={scoring_module.DDB_RUNTIME}",
+                     f"concurrent={scoring_module.CONCURRENT_INFERENCE}", f"cascade={scoring_module.CASCADE_MODE}", f"cap={AUTOTUNE_LATENCY_CAP_MS:g}"])
+
+def _synthetic_images(count, size=_SYNTHETIC_SIZE, seed=0):
+    """なめらかなグラデーション + ノイズの RGB 画像 (JPEG の圧縮率・デコード時間が写真に近くなる)。"""
+    rng = np.random.default_rng(seed); w, h = size; yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    images = []
+    for _ in range(count):
+        phase = rng.uniform(0, 2 * np.pi, 3); base = np.stack([127 + 100 * np.sin(xx / rng.uniform(60, 240) + yy / rng.uniform(60, 240) + p) for p in phase], axis=-1)
+        images.append(Image.fromarray(np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8), "RGB"))
+    return images
+
+def _torch_thread_candidates(scoring_module):
+    """torch の CLIP を CPU で動かしているときだけ、コア数の 1/4・1/2・全部を試す。それ以外は [None] (変更しない)。"""
+    torch = scoring_module.torch
+    if torch is None or scoring_module.DEVICE != "cpu" or scoring_module.STD_AESTHETIC_ONNX is not None or scoring_module.STD_AESTHETIC_PREDICTOR is None: return [None]
+    cpu = os.cpu_count() or 1
+    return sorted({max(1, cpu // 4), max(1, cpu // 2), cpu})
+
+def _set_torch_threads(scoring_module, threads):
+    if threads is not None: scoring_module.torch.set_num_threads(int(threads))
+
+def _time_batch(scoring_module, model_inputs, batch_size, repeat):
+    batch = [model_inputs[i % len(model_inputs)] for i in range(batch_size)]; names = [f"autotune_{i}" for i in range(batch_size)]
+    scoring_module.score_preprocessed_batch(batch, names, {})  # ウォームアップ (初回のみの確保・コンパイルを除く)
+    best = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter(); scoring_module.score_preprocessed_batch(batch, names, {}); elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _tune_inference(scoring_module, model_inputs, trials, progress_callback=None):
+    """(torch スレッド数, バッチサイズ) の全組を測る。上限を超えたらそれより大きいバッチは測らない。"""
+    cap_s = AUTOTUNE_LATENCY_CAP_MS / 1000.0; thread_options = _torch_thread_candidates(scoring_module)
+    total = len(thread_options) * len(AUTOTUNE_BATCH_SIZES); done = 0
+    for threads in thread_options:
+        _set_torch_threads(scoring_module, threads)
+        for batch_size in AUTOTUNE_BATCH_SIZES:
+            done += 1
+            if progress_callback: progress_callback.emit(f"自動チューニング: 推論 (スレッド {threads or '既定'}, バッチ {batch_size})...", int(80 * done / total))
+            seconds = _time_batch(scoring_module, model_inputs, batch_size, AUTOTUNE_REPEAT)
+            trials.append({"kind": "inference", "torch_threads": threads, "batch_size": batch_size, "latency_ms": round(seconds * 1000.0, 1), "images_per_sec": round(batch_size / seconds, 2)})
+            if seconds > cap_s: break
+    within_cap = [t for t in trials if t["kind"] == "inference" and t["latency_ms"] <= AUTOTUNE_LATENCY_CAP_MS]
+    if within_cap: return max(within_cap, key=lambda t: t["images_per_sec"])
+    return min((t for t in trials if t["kind"] == "inference"), key=lambda t: t["latency_ms"])  # どれも上限超え: 最も待ちの短い構成
+
+def _tune_decode_workers(scoring_module, trials, progress_callback=None):
+    """合成 JPEG のデコード + 前処理をワーカー数を変えて測り、最速に近い中で最少のワーカー数を返す。"""
+    target = scoring_module.decode_target_size(); payloads = []
+    for img in _synthetic_images(4, seed=1):
+        buffer = io.BytesIO(); img.save(buffer, "JPEG", quality=90); payloads.append(buffer.getvalue())
+    payloads = [payloads[i % len(payloads)] for i in range(AUTOTUNE_DECODE_IMAGES)]
+    def decode_one(data):
+        with Image.open(io.BytesIO(data)) as img:
+            if target: img.draft("RGB", target)
+            scoring_module.preprocess_for_models(img.convert("RGB"))
+    cpu = os.cpu_count() or 1; results = []
+    for workers in sorted({1, 2, max(1, cpu // 4), max(1, cpu // 2), cpu}):
+        if progress_callback: progress_callback.emit(f"自動チューニング: デコード ({workers}ワーカー)...", 85)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            start = time.perf_counter(); list(executor.map(decode_one, payloads)); seconds = time.perf_counter() - start
+        trial = {"kind": "decode", "decode_workers": workers, "images_per_sec": round(len(payloads) / seconds, 2)}; trials.append(trial); results.append(trial)
+    best = max(t["images_per_sec"] for t in results)
+    return min((t for t in results if t["images_per_sec"] >= best * (1.0 - AUTOTUNE_DECODE_TOLERANCE)), key=lambda t: t["decode_workers"])
+
+def run_autotune(scoring_module, progress_callback=None):
+    """合成入力で構成を測り、選んだ構成と全試行を返す (モデル初期化済みで、まだ処理を始めていない時点で呼ぶ)。"""
+    from . import perf_stats as perf_stats_module
+    started = time.perf_counter(); trials = []
+    previous_threads = scoring_module.torch.get_num_threads() if _torch_thread_candidates(scoring_module) != [None] else None
+    try:
+        model_inputs = [scoring_module.preprocess_for_models(img) for img in _synthetic_images(4)]
+        best_inference = _tune_inference(scoring_module, model_inputs, trials, progress_callback)
+        best_decode = _tune_decode_workers(scoring_module, trials, progress_callback)
+    finally:
+        _set_torch_threads(scoring_module, previous_threads)
+        perf_stats_module.get_perf_stats().reset()  # 合成入力の計測を統計に残さない
+    result = {"fingerprint": machine_fingerprint(scoring_module), "tuned_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+              "batch_size": best_inference["batch_size"], "torch_threads": best_inference["torch_threads"], "decode_workers": best_decode["decode_workers"],
+              "images_per_sec": best_inference["images_per_sec"], "latency_ms": best_inference["latency_ms"], "seconds": round(time.perf_counter() - started, 1), "trials": trials}
+    print(f"[Autotune] バッチ {result['batch_size']}, torch スレッド {result['torch_threads'] or '既定'}, デコードワーカー {result['decode_workers']} を選択 "
+          f"({result['images_per_sec']:.2f} 枚/秒, 1 バッチ {result['latency_ms']:.0f}ms, 計測 {result['seconds']:.1f}秒)")
+    return result
+
+def tune_or_reuse(scoring_module, cached=None, progress_callback=None):
+    """保存済みの結果が今のマシン/モデル/バックエンドのものならそれを、違えば測り直した結果を返す。Returns: (結果, 再利用したか)"""
+    if cached and cached.get("fingerprint") == machine_fingerprint(scoring_module): return cached, True
+    if cached: print("[Autotune] マシンまたはモデル/バックエンドが変わったため測り直します。")
+    return run_autotune(scoring_module, progress_callback), False
+
+def apply_result(result, scoring_module, pipeline_module):
+    """選んだ構成をモジュール変数 (と torch のスレッド数) に反映する。"""
+    if not result: return
+    scoring_module.SCORING_BATCH_SIZE = int(result["batch_size"]); pipeline_module.PIPELINE_DECODE_WORKERS = int(result["decode_workers"])
+    if result.get("torch_threads") and scoring_module.torch is not None:
+        scoring_module.TORCH_INTRA_OP_THREADS = int(result["torch_threads"]); scoring_module.torch.set_num_threads(int(result["torch_threads"]))
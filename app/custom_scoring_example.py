@@ -1,6 +1,9 @@
 # app/custom_scoring_example.py
 # このファイルを app/custom_scoring.py として保存し、
 # 以下の関数を独自ロジックで実装してください。
+# (旧来の 1 枚ずつの API (v1) です。バッチで推論するプラグイン API (v2) は scorer_plugin_example.py を参照)
+# v1 では penalties_dict に penalties.yml の内容が渡され、返した final_score / applied_penalties がそのまま使われます
+# (v2 プラグインと併用した場合だけ、返した failure_tags から penalties.yml で減点を計算し直します)。
 
 from pathlib import Path
 from PIL import Image
@@ -0,0 +1,75 @@
+# app/ddb_runtime.py
+# TensorFlow を使わない DeepDanbooru 推論。
+# models/deepdanbooru_standard_model の Keras モデルを 1 回だけ ONNX に変換し、以後は ONNX Runtime で直接実行します。
+#   変換: python -m app.ddb_runtime convert [--project PATH] [--opset 13]
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ONNX_MODEL_FILENAME = "deepdanbooru.onnx"
+DEFAULT_OPSET = 13
+
+def onnx_model_path(project_path):
+    return Path(project_path) / ONNX_MODEL_FILENAME
+
+def load_tags(project_path):
+    """project の tags.txt を読む (deepdanbooru.project.load_tags_from_project と同じ内容、TensorFlow 不要)。"""
+    with open(Path(project_path) / "tags.txt", 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+class OnnxDeepDanbooru:
+    """
+    Keras モデルと同じ呼び出し方 (input_shape / predict) ができる ONNX Runtime ラッパー。
+    predict は Keras の predict のようなコールバック・データセット構築を行わず、セッションを直接実行します。
+    """
+    def __init__(self, model_path, intra_op_threads=0):
+        import onnxruntime as ort
+        options = ort.SessionOptions(); options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads and intra_op_threads > 0: options.intra_op_num_threads = int(intra_op_threads)
+        self.model_path = Path(model_path)
+        self.session = ort.InferenceSession(str(model_path), sess_options=options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]; self.input_name = model_input.name
+        self.input_shape = (None, *[d if isinstance(d, int) else None for d in model_input.shape[1:]])  # (None, H, W, 3)
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        if not batch_size or batch_size >= len(batch): return self.session.run(None, {self.input_name: batch})[0]
+        return np.concatenate([self.session.run(None, {self.input_name: batch[i:i + batch_size]})[0] for i in range(0, len(batch), batch_size)])
+
+def convert_project_to_onnx(project_path, output_path=None, opset=DEFAULT_OPSET, verify=True):
+    """Keras の DeepDanbooru モデルを ONNX に変換する (TensorFlow・deepdanbooru・tf2onnx が必要、1 回だけ)。"""
+    import tensorflow as tf
+    import tf2onnx
+    import deepdanbooru as ddb
+    project_path = Path(project_path); output_path = Path(output_path or onnx_model_path(project_path))
+    model = ddb.project.load_model_from_project(str(project_path), compile_model=False)
+    height, width = model.input_shape[1], model.input_shape[2]
+    spec = (tf.TensorSpec((None, height, width, 3), tf.float32, name="input"),)
+    tmp_path = output_path.with_suffix(".tmp")
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=str(tmp_path))
+    if verify:
+        sample = np.random.default_rng(0).random((2, height, width, 3), dtype=np.float32)
+        diff = float(np.max(np.abs(OnnxDeepDanbooru(tmp_path).predict(sample) - model.predict(sample, verbose=0))))
+        print(f"[DDB-ONNX] Keras との最大誤差: {diff:.2e}")
+        if diff > 1e-3: tmp_path.unlink(missing_ok=True); raise RuntimeError(f"変換結果が Keras と一致しません (最大誤差 {diff:.2e})")
+    tmp_path.replace(output_path)
+    print(f"[DDB-ONNX] 変換完了: {output_path} (入力 {height}x{width})")
+    return output_path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.ddb_runtime", description="DeepDanbooru モデルを ONNX に変換します。")
+    sub = parser.add_subparsers(dest="command", required=True)
+    convert = sub.add_parser("convert", help="Keras モデルを ONNX に変換")
+    convert.add_argument("--project", default=str(Path(__file__).resolve().parent.parent / "models" / "deepdanbooru_standard_model"))
+    convert.add_argument("--output", default=None); convert.add_argument("--opset", type=int, default=DEFAULT_OPSET)
+    convert.add_argument("--no-verify", action="store_true", help="Keras との出力比較を省略")
+    args = parser.parse_args(argv)
+    project = Path(args.project)
+    if not (project / "project.json").exists(): print(f"DeepDanbooru プロジェクトが見つかりません: {project}", file=sys.stderr); return 1
+    convert_project_to_onnx(project, args.output, args.opset, verify=not args.no_verify)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
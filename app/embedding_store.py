@@ -0,0 +1,104 @@
+# app/embedding_store.py
+# 画像ごとの CLIP 画像埋め込み (Aesthetic ヘッドの入力) を float16 のメモリマップ行列に保存します。
+# キーは内容ハッシュ (score_data["content_hash"]) なので、リネームやキャッシュ経由の再登録でも同じ行を使います。
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+BASE_DIR_EMBEDDING_STORE = Path(__file__).resolve().parent.parent
+EMBEDDING_STORE_DIR = BASE_DIR_EMBEDDING_STORE / "cache" / "clip_embeddings"
+_INITIAL_CAPACITY = 1024
+
+class ClipEmbeddingStore:
+    """
+    embeddings.f16 (capacity × dim の float16 memmap) と index.json ({content_hash: 行番号}, モデルID) の組。
+    埋め込みを作ったモデルが変わった場合は中身を破棄して作り直します。
+    """
+    def __init__(self, store_dir=EMBEDDING_STORE_DIR):
+        self.store_dir = Path(store_dir); self.data_path = self.store_dir / "embeddings.f16"; self.index_path = self.store_dir / "index.json"
+        self._lock = threading.Lock(); self.model_id = None; self.dim = None; self.capacity = 0
+        self._row_of = {}; self._matrix = None; self.dirty = False
+
+    def __len__(self):
+        with self._lock: return len(self._row_of)
+
+    def __contains__(self, content_hash):
+        with self._lock: return content_hash in self._row_of
+
+    def load(self):
+        if not self.index_path.exists() or not self.data_path.exists(): return self
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f: index = json.load(f)
+            model_id, dim, capacity, row_of = index["model_id"], int(index["dim"]), int(index["capacity"]), dict(index["rows"])
+            if self.data_path.stat().st_size != capacity * dim * 2: raise ValueError("行列ファイルのサイズが index と一致しません")
+            matrix = np.memmap(self.data_path, dtype=np.float16, mode="r+", shape=(capacity, dim))
+        except Exception as e_load: print(f"[EmbeddingStore] 読込失敗 (空のストアで続行): {e_load}"); return self
+        with self._lock:
+            self.model_id = model_id; self.dim = dim; self.capacity = capacity; self._row_of = row_of; self._matrix = matrix; self.dirty = False
+        return self
+
+    def _reset_locked(self, model_id, dim):
+        if self._row_of: print(f"[EmbeddingStore] 埋め込みモデルが変わったため既存の {len(self._row_of)} 件を破棄 ({self.model_id} -> {model_id})")
+        self._matrix = None; self.model_id = model_id; self.dim = int(dim); self.capacity = 0; self._row_of = {}
+        self.store_dir.mkdir(parents=True, exist_ok=True); self._grow_locked(_INITIAL_CAPACITY)
+
+    def _grow_locked(self, min_capacity):
+        new_capacity = max(min_capacity, self.capacity * 2, _INITIAL_CAPACITY)
+        if self._matrix is not None: self._matrix.flush(); self._matrix = None
+        with open(self.data_path, "ab" if self.capacity else "wb") as f: f.truncate(new_capacity * self.dim * 2)
+        self._matrix = np.memmap(self.data_path, dtype=np.float16, mode="r+", shape=(new_capacity, self.dim)); self.capacity = new_capacity
+
+    def add(self, content_hash, embedding, model_id):
+        """1 枚分の埋め込み (D,) を登録。content_hash か embedding がなければ何もしない。"""
+        if not content_hash or embedding is None: return
+        embedding = np.asarray(embedding, dtype=np.float16).reshape(-1)
+        with self._lock:
+            if self._matrix is None or self.model_id != model_id or self.dim != embedding.shape[0]: self._reset_locked(model_id, embedding.shape[0])
+            row = self._row_of.get(content_hash)
+            if row is None:
+                row = len(self._row_of)
+                if row >= self.capacity: self._grow_locked(row + 1)
+                self._row_of[content_hash] = row
+            self._matrix[row] = embedding; self.dirty = True
+
+    def get_matrix(self, content_hashes):
+        """(見つかった content_hash のリスト, (N, D) float16 配列) を返す。"""
+        with self._lock:
+            found = [h for h in content_hashes if h in self._row_of]
+            if not found or self._matrix is None: return [], np.zeros((0, self.dim or 0), dtype=np.float16)
+            return found, np.asarray(self._matrix[[self._row_of[h] for h in found]])
+
+    def prune(self, keep_hashes):
+        """keep_hashes にない行を詰めて削除する。削除件数を返す。"""
+        keep_hashes = set(keep_hashes)
+        with self._lock:
+            kept = [(h, r) for h, r in self._row_of.items() if h in keep_hashes]
+            removed = len(self._row_of) - len(kept)
+            if not removed: return 0
+            rows = np.asarray(self._matrix[[r for _, r in kept]]) if kept else None
+            self._row_of = {h: i for i, (h, _) in enumerate(kept)}
+            if rows is not None: self._matrix[:len(kept)] = rows
+            self.dirty = True
+        return removed
+
+    def flush(self):
+        with self._lock:
+            if not self.dirty or self._matrix is None: return
+            try:
+                self._matrix.flush(); tmp_path = self.index_path.with_suffix(".tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({"model_id": self.model_id, "dim": self.dim, "capacity": self.capacity, "rows": self._row_of}, f)
+                os.replace(tmp_path, self.index_path); self.dirty = False
+            except Exception as e_flush: print(f"[EmbeddingStore] 保存失敗: {e_flush}")
+
+_store_instance = None; _store_instance_lock = threading.Lock()
+
+def get_embedding_store():
+    """プロセス内で共有するストア (初回呼び出し時にディスクから読込)。"""
+    global _store_instance
+    with _store_instance_lock:
+        if _store_instance is None: _store_instance = ClipEmbeddingStore(EMBEDDING_STORE_DIR).load()
+        return _store_instance
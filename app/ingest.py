@@ -0,0 +1,91 @@
+# app/ingest.py
+# 新規画像 1 枚分の取り込みコンテキスト。
+# ファイルを 1 回だけ開いてデコードし、メタデータ抽出・スコアリング・サムネイル生成で共有します。
+# target_size を渡すと、各利用先が必要とする最小解像度まで縮小してデコードします
+# (JPEG は draft による DCT スケーリング、その他はデコード後に reduce() の整数倍縮小)。
+import time
+from pathlib import Path
+from PIL import Image
+
+from . import perf_stats as perf_stats_module
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    PILLOW_HEIF_AVAILABLE = True
+except ImportError: PILLOW_HEIF_AVAILABLE = False
+
+class ImageIngest:
+    """
+    1 ファイル分の PIL ハンドルとデコード済み画像を保持します。
+    各ステージ (open / decode / metadata / scoring / thumbnail) の失敗は errors に記録され、
+    後続ステージは失敗したステージの結果を使わずにそれぞれ従来どおりのエラー処理を行います。
+    target_size (幅, 高さ) を指定すると、rgb は両辺がそれ以上を保つ範囲で縮小された画像になります (original_size は元の寸法)。
+    """
+    def __init__(self, image_path, target_size=None):
+        self.path = Path(image_path); self.target_size = target_size
+        self.errors = {}  # stage名 -> エラーメッセージ
+        self._img = None; self._rgb = None; self._opened = False; self._decoded = False
+        self.original_size = None; self.reduce_factor = 1  # 元画像の (幅, 高さ) と、元画像からの縮小率 (draft + reduce)
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close(); return False
+
+    def record_error(self, stage, error):
+        self.errors[stage] = str(error)
+
+    @property
+    def image(self):
+        """開いたままの PIL 画像 (format / info / text 参照用)。open に失敗した場合は None。"""
+        if not self._opened:
+            self._opened = True
+            start = time.perf_counter()
+            try: self._img = Image.open(self.path); self.original_size = self._img.size
+            except Exception as e_open: self.record_error("open", e_open); self._img = None
+            perf_stats_module.record("open", time.perf_counter() - start)
+        return self._img
+
+    def decode(self):
+        """ピクセルを 1 回だけデコードします。PNG の IDAT 後の tEXt もこの時点で info/text に入ります。"""
+        img = self.image
+        if img is None: return False
+        if not self._decoded:
+            self._decoded = True
+            start = time.perf_counter()
+            try:
+                if self.target_size and img.format == "JPEG":
+                    img.draft(img.mode, self.target_size)  # DCT スケーリング (1/2, 1/4, 1/8) で必要な解像度だけデコード
+                img.load()
+            except Exception as e_decode: self.record_error("decode", e_decode)
+            perf_stats_module.record("decode", time.perf_counter() - start)
+        return "decode" not in self.errors
+
+    @property
+    def rgb(self):
+        """デコード済み RGB 画像 (共有、呼び出し側で破壊的変更をしないこと)。失敗時は None。"""
+        if self._rgb is None and self.decode():
+            try:
+                rgb = self._img if self._img.mode == "RGB" else self._img.convert("RGB")
+                factor = min(rgb.width // self.target_size[0], rgb.height // self.target_size[1]) if self.target_size else 1
+                if factor >= 2: rgb = rgb.reduce(factor)  # ボックス平均による整数倍縮小 (LANCZOS より大幅に軽い)
+                self._rgb = rgb; self.reduce_factor = self.original_size[0] / rgb.width if self.original_size else 1
+            except Exception as e_convert: self.record_error("decode", e_convert)
+        return self._rgb
+
+    def stage_error(self, *stages):
+        """指定ステージのうち最初に記録されたエラーを返す (なければ None)。"""
+        for stage in stages:
+            if stage in self.errors: return self.errors[stage]
+        return None
+
+    def close(self):
+        if self._img is not None:
+            try: self._img.close()
+            except Exception: pass
+        self._img = None; self._rgb = None
+
+def open_rgb(image_path, target_size=None):
+    """ImageIngest を介さずに使う呼び出し元向け: 1 回だけ開いて (縮小) デコードした RGB 画像。失敗時は OSError。"""
+    ingest = ImageIngest(image_path, target_size); img = ingest.rgb
+    if img is None: raise OSError(ingest.stage_error("open", "decode"))
+    return img
@@ -0,0 +1,151 @@
+# app/job_queue.py
+# スコアリング待ちの画像をディスクに残す優先度付きジョブキュー。
+# cache/job_queue.jsonl に追加 (add) と完了 (done) を 1 行ずつ追記するだけなので、
+# 処理途中でアプリが落ちても、起動時に読み直せば未完了のジョブから再開できます。
+# 優先度は小さいほど先: 対話的な再スコア > 監視で見つけた新規画像 > 一括再スキャン。
+import datetime
+import json
+import os
+import threading
+from pathlib import Path
+
+BASE_DIR_JOB_QUEUE = Path(__file__).resolve().parent.parent
+JOB_QUEUE_PATH = BASE_DIR_JOB_QUEUE / "cache" / "job_queue.jsonl"
+PRIORITY_INTERACTIVE = 0
+PRIORITY_WATCHER = 1
+PRIORITY_RESCAN = 2
+JOB_CHUNK_SIZE = 64             # 1 回のスコアリングスレッドに渡す枚数 (この単位で優先度の高いジョブが割り込める)
+JOB_CHECKPOINT_INTERVAL = 100   # この枚数ごとに結果を保存し、ジョブを完了として記録する
+_COMPACT_MIN_LINES = 1000       # ジャーナルがこの行数かつ未完了ジョブの 4 倍を超えたら書き直す
+
+class ScoringJobQueue:
+    """
+    パス単位で重複を除いたジョブキュー。
+    take() で取り出したジョブは「処理中」になるだけで、mark_done() されるまでジャーナル上は未完了のまま
+    (結果を保存する前に落ちても、次回起動時にもう一度処理される)。
+    処理中のパスがもう一度追加されたら (処理中にファイルが書き換えられた、再スコアが押された等) 覚えておき、
+    mark_done() / release() のあとも未着手のジョブとして残す。
+    release(paths, retry=False) で戻したジョブはこのセッションでは取り出さず、次回起動時に再開する。
+    """
+    def __init__(self, path=JOB_QUEUE_PATH):
+        self.path = Path(path); self._lock = threading.Lock()
+        self._pending = {}; self._in_flight = set(); self._requeued = {}; self._deferred = set(); self._seq = 0; self._journal_lines = 0
+
+    def load(self):
+        """ジャーナルを再生して未完了ジョブを復元する (壊れた行は読み飛ばす)。"""
+        pending = {}; seq = 0; lines = 0
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if not line.strip(): continue
+                        try: record = json.loads(line)
+                        except json.JSONDecodeError: continue  # 書き込み途中で落ちた最終行など
+                        lines += 1; path = record.get("path")
+                        if not path: continue
+                        if record.get("op") == "done": pending.pop(path, None)
+                        elif record.get("op") == "add":
+                            job = pending.get(path)
+                            if job is None: seq += 1; pending[path] = {"priority": int(record.get("priority", PRIORITY_RESCAN)), "seq": seq, "source": record.get("source")}
+                            else: job["priority"] = min(job["priority"], int(record.get("priority", PRIORITY_RESCAN)))
+            except Exception as e_load: print(f"[JobQueue] {self.path.name} の読込失敗 (空のキューで続行): {e_load}")
+        with self._lock:
+            self._pending = pending; self._in_flight = set(); self._requeued = {}; self._deferred = set(); self._seq = seq; self._journal_lines = lines
+        if pending: print(f"[JobQueue] 未完了のジョブ {len(pending)}件を復元しました。")
+        self._maybe_compact()
+        return self
+
+    def _append_locked(self, records):
+        if not records: return
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write("".join(json.dumps({**r, "ts": now}, ensure_ascii=False) + "\n" for r in records)); f.flush(); os.fsync(f.fileno())
+            self._journal_lines += len(records)
+        except Exception as e_write: print(f"[JobQueue] {self.path.name} への書込失敗: {e_write}")
+
+    def enqueue(self, paths, priority=PRIORITY_RESCAN, source=None):
+        """
+        ジョブを追加し、新規に追加した件数を返す。
+        既に待っているパスは、より高い優先度で追加されたときだけ優先度を引き上げる。
+        """
+        records = []; added = 0
+        with self._lock:
+            for path in paths:
+                path = str(path); job = self._pending.get(path)
+                if job is None:
+                    self._seq += 1; self._pending[path] = {"priority": priority, "seq": self._seq, "source": source}; added += 1
+                elif path in self._in_flight:  # 処理中の結果は古いかもしれないので、完了後にもう一度処理する
+                    previous = self._requeued.get(path)
+                    if previous is None: added += 1
+                    if previous is None or priority < previous["priority"]: self._requeued[path] = {"priority": priority, "source": source}
+                elif path in self._deferred: self._deferred.discard(path); job["priority"] = min(priority, job["priority"]); added += 1  # 明示的な再追加なら再試行する
+                elif priority < job["priority"]: job["priority"] = priority
+                else: continue
+                records.append({"op": "add", "path": path, "priority": priority, "source": source})
+            self._append_locked(records)
+        return added
+
+    def take(self, max_count=JOB_CHUNK_SIZE, priority=None):
+        """優先度順 (同じ優先度は追加順) に最大 max_count 件を取り出して処理中にする。priority を指定するとその優先度のジョブだけ。"""
+        with self._lock:
+            ready = sorted((job["priority"], job["seq"], path) for path, job in self._pending.items()
+                           if path not in self._in_flight and path not in self._deferred and (priority is None or job["priority"] == priority))
+            chunk = [path for _, _, path in ready[:max_count]]; self._in_flight.update(chunk)
+            return chunk
+
+    def mark_done(self, paths):
+        """結果を保存し終えたジョブを完了として記録する。"""
+        with self._lock:
+            records = []
+            for path in paths:
+                path = str(path); self._in_flight.discard(path)
+                if path in self._requeued: self._requeue_locked(path); continue  # 処理中に追加し直されたジョブは残す (ジャーナルも未完了のまま)
+                if self._pending.pop(path, None) is not None: records.append({"op": "done", "path": path})
+            self._append_locked(records)
+        self._maybe_compact()
+
+    def release(self, paths, retry=True):
+        """処理中のジョブを未着手に戻す (中断時)。retry=False ならこのセッションでは取り出さない (結果が届かなかったジョブ)。"""
+        with self._lock:
+            for path in paths:
+                path = str(path); self._in_flight.discard(path)
+                if path in self._requeued: self._requeue_locked(path)
+                elif not retry and path in self._pending: self._deferred.add(path)
+
+    def _requeue_locked(self, path):
+        request = self._requeued.pop(path); job = self._pending.get(path)
+        if job is None: return
+        self._seq += 1; job["seq"] = self._seq; job["priority"] = min(job["priority"], request["priority"]); job["source"] = request["source"]; self._deferred.discard(path)
+
+    def pending_count(self, include_in_flight=False):
+        """未着手のジョブ数 (このセッションでは取り出さないジョブは除く)。include_in_flight なら処理中・保留も含めた全件。"""
+        with self._lock: return len(self._pending) if include_in_flight else len(self._pending) - len(self._in_flight) - len(self._deferred)
+
+    def __len__(self): return self.pending_count(include_in_flight=True)
+
+    def __contains__(self, path):
+        with self._lock: return str(path) in self._pending
+
+    def _maybe_compact(self):
+        """完了済みの行が溜まったら、未完了ジョブだけのジャーナルに書き直す。"""
+        with self._lock:
+            if self._journal_lines < max(_COMPACT_MIN_LINES, 4 * len(self._pending)): return
+            ordered = sorted(self._pending.items(), key=lambda item: item[1]["seq"]); tmp_path = self.path.with_suffix(".tmp")
+            now = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    for path, job in ordered: f.write(json.dumps({"op": "add", "path": path, "priority": job["priority"], "source": job["source"], "ts": now}, ensure_ascii=False) + "\n")
+                    f.flush(); os.fsync(f.fileno())
+                os.replace(tmp_path, self.path); self._journal_lines = len(ordered)
+            except Exception as e_compact: print(f"[JobQueue] {self.path.name} の書き直し失敗: {e_compact}")
+
+_queue_instance = None; _queue_instance_lock = threading.Lock()
+
+def get_job_queue():
+    """プロセス内で共有するキュー (初回呼び出し時にジャーナルから復元)。"""
+    global _queue_instance
+    with _queue_instance_lock:
+        if _queue_instance is None: _queue_instance = ScoringJobQueue(JOB_QUEUE_PATH).load()
+        return _queue_instance
@@ -0,0 +1,95 @@
+# app/model_snapshot.py
+# 起動高速化用のモデルスナップショット。
+# 初回 (HF Hub 経由) のロード後に、解決済みの CLIP 前処理設定と Aesthetic Predictor の重みを
+# models/snapshot/ に safetensors (メモリマップで読める形式) で書き出し、manifest.json にモデルIDとリビジョンを記録します。
+# 次回以降はこのディレクトリから local_files_only でロードし、Hub への問い合わせを行いません。
+# モデルID (またはスナップショット形式) が変わると manifest が一致しなくなり、Hub から取り直して作り直します。
+# 書き出しは毎回新しい世代ディレクトリ (gen-*) に行い、最後に manifest を原子的に差し替えて切り替えるので、
+# 同時に起動した別プロセスが書きかけのファイルを読むことはありません。
+import datetime
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+SNAPSHOT_FORMAT_VERSION = 2  # 2: 世代ディレクトリ (manifest["dir"])
+BASE_DIR_SNAPSHOT = Path(__file__).resolve().parent.parent
+SNAPSHOT_DIR = BASE_DIR_SNAPSHOT / "models" / "snapshot"
+MANIFEST_FILENAME = "manifest.json"
+PROCESSOR_SUBDIR = "clip_processor"   # CLIPProcessor + CLIPConfig (save_pretrained)
+PREDICTOR_SUBDIR = "aesthetic"        # Aesthetic Predictor (config.json + model.safetensors)
+GENERATION_PREFIX = "gen-"
+STALE_GENERATION_SEC = 3600.0         # manifest から外れた世代をこれより古くなってから消す (他プロセスが書き込み中かもしれない)
+
+def snapshot_key(model_ids):
+    """manifest と比較する識別情報。model_ids: {"clip": ..., "aesthetic_predictor": ..., "aesthetic_class": ...}"""
+    return {"format": SNAPSHOT_FORMAT_VERSION, "models": dict(model_ids)}
+
+def load_manifest(snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(Path(snapshot_dir) / MANIFEST_FILENAME, 'r', encoding='utf-8') as f: return json.load(f)
+    except FileNotFoundError: return None
+    except Exception as e_manifest: print(f"[Snapshot] manifest 読込失敗 (無効として扱います): {e_manifest}"); return None
+
+def valid_snapshot(model_ids, snapshot_dir=SNAPSHOT_DIR):
+    """model_ids に一致する完全なスナップショットがあれば manifest を返す。なければ None。"""
+    manifest = load_manifest(snapshot_dir)
+    if not manifest: return None
+    if {k: manifest.get(k) for k in ("format", "models")} != snapshot_key(model_ids):
+        print(f"[Snapshot] モデルIDが変わったためスナップショットを無効化: {manifest.get('models')} -> {model_ids}"); return None
+    if not manifest.get("dir"): return None
+    for rel in manifest.get("files", []):
+        if not (generation_dir(manifest, snapshot_dir) / rel).exists(): print(f"[Snapshot] ファイル欠落のためスナップショットを無効化: {rel}"); return None
+    return manifest
+
+def invalidate(manifest=None, snapshot_dir=SNAPSHOT_DIR):
+    """manifest を削除する。manifest を渡した場合は、その世代がまだ現行のときだけ (他プロセスが書き直した新しい世代は消さない)。"""
+    if manifest is not None and (load_manifest(snapshot_dir) or {}).get("dir") != manifest.get("dir"): return
+    (Path(snapshot_dir) / MANIFEST_FILENAME).unlink(missing_ok=True)
+
+def generation_dir(manifest, snapshot_dir=SNAPSHOT_DIR): return Path(snapshot_dir) / manifest["dir"]
+def processor_dir(manifest, snapshot_dir=SNAPSHOT_DIR): return generation_dir(manifest, snapshot_dir) / PROCESSOR_SUBDIR
+def predictor_dir(manifest, snapshot_dir=SNAPSHOT_DIR): return generation_dir(manifest, snapshot_dir) / PREDICTOR_SUBDIR
+
+def _library_versions():
+    versions = {}
+    for name in ("torch", "transformers", "aesthetics_predictor", "safetensors"):
+        try:
+            from importlib.metadata import version
+            versions[name] = version({"aesthetics_predictor": "simple-aesthetics-predictor"}.get(name, name))
+        except Exception: versions[name] = None
+    return versions
+
+def write_snapshot(model_ids, processor, clip_config, predictor, snapshot_dir=SNAPSHOT_DIR):
+    """
+    ロード済みの processor / clip_config / predictor を新しい世代ディレクトリに書き出し、manifest を原子的に差し替えて切り替える。
+    途中で失敗しても、読み込み中の他プロセスがいても、現行のスナップショットには触れない。
+    """
+    snapshot_dir = Path(snapshot_dir); snapshot_dir.mkdir(parents=True, exist_ok=True); previous = load_manifest(snapshot_dir) or {}
+    name = f"{GENERATION_PREFIX}{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"; gen_dir = snapshot_dir / name
+    try:
+        processor.save_pretrained(str(gen_dir / PROCESSOR_SUBDIR)); clip_config.save_pretrained(str(gen_dir / PROCESSOR_SUBDIR))
+        predictor.save_pretrained(str(gen_dir / PREDICTOR_SUBDIR), safe_serialization=True)
+    except BaseException: shutil.rmtree(gen_dir, ignore_errors=True); raise
+    files = sorted(str(p.relative_to(gen_dir)).replace(os.sep, "/") for p in gen_dir.rglob("*") if p.is_file())
+    manifest = {**snapshot_key(model_ids), "dir": name,
+                "revisions": {"clip": getattr(clip_config, "_commit_hash", None), "aesthetic_predictor": getattr(getattr(predictor, "config", None), "_commit_hash", None)},
+                "libraries": _library_versions(), "files": files,
+                "size_mb": round(sum((gen_dir / f).stat().st_size for f in files) / 2**20, 1),
+                "created": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+    tmp_path = snapshot_dir / f"{MANIFEST_FILENAME}.{name}.tmp"  # 書き込むプロセスごとに別の一時ファイル
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, snapshot_dir / MANIFEST_FILENAME)
+    _remove_old_generations(snapshot_dir, {name, previous.get("dir")})
+    print(f"[Snapshot] モデルスナップショットを保存: {gen_dir} ({manifest['size_mb']} MB)")
+    return manifest
+
+def _remove_old_generations(snapshot_dir, keep):
+    """現行と直前の世代 (読み込み中のプロセスがいるかもしれない) 以外で、STALE_GENERATION_SEC より古い世代と旧形式のディレクトリを消す。"""
+    now = time.time()
+    for path in Path(snapshot_dir).iterdir():
+        if not path.is_dir() or path.name in keep: continue
+        if path.name in (PROCESSOR_SUBDIR, PREDICTOR_SUBDIR) or (path.name.startswith(GENERATION_PREFIX) and now - path.stat().st_mtime > STALE_GENERATION_SEC):
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,97 @@
+# app/onnx_aesthetic.py
+# Aesthetic Predictor (CLIP ViT-L/14 画像タワー + Aesthetic ヘッド) の ONNX Runtime int8 バックエンド。
+# 初回に PyTorch モデルを ONNX へエクスポートし、動的 int8 量子化したものを
+# models/aesthetic_models_cache/onnx/ にキャッシュします。2 回目以降は PyTorch の重みをロードせずに起動できます。
+import re
+from pathlib import Path
+
+import numpy as np
+
+ONNX_OPSET_VERSION = 17
+
+def _safe_name(model_id):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", model_id)
+
+def int8_model_path(cache_dir, model_id):
+    return Path(cache_dir) / "onnx" / f"{_safe_name(model_id)}.int8.onnx"
+
+def head_state_path(cache_dir, model_id):
+    """エクスポート時に保存するヘッド重み (ONNX 使用中でも「ヘッドのみ再スコア」の current ヘッドに使う)。"""
+    return Path(cache_dir) / "onnx" / f"{_safe_name(model_id)}.head.npz"
+
+class OnnxAestheticRunner:
+    """int8 ONNX モデルを ONNX Runtime (CPU) で実行する。run(pixel_values (N,3,H,W) float32) -> (logits (N,1), 埋め込み (N,D) or None)"""
+    def __init__(self, model_path, intra_op_threads=0):
+        import onnxruntime as ort
+        options = ort.SessionOptions(); options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads and intra_op_threads > 0: options.intra_op_num_threads = int(intra_op_threads)
+        options.inter_op_num_threads = 1
+        self.model_path = Path(model_path)
+        self.session = ort.InferenceSession(str(model_path), sess_options=options, providers=["CPUExecutionProvider"])
+        self.output_names = [o.name for o in self.session.get_outputs()]
+        self.has_embeddings = "image_embeds" in self.output_names
+
+    def run(self, pixel_values):
+        outputs = self.session.run(None, {"pixel_values": np.ascontiguousarray(pixel_values, dtype=np.float32)})
+        named = dict(zip(self.output_names, outputs))
+        return named["logits"], named.get("image_embeds")
+
+def _save_head_state(predictor, torch, path):
+    layers = getattr(predictor, "layers", None)
+    if layers is None: return
+    state = {f"layers.{k}": v.detach().float().cpu().numpy() for k, v in layers.state_dict().items()}
+    state["__relu__"] = np.array(any(isinstance(m, torch.nn.ReLU) for m in layers.modules()))
+    np.savez(path, **state)
+
+def export_int8(predictor, torch, input_size, model_path, head_path):
+    """predictor を ONNX (fp32) にエクスポートし、動的 int8 量子化して model_path に保存する。"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    model_path = Path(model_path); model_path.parent.mkdir(parents=True, exist_ok=True)
+    fp32_path = model_path.with_name(model_path.name.replace(".int8.onnx", ".fp32.onnx"))
+    height, width = input_size
+    dummy = torch.zeros(1, 3, height, width, dtype=torch.float32)
+    original_device = next(predictor.parameters()).device
+    predictor = predictor.to("cpu").eval()
+    with torch.no_grad(): probe = predictor(pixel_values=dummy)
+    with_embeds = torch.is_tensor(getattr(probe, "hidden_states", None)) and probe.hidden_states.dim() == 2
+
+    class _ExportWrapper(torch.nn.Module):
+        def __init__(self, inner): super().__init__(); self.inner = inner
+        def forward(self, pixel_values):
+            out = self.inner(pixel_values=pixel_values)
+            return (out.logits, out.hidden_states) if with_embeds else (out.logits,)
+
+    output_names = ["logits", "image_embeds"] if with_embeds else ["logits"]
+    try:
+        with torch.no_grad():
+            torch.onnx.export(_ExportWrapper(predictor), (dummy,), str(fp32_path), input_names=["pixel_values"], output_names=output_names,
+                              dynamic_axes={name: {0: "batch"} for name in ["pixel_values", *output_names]},
+                              opset_version=ONNX_OPSET_VERSION, do_constant_folding=True)
+        quantize_dynamic(str(fp32_path), str(model_path), weight_type=QuantType.QInt8)
+        _save_head_state(predictor, torch, head_path)
+    finally:
+        fp32_path.unlink(missing_ok=True)  # fp32 版 (約 1.2GB) は量子化後に不要
+        predictor.to(original_device)
+    return model_path
+
+def load_or_build(cache_dir, model_id, intra_op_threads=0, predictor=None, torch=None, input_size=(224, 224)):
+    """
+    キャッシュ済み int8 モデルがあれば開き、なければ predictor からエクスポートしてから開く。
+    predictor なしでキャッシュもない場合は None。
+    """
+    model_path = int8_model_path(cache_dir, model_id)
+    if not model_path.exists():
+        if predictor is None or torch is None: return None
+        print(f"[ONNX] Aesthetic モデルを ONNX int8 にエクスポート中 (初回のみ、数分かかります): {model_path.name}")
+        export_int8(predictor, torch, input_size, model_path, head_state_path(cache_dir, model_id))
+    runner = OnnxAestheticRunner(model_path, intra_op_threads)
+    print(f"[ONNX] Aesthetic int8 モデルをロード: {model_path.name} (スレッド: {intra_op_threads or '自動'})")
+    return runner
+
+def load_head_state(cache_dir, model_id):
+    """保存済みヘッド重み ({"layers.*": ndarray}, relu) 。なければ None。"""
+    path = head_state_path(cache_dir, model_id)
+    if not path.exists(): return None
+    with np.load(path) as npz:
+        state = {k: npz[k] for k in npz.files if k != "__relu__"}; relu = bool(npz["__relu__"]) if "__relu__" in npz.files else False
+    return state, relu
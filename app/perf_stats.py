@@ -0,0 +1,137 @@
+# app/perf_stats.py
+# スコアリング経路のステージ別処理時間の計測。
+# 画像 1 枚あたりの所要時間をステージごとの直近ウィンドウに記録し、p50/p95/p99 とスループットを求めます。
+# 集計結果は logs/perf_stats.jsonl に 1 行 1 レコードで追記し、ステータスバーにも要約を表示します。
+import datetime
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+BASE_DIR_PERF_STATS = Path(__file__).resolve().parent.parent
+PERF_LOG_PATH = BASE_DIR_PERF_STATS / "logs" / "perf_stats.jsonl"
+PERF_STATS_ENABLED = True
+PERF_WINDOW = 2048              # ステージごとに保持する直近サンプル数 (画像単位)
+PERF_THROUGHPUT_WINDOW_SEC = 60.0
+PERF_LOG_INTERVAL_SEC = 30.0    # maybe_flush でのログ追記間隔
+STAGES = ("open", "metadata", "decode", "clip_preprocess", "cascade_cheap_inference", "clip_inference", "ddb_resize", "ddb_inference", "thumbnail", "persist")
+STAGE_LABELS = {"open": "オープン", "metadata": "メタデータ", "decode": "デコード", "clip_preprocess": "CLIP前処理", "cascade_cheap_inference": "簡易CLIP推論",
+                "clip_inference": "CLIP推論", "ddb_resize": "DDBリサイズ", "ddb_inference": "DDB推論", "thumbnail": "サムネイル", "persist": "保存"}
+
+class PerfStats:
+    """
+    ステージ名 -> 直近 PERF_WINDOW 件の 1 枚あたり秒数。バッチ処理のステージは所要時間を枚数で割って枚数分記録する。
+    時間を持たない事象 (カスケードで ViT-L を省いた枚数など) は count() で名前ごとの累計に数える。
+    スレッドセーフ (デコードワーカー・推論・保存の各スレッドから同時に呼ばれる)。
+    """
+    def __init__(self, window=PERF_WINDOW):
+        self._lock = threading.Lock(); self.window = window
+        self._samples = {stage: deque(maxlen=window) for stage in STAGES}; self._totals = {stage: [0, 0.0] for stage in STAGES}
+        self._completions = deque(); self.images_done = 0; self._last_flush = time.monotonic(); self._counters = {}
+        self.export_enabled = False; self._pending_export = []  # export_enabled: drain_samples 用に記録を溜める (プールのワーカーのみ)
+
+    def record(self, stage, seconds, n=1):
+        if not PERF_STATS_ENABLED or n <= 0: return
+        per_image = seconds / n
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None: samples = self._samples[stage] = deque(maxlen=self.window); self._totals[stage] = [0, 0.0]
+            samples.extend([per_image] * min(n, self.window)); self._totals[stage][0] += n; self._totals[stage][1] += seconds
+            if self.export_enabled: self._pending_export.append((stage, seconds, n))
+
+    def count(self, name, n=1):
+        if not PERF_STATS_ENABLED or n <= 0: return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+            if self.export_enabled: self._pending_export.append((name, None, n))  # 秒数 None はカウンター
+
+    @contextmanager
+    def timed(self, stage, n=1):
+        start = time.perf_counter()
+        try: yield
+        finally: self.record(stage, time.perf_counter() - start, n)
+
+    def image_done(self, n=1):
+        if not PERF_STATS_ENABLED: return
+        now = time.monotonic()
+        with self._lock:
+            self.images_done += n; self._completions.append((now, n))
+            while self._completions and now - self._completions[0][0] > PERF_THROUGHPUT_WINDOW_SEC: self._completions.popleft()
+
+    def drain_samples(self):
+        """前回の drain 以降の記録 [(stage, 秒, 枚数), ...] を取り出す (プロセスプールのワーカーから親へ返す用)。カウンターは秒が None。"""
+        with self._lock: samples, self._pending_export = self._pending_export, []
+        return samples
+
+    def merge_samples(self, samples):
+        for stage, seconds, n in samples or []:
+            if seconds is None: self.count(stage, n)
+            else: self.record(stage, seconds, n)
+
+    def throughput(self):
+        """直近 PERF_THROUGHPUT_WINDOW_SEC 秒の処理枚数/秒。"""
+        with self._lock:
+            if not self._completions: return 0.0
+            span = max(time.monotonic() - self._completions[0][0], 1.0)
+            return sum(n for _, n in self._completions) / span
+
+    def summary(self):
+        """{"stages": {stage: {count, mean_ms, p50_ms, p95_ms, p99_ms}}, "counters": {name: 累計}, "throughput_ips", "images_done"}"""
+        with self._lock:
+            snapshot = {stage: (np.fromiter(s, dtype=np.float64, count=len(s)), self._totals[stage][0]) for stage, s in self._samples.items() if s}; counters = dict(self._counters)
+        stages = {}
+        for stage, (arr, count) in snapshot.items():
+            p50, p95, p99 = np.percentile(arr, [50, 95, 99]) * 1000.0
+            stages[stage] = {"count": int(count), "mean_ms": round(float(arr.mean()) * 1000.0, 2), "p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2)}
+        return {"stages": stages, "counters": counters, "throughput_ips": round(self.throughput(), 2), "images_done": self.images_done}
+
+    def status_text(self, top=3):
+        """ステータスバー用の 1 行要約 (p50 が大きいステージ上位 top 件)。"""
+        summary = self.summary()
+        if not summary["stages"]: return ""
+        slowest = sorted(summary["stages"].items(), key=lambda kv: kv[1]["p50_ms"], reverse=True)[:top]
+        parts = [f"{STAGE_LABELS.get(stage, stage)} {s['p50_ms']:.0f}/{s['p95_ms']:.0f}ms" for stage, s in slowest]
+        return f"{summary['throughput_ips']:.1f}枚/s | " + " | ".join(parts) + " (p50/p95)"
+
+    def table_text(self):
+        """診断表示用の全ステージ表。"""
+        summary = self.summary()
+        lines = [f"処理済み: {summary['images_done']}枚 / スループット: {summary['throughput_ips']:.2f}枚/s (直近{PERF_THROUGHPUT_WINDOW_SEC:.0f}秒)", "",
+                 f"{'ステージ':<12}{'件数':>8}{'平均':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms/枚)"]
+        for stage in [s for s in STAGES if s in summary["stages"]] + [s for s in summary["stages"] if s not in STAGES]:
+            s = summary["stages"][stage]
+            lines.append(f"{STAGE_LABELS.get(stage, stage):<12}{s['count']:>8}{s['mean_ms']:>10.1f}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}")
+        return "\n".join(lines)
+
+    def flush(self, path=PERF_LOG_PATH, reason="interval"):
+        """現在の集計を JSONL に 1 行追記する。"""
+        summary = self.summary(); self._last_flush = time.monotonic()
+        if not summary["stages"]: return
+        record = {"timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(), "reason": reason, **summary}
+        try:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f: f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e_flush: print(f"[PerfStats] ログ書込失敗: {e_flush}")
+
+    def maybe_flush(self, path=PERF_LOG_PATH):
+        if time.monotonic() - self._last_flush >= PERF_LOG_INTERVAL_SEC: self.flush(path)
+
+    def reset(self):
+        with self._lock:
+            for samples in self._samples.values(): samples.clear()
+            for stage in self._totals: self._totals[stage] = [0, 0.0]
+            self._completions.clear(); self.images_done = 0; self._pending_export = []; self._counters = {}
+
+_stats_instance = PerfStats()
+
+def get_perf_stats():
+    """プロセス内で共有する計測器。"""
+    return _stats_instance
+
+def timed(stage, n=1): return _stats_instance.timed(stage, n)
+def record(stage, seconds, n=1): _stats_instance.record(stage, seconds, n)
+def count(name, n=1): _stats_instance.count(name, n)
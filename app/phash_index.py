@@ -0,0 +1,176 @@
+# app/phash_index.py
+# 画像の知覚ハッシュ (64bit dHash) と、ハミング距離で近い画像を引くマルチインデックス。
+# 同じシードの hires-fix 有無・再保存・形式変換などの「ほぼ同じ画像」を見つけ、
+# スコア済み画像のスコアを流用したり (scoring.NEAR_DUP_MODE)、重複一覧を出したりするのに使います。
+# キーは内容ハッシュ (score_data["content_hash"])。cache/phash_index.npz に保存します。
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+BASE_DIR_PHASH_INDEX = Path(__file__).resolve().parent.parent
+PHASH_INDEX_PATH = BASE_DIR_PHASH_INDEX / "cache" / "phash_index.npz"
+HASH_BITS = 64
+MAX_INDEXED_RADIUS = 5  # この距離までは鳩の巣原理で取りこぼしなし (ハッシュを MAX_INDEXED_RADIUS + 1 個の部分に分割)
+PHASH_KEY = "phash"     # score_data に保存する 16 桁の 16 進文字列
+
+def dhash(img, hash_size=8):
+    """差分ハッシュ: グレースケール (hash_size+1)×hash_size に縮小し、横に隣り合う画素の大小を 64bit に詰める。"""
+    small = np.asarray(img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BOX, reducing_gap=2.0), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).reshape(-1)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def phash_to_hex(value): return f"{int(value):016x}"
+def phash_from_hex(text): return int(text, 16)
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(values): return np.bitwise_count(values).astype(np.int64)
+else:
+    _POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+    def _popcount(values):
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        return _POPCOUNT8[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def _chunk_layout(n_chunks, bits=HASH_BITS):
+    """64bit を n_chunks 個の (shift, mask) に分割 (ビット数はできるだけ均等)。"""
+    sizes = [bits // n_chunks + (1 if i < bits % n_chunks else 0) for i in range(n_chunks)]; layout = []; shift = bits
+    for size in sizes: shift -= size; layout.append((shift, (1 << size) - 1))
+    return layout
+
+class PerceptualHashIndex:
+    """
+    マルチインデックスハッシング: ハッシュを MAX_INDEXED_RADIUS + 1 個の部分に分け、部分ごとに {部分値: [行]} を持つ。
+    距離 r <= MAX_INDEXED_RADIUS の近傍はどれかの部分が完全一致するので、その候補だけをハミング距離で確認すれば済む。
+    それより大きい r は全件をベクトル演算で走査する。
+    """
+    def __init__(self, path=PHASH_INDEX_PATH):
+        self.path = Path(path); self._lock = threading.Lock(); self._layout = _chunk_layout(MAX_INDEXED_RADIUS + 1)
+        self._keys = []; self._row_of = {}; self._hashes = np.zeros(0, dtype=np.uint64); self._n = 0
+        self._buckets = [dict() for _ in self._layout]; self.dirty = False
+
+    def __len__(self):
+        with self._lock: return len(self._row_of)
+
+    def __contains__(self, key):
+        with self._lock: return key in self._row_of
+
+    def load(self):
+        if not self.path.exists(): return self
+        try:
+            with np.load(self.path, allow_pickle=False) as npz: keys = [str(k) for k in npz["keys"]]; hashes = npz["hashes"].astype(np.uint64)
+            if len(keys) != len(hashes): raise ValueError("キーとハッシュの数が一致しません")
+        except Exception as e_load: print(f"[PHashIndex] {self.path.name} の読込失敗 (空のインデックスで続行): {e_load}"); return self
+        with self._lock:
+            self._keys = []; self._row_of = {}; self._hashes = np.zeros(0, dtype=np.uint64); self._n = 0; self._buckets = [dict() for _ in self._layout]
+            for key, value in zip(keys, hashes.tolist()): self._add_locked(key, value)
+            self.dirty = False
+        return self
+
+    def save(self):
+        with self._lock:
+            if not self.dirty: return
+            live = [(k, r) for k, r in self._row_of.items()]
+            keys = np.array([k for k, _ in live], dtype=str); hashes = self._hashes[[r for _, r in live]] if live else np.zeros(0, dtype=np.uint64)
+            self.path.parent.mkdir(parents=True, exist_ok=True); tmp_path = self.path.with_suffix(".tmp")
+            try:
+                with open(tmp_path, "wb") as f: np.savez(f, keys=keys, hashes=hashes)
+                os.replace(tmp_path, self.path); self.dirty = False
+            except Exception as e_save: print(f"[PHashIndex] {self.path.name} の保存失敗: {e_save}")
+
+    def _add_locked(self, key, value):
+        value = int(value); row = self._row_of.get(key)
+        if row is not None:
+            if int(self._hashes[row]) == value: return
+            self._remove_locked(key)
+        if self._n >= len(self._hashes): self._hashes = np.concatenate([self._hashes, np.zeros(max(1024, len(self._hashes)), dtype=np.uint64)])
+        row = self._n; self._n += 1; self._hashes[row] = value; self._keys.append(key); self._row_of[key] = row
+        for bucket, (shift, mask) in zip(self._buckets, self._layout): bucket.setdefault((value >> shift) & mask, []).append(row)
+        self.dirty = True
+
+    def _remove_locked(self, key):
+        row = self._row_of.pop(key, None)
+        if row is None: return
+        value = int(self._hashes[row])
+        for bucket, (shift, mask) in zip(self._buckets, self._layout):
+            rows = bucket.get((value >> shift) & mask)
+            if rows:
+                try: rows.remove(row)
+                except ValueError: pass
+        self.dirty = True  # 行は欠番のまま (save/load で詰まる)
+
+    def add(self, key, value):
+        """key (content_hash) の知覚ハッシュを登録/更新。key か value がなければ何もしない。"""
+        if not key or value is None: return
+        with self._lock: self._add_locked(key, value)
+
+    def remove(self, key):
+        with self._lock: self._remove_locked(key)
+
+    def get(self, key):
+        with self._lock:
+            row = self._row_of.get(key)
+            return None if row is None else int(self._hashes[row])
+
+    def query(self, value, max_distance, exclude=None):
+        """value から max_distance 以内の [(key, 距離), ...] を距離順に返す。exclude の key は除く。"""
+        value = int(value)
+        with self._lock:
+            if not self._row_of: return []
+            if max_distance <= MAX_INDEXED_RADIUS:
+                rows = set()
+                for bucket, (shift, mask) in zip(self._buckets, self._layout): rows.update(bucket.get((value >> shift) & mask, ()))
+                rows = np.fromiter(rows, dtype=np.int64, count=len(rows))
+            else: rows = np.fromiter(self._row_of.values(), dtype=np.int64, count=len(self._row_of))
+            if not len(rows): return []
+            dist = _popcount(self._hashes[rows] ^ np.uint64(value)); hit = dist <= max_distance
+            found = sorted(zip(dist[hit].tolist(), rows[hit].tolist()))
+            keys = self._keys; row_of = self._row_of
+            return [(keys[r], d) for d, r in found if row_of.get(keys[r]) == r and keys[r] != exclude]
+
+    def duplicate_pairs(self, max_distance):
+        """距離 max_distance 以内の全ペア [(key_a, key_b, 距離), ...]。max_distance は MAX_INDEXED_RADIUS まで。"""
+        if max_distance > MAX_INDEXED_RADIUS: raise ValueError(f"重複一覧の距離は {MAX_INDEXED_RADIUS} 以下にしてください")
+        with self._lock:
+            rows = np.fromiter(self._row_of.values(), dtype=np.int64, count=len(self._row_of)); hashes = self._hashes[rows]; keys = self._keys
+        if len(rows) < 2: return []
+        found_a = []; found_b = []
+        for shift, mask in self._layout:
+            # 部分値でソートし、同じ部分値のグループ内で i と i+d を比べる (d を増やしながら、グループ内に相手が残る位置だけ)
+            part = (hashes >> np.uint64(shift)) & np.uint64(mask); order = np.argsort(part, kind="stable"); sorted_part = part[order]
+            group_end = np.searchsorted(sorted_part, sorted_part, side="right"); active = np.flatnonzero(group_end - np.arange(len(order)) > 1); d = 1
+            while len(active):
+                a = order[active]; b = order[active + d]
+                close = _popcount(hashes[a] ^ hashes[b]) <= max_distance
+                found_a.append(a[close]); found_b.append(b[close])
+                d += 1; active = active[group_end[active] > active + d]
+        if not found_a: return []
+        a = np.concatenate(found_a); b = np.concatenate(found_b)
+        lo = np.minimum(a, b); hi = np.maximum(a, b); pair_ids = np.unique(lo * len(rows) + hi)
+        lo = pair_ids // len(rows); hi = pair_ids % len(rows); dist = _popcount(hashes[lo] ^ hashes[hi])
+        return [(keys[rows[i]], keys[rows[j]], int(dd)) for i, j, dd in zip(lo.tolist(), hi.tolist(), dist.tolist())]
+
+    def duplicate_groups(self, max_distance):
+        """duplicate_pairs を連結成分にまとめた [[key, ...], ...] (大きいグループ順)。"""
+        parent = {}
+        def find(x):
+            while parent.get(x, x) != x: parent[x] = parent.get(parent[x], parent[x]); x = parent[x]
+            return x
+        for a, b, _ in self.duplicate_pairs(max_distance):
+            ra, rb = find(a), find(b)
+            if ra != rb: parent[ra] = rb
+        groups = {}
+        for key in parent: groups.setdefault(find(key), []).append(key)
+        for root in list(groups):
+            if root not in groups[root]: groups[root].append(root)
+        return sorted((sorted(g) for g in groups.values()), key=len, reverse=True)
+
+_index_instance = None; _index_instance_lock = threading.Lock()
+
+def get_phash_index():
+    """プロセス内で共有するインデックス (初回呼び出し時にディスクから読込)。"""
+    global _index_instance
+    with _index_instance_lock:
+        if _index_instance is None: _index_instance = PerceptualHashIndex(PHASH_INDEX_PATH).load()
+        return _index_instance
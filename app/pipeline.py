@@ -0,0 +1,171 @@
+# app/pipeline.py
+# 取り込みパイプライン: デコード/前処理 → 推論 → サムネイル/保存 を別スレッドで重ねて実行します。
+# ステージ間は上限付きキューで接続するため、同時に保持するデコード済み画像の数も上限が決まります。
+import queue
+import threading
+from pathlib import Path
+
+from . import scoring as scoring_module
+from .ingest import ImageIngest
+
+PIPELINE_DECODE_WORKERS = 3       # デコード/前処理ワーカー数
+PIPELINE_READY_QUEUE_SIZE = 32    # 前処理済み → 推論 のキュー上限 (枚)
+PIPELINE_PERSIST_QUEUE_SIZE = 16  # 推論済み → サムネイル/保存 のキュー上限 (枚)
+PIPELINE_BATCH_WAIT_SEC = 0.05    # バッチが埋まるまで推論ステージが待つ最大時間
+
+_END = object()  # ステージ終端マーカー
+
+class _PipelineItem:
+    __slots__ = ("path", "ingest", "metadata", "model_inputs", "score_data", "content_hash", "cached_entry", "phash", "near_duplicate")
+    def __init__(self, path, decode_target_size=None):
+        self.path = Path(path); self.ingest = ImageIngest(path, decode_target_size)
+        self.metadata = None; self.model_inputs = None; self.score_data = None
+        self.content_hash = None; self.cached_entry = None; self.phash = None; self.near_duplicate = None
+
+class IngestPipeline:
+    """
+    画像パスのリストを 3 ステージで処理します。
+      1. デコード/前処理 (PIPELINE_DECODE_WORKERS スレッド): 1 回デコードしてメタデータ抽出とモデル入力作成
+      2. 推論 (1 スレッド): 前処理済みの画像をバッチにまとめて scoring.score_ingested_batch
+      3. サムネイル/保存 (1 スレッド): サムネイル生成後に on_result(image_id, score_data, metadata) を呼ぶ
+    on_progress(done, total) は各画像の完了 (存在しないファイルのスキップを含む) ごとに呼ばれます。
+    stop() で全ステージが途中終了します。1 枚の読込や on_result の失敗はその画像だけ failed_paths に記録して続け、
+    ステージ自体が例外で落ちた場合 (推論の OOM 等) は error に記録して全ステージを止めます。
+    """
+    def __init__(self, image_paths, penalties_config, thumbnail_dir=None, batch_size=None,
+                 decode_workers=None, ready_queue_size=None, persist_queue_size=None,
+                 on_result=None, on_progress=None, use_cache=True):
+        self.image_paths = [str(p) for p in image_paths]; self.penalties_config = penalties_config
+        self.thumbnail_dir = thumbnail_dir
+        self.batch_size = max(1, int(batch_size or scoring_module.SCORING_BATCH_SIZE))
+        self.decode_workers = max(1, int(decode_workers or PIPELINE_DECODE_WORKERS))
+        self.on_result = on_result; self.on_progress = on_progress; self.use_cache = use_cache  # False: スコアキャッシュ・近似重複を使わず推論する (対話的な再スコア)
+        self.decode_target_size = scoring_module.decode_target_size()  # 縮小デコードの目標 (モデル初期化後に決まる)
+        self._input_q = queue.Queue()
+        self._ready_q = queue.Queue(maxsize=max(1, int(ready_queue_size or PIPELINE_READY_QUEUE_SIZE)))
+        self._persist_q = queue.Queue(maxsize=max(1, int(persist_queue_size or PIPELINE_PERSIST_QUEUE_SIZE)))
+        self._stop_event = threading.Event()
+        self._progress_lock = threading.Lock(); self._done = 0; self.total = len(self.image_paths)
+        self.failed_paths = []; self.error = None
+
+    def stop(self): self._stop_event.set()
+    @property
+    def stopped(self): return self._stop_event.is_set()
+
+    def run(self):
+        """全ステージを起動し、完了 (または stop) まで待ちます。処理した画像数を返します。"""
+        for path_str in self.image_paths: self._input_q.put(path_str)
+        threads = [threading.Thread(target=self._run_stage, args=("デコード", self._decode_worker), name=f"ingest-decode-{i}", daemon=True) for i in range(self.decode_workers)]
+        threads.append(threading.Thread(target=self._run_stage, args=("推論", self._inference_stage), name="ingest-inference", daemon=True))
+        threads.append(threading.Thread(target=self._run_stage, args=("保存", self._persist_stage), name="ingest-persist", daemon=True))
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self._drain()
+        return self._done
+
+    def _run_stage(self, name, stage):
+        """ステージ本体を実行する。例外で落ちたら記録して全ステージを止める (他のステージがキューで待ち続けないように)。"""
+        try: stage()
+        except Exception as e_stage:
+            print(f"[Pipeline] {name}ステージが異常終了したため処理を中止します: {e_stage}")
+            with self._progress_lock:
+                if self.error is None: self.error = f"{name}: {e_stage}"
+            self._stop_event.set()
+
+    def _item_failed(self, path_str, stage, error):
+        print(f"[Pipeline] {Path(path_str).name}: {stage}に失敗したためスキップします: {error}")
+        with self._progress_lock: self.failed_paths.append(str(path_str))
+        self._advance()
+
+    def _put(self, q, item):
+        while not self._stop_event.is_set():
+            try: q.put(item, timeout=0.2); return True
+            except queue.Full: continue
+        if isinstance(item, _PipelineItem): item.ingest.close()
+        return False
+
+    def _advance(self, n=1):
+        with self._progress_lock: self._done += n; done = self._done
+        if self.on_progress: self.on_progress(done, self.total)
+
+    def _decode_worker(self):
+        try:
+            while not self._stop_event.is_set():
+                try: path_str = self._input_q.get_nowait()
+                except queue.Empty: break
+                if not Path(path_str).exists(): self._advance(); continue
+                item = _PipelineItem(path_str, self.decode_target_size)
+                try:
+                    item.content_hash = scoring_module.compute_content_hash(path_str)
+                    item.cached_entry = scoring_module.lookup_cached_scores([item.content_hash]).get(item.content_hash) if self.use_cache else None
+                    if item.cached_entry is not None: item.metadata = item.cached_entry["metadata"]  # 推論・前処理不要
+                    else:
+                        item.metadata = scoring_module.extract_metadata_from_image(path_str, ingest=item.ingest)
+                        item.phash = scoring_module.compute_phash(item.ingest); near = scoring_module.find_near_duplicate(item.phash, item.content_hash) if self.use_cache else None
+                        if near: item.cached_entry = near[0]; item.near_duplicate = (near[1], near[2])  # 近似重複: 推論せずスコアを流用
+                        elif item.ingest.rgb is not None: item.model_inputs = scoring_module.preprocess_for_models(item.ingest.rgb)
+                except Exception as e_item:  # 1 枚の失敗でワーカーごと落とさない (残りの入力を取りこぼさない)
+                    item.ingest.close(); self._item_failed(path_str, "読込", e_item); continue
+                if not self._put(self._ready_q, item): break
+        finally: self._put(self._ready_q, _END)
+
+    def _next_batch(self, ends_seen):
+        batch = []
+        while not batch and not self._stop_event.is_set() and ends_seen < self.decode_workers:
+            try: item = self._ready_q.get(timeout=0.2)
+            except queue.Empty: continue
+            if item is _END: ends_seen += 1
+            else: batch.append(item)
+        waited = 0.0
+        while batch and len(batch) < self.batch_size and ends_seen < self.decode_workers and waited < PIPELINE_BATCH_WAIT_SEC:
+            try: item = self._ready_q.get(timeout=0.01)
+            except queue.Empty: waited += 0.01; continue
+            if item is _END: ends_seen += 1
+            else: batch.append(item)
+        return batch, ends_seen
+
+    def _inference_stage(self):
+        ends_seen = 0
+        try:
+            while not self._stop_event.is_set():
+                batch, ends_seen = self._next_batch(ends_seen)
+                if not batch:
+                    if ends_seen >= self.decode_workers: break
+                    continue
+                to_score = [it for it in batch if it.cached_entry is None]; scores = {}; extras = {}
+                if to_score:
+                    scored_extras = []
+                    scored = scoring_module.score_ingested_batch([it.ingest for it in to_score], [it.model_inputs for it in to_score], self.penalties_config, extras_out=scored_extras)
+                    scoring_module.store_cached_scores([it.content_hash for it in to_score], scored, [it.metadata for it in to_score], scored_extras)
+                    scores = {id(it): s for it, s in zip(to_score, scored)}; extras = {id(it): e for it, e in zip(to_score, scored_extras)}
+                for item in batch:
+                    item.model_inputs = None  # 前処理済み配列はここで解放
+                    from_cache = item.cached_entry is not None
+                    if from_cache: score = scoring_module.score_from_cache(item.cached_entry, self.penalties_config); item_extras = {"tag_probs": item.cached_entry.get("tag_probs"), "near_duplicate": item.near_duplicate}
+                    else: score = scores[id(item)]; item_extras = extras[id(item)]
+                    item_extras["phash"] = item.phash
+                    item.score_data = scoring_module.annotate_cache_fields(scoring_module.build_score_data(item.path, *score), item.content_hash, from_cache, item_extras)
+                    if not self._put(self._persist_q, item): return
+        finally: self._put(self._persist_q, _END)
+
+    def _persist_stage(self):
+        while not self._stop_event.is_set():
+            try: item = self._persist_q.get(timeout=0.2)
+            except queue.Empty: continue
+            if item is _END: break
+            try:
+                try:
+                    if self.thumbnail_dir is not None: scoring_module.attach_thumbnail(item.score_data, self.thumbnail_dir, ingest=item.ingest)
+                    for stage, err in item.ingest.errors.items(): print(f"[Pipeline] {item.path.name}: {stage} ステージ失敗: {err}")
+                finally: item.ingest.close()
+                if self.on_result: self.on_result(item.path.stem, item.score_data, item.metadata)
+            except Exception as e_item: self._item_failed(item.path, "保存", e_item); continue  # 書き出し先の失敗 (ディスク不足等) も 1 枚ずつ記録して続ける
+            self._advance()
+
+    def _drain(self):
+        """stop() 後にキューに残った画像のハンドルを閉じる。"""
+        for q in (self._ready_q, self._persist_q):
+            while True:
+                try: item = q.get_nowait()
+                except queue.Empty: break
+                if isinstance(item, _PipelineItem): item.ingest.close()
@@ -3,6 +3,9 @@ import os
 import json
 import datetime
 import time
+_STARTUP_T0 = time.perf_counter()  # 起動時間の内訳の基準 (できるだけ早く記録)
+import threading
+import multiprocessing
 import pandas as pd
 from pathlib import Path
 from PySide6.QtWidgets import (
@@ -13,8 +16,8 @@ from PySide6.QtWidgets import (
     QTextEdit, QProgressBar, QSpinBox, QDoubleSpinBox, QDialog,
     QDialogButtonBox, QSizePolicy, QInputDialog, QCheckBox, QFormLayout
 )
-from PySide6.QtGui import QPixmap, QIcon, QPainter, QAction, QDesktopServices, QColor, QBrush
-from PySide6.QtCore import Qt, QSize, QTimer, Signal, QThread, Slot, QUrl, QSettings
+from PySide6.QtGui import QPixmap, QIcon, QPainter, QAction, QDesktopServices, QColor, QBrush, QFontDatabase
+from PySide6.QtCore import Qt, QSize, QTimer, Signal, QThread, Slot, QUrl, QSettings, QFileSystemWatcher
 
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
@@ -46,47 +49,87 @@ LOG_DIR = BASE_DIR / "logs"
 MODELS_DIR = BASE_DIR / "models"
 
 from . import scoring as scoring_module
+from . import pipeline as pipeline_module
+from . import score_pool as score_pool_module
+from .tag_store import get_tag_store
+from .embedding_store import get_embedding_store
+from . import aesthetic_heads as aesthetic_heads_module
+from . import perf_stats as perf_stats_module
+from . import phash_index as phash_index_module
+from . import job_queue as job_queue_module
+from . import autotune as autotune_module
 from .fs_watcher import FileSystemWatcherThread, WATCHED_EXTENSIONS as FS_WATCHED_EXTENSIONS
 from . import sync as sync_module
 from . import analysis_dashboard as analysis_dashboard_module
-from .gemini_analyzer import GeminiAnalyzer
 
 scoring_module.WATCHED_EXTENSIONS = FS_WATCHED_EXTENSIONS
 
+# --- 起動時間の計測 ---
+STARTUP_TIMING_LOG_PATH = LOG_DIR / "startup_timing.log"
+_startup_marks = []
+def mark_startup(label): _startup_marks.append((label, time.perf_counter() - _STARTUP_T0))
+def log_startup_timing():
+    """起動から各段階までの経過時間と AI ライブラリ別の読込時間を表示し、logs/startup_timing.log に追記する。"""
+    lines = [f"  {label}: {elapsed:.2f}秒" for label, elapsed in _startup_marks]
+    lines += [f"  (内訳) {name} インポート: {elapsed:.2f}秒" for name, elapsed in scoring_module.BACKEND_LOAD_TIMES.items()]
+    report = f"[Startup] {datetime.datetime.now().isoformat(timespec='seconds')} 起動時間の内訳:\n" + "\n".join(lines)
+    print(report)
+    try:
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        with open(STARTUP_TIMING_LOG_PATH, 'a', encoding='utf-8') as f: f.write(report + "\n")
+    except Exception as e: print(f"起動時間ログ書込失敗: {e}")
+mark_startup("モジュール読込完了")
+
 # --- スレッド定義 ---
 class SyncThread(QThread): # 変更なし
     progress = Signal(int); finished = Signal(bool, str)
     def run(self): success, msg = sync_module.synchronize_all(progress_callback=self.progress); self.finished.emit(success, msg)
 
-class ScoringAndMetadataThread(QThread): # 変更なし
+class ScoringAndMetadataThread(QThread):
     progress = Signal(int, int); image_processed = Signal(str, dict, dict); finished = Signal()
-    def __init__(self, image_paths, penalties_config, parent=None):
+    def __init__(self, image_paths, penalties_config, use_cache=True, parent=None):
         super().__init__(parent); self.image_paths = image_paths; self.penalties_config = penalties_config
-        self._is_running = True
+        self.use_cache = use_cache; self._is_running = True; self.pipeline = None
     def run(self):
-        total = len(self.image_paths)
-        for i, path_str in enumerate(self.image_paths):
-            if not self._is_running: break
-            path_obj = Path(path_str)
-            if not path_obj.exists(): continue
-            img_id, score_d, meta_d = scoring_module.process_single_image(str(path_obj), self.penalties_config)
-            thumb_name = f"{img_id}.jpg"; thumb_p_str = str(IMAGES_THUMBNAILS_DIR / thumb_name)
-            if scoring_module.generate_thumbnail(str(path_obj), thumb_p_str):
-                score_d["thumbnail_path_local"] = thumb_p_str
-                score_d["thumbnail_web_path"] = f"cloude_image/thumbnails/{thumb_name}"
-            self.image_processed.emit(img_id, score_d, meta_d)
-            self.progress.emit(i + 1, total)
+        # デコード/前処理・推論・サムネイル生成を重ねて実行するパイプライン
+        self.pipeline = pipeline_module.IngestPipeline(
+            self.image_paths, self.penalties_config, thumbnail_dir=IMAGES_THUMBNAILS_DIR,
+            on_result=self.image_processed.emit, on_progress=self.progress.emit, use_cache=self.use_cache)
+        if self._is_running: self.pipeline.run()
         self.finished.emit()
-    def stop(self): self._is_running = False
+    def stop(self):
+        self._is_running = False
+        if self.pipeline: self.pipeline.stop()
 
-class ModelInitializationThread(QThread): # 変更なし
+class ScoringProcessPoolThread(QThread):
+    """ScoringAndMetadataThread と同じシグナルで、マルチプロセスプール (score_pool) に処理を委譲する。"""
+    progress = Signal(int, int); image_processed = Signal(str, dict, dict); finished = Signal()
+    def __init__(self, score_pool, image_paths, penalties_config, use_cache=True, parent=None):
+        super().__init__(parent); self.score_pool = score_pool; self.image_paths = image_paths
+        self.penalties_config = penalties_config; self.use_cache = use_cache; self._stop_event = threading.Event()
+    def run(self):
+        existing = [p for p in self.image_paths if Path(p).exists()]
+        total = len(self.image_paths); skipped = total - len(existing)
+        try:
+            self.score_pool.score(existing, self.penalties_config, thumbnail_dir=IMAGES_THUMBNAILS_DIR,
+                                  on_result=self.image_processed.emit, on_progress=lambda done, _: self.progress.emit(done + skipped, total),
+                                  stop_event=self._stop_event, runtime_settings=scoring_module.export_runtime_settings(), use_cache=self.use_cache)
+        except Exception as e: print(f"[ScorePool] スコアリングプールエラー: {e}")
+        self.finished.emit()
+    def stop(self): self._stop_event.set()
+
+class ModelInitializationThread(QThread):
     initialization_progress = Signal(str, int)
     initialization_finished = Signal(bool)
-    def __init__(self, force_cpu, parent=None):
-        super().__init__(parent); self.force_cpu = force_cpu
+    autotune_finished = Signal(dict, bool)  # (結果, 保存済みの結果を再利用したか)。initialization_finished より先に届く
+    def __init__(self, force_cpu, autotune_cached=None, parent=None):
+        super().__init__(parent); self.force_cpu = force_cpu; self.autotune_cached = autotune_cached
     def run(self):
         try:
             scoring_module.initialize_all_models(force_cpu=self.force_cpu, progress_callback=self.initialization_progress)
+            if autotune_module.AUTOTUNE_ENABLED and scoring_module.INITIALIZED_SUCCESSFULLY:
+                try: self.autotune_finished.emit(*autotune_module.tune_or_reuse(scoring_module, self.autotune_cached, progress_callback=self.initialization_progress))
+                except Exception as e_tune: print(f"[Autotune] 自動チューニング失敗 (設定値のまま): {e_tune}")
             self.initialization_finished.emit(scoring_module.INITIALIZED_SUCCESSFULLY if hasattr(scoring_module, 'INITIALIZED_SUCCESSFULLY') else True)
         except Exception as e:
             self.initialization_progress.emit(f"モデル初期化中に致命的エラー: {e}", 100)
@@ -99,6 +142,7 @@ class GeminiAnalysisRunnerThread(QThread): # 変更なし
         self.api_key = api_key; self.analyzer_instance = None
     def run(self):
         try:
+            from .gemini_analyzer import GeminiAnalyzer  # google.generativeai の読込は起動を遅らせるため解析時まで遅延
             self.analyzer_instance = GeminiAnalyzer(api_key_val=self.api_key)
             self.analyzer_instance.signals.analysis_progress.connect(self.analysis_progress)
             self.analyzer_instance.signals.analysis_finished.connect(self.analysis_finished)
@@ -136,13 +180,92 @@ class SettingsDialog(QDialog): # 変更なし
         penalties_layout.addWidget(QLabel(f"penalties.yml パス: {PENALTIES_YML_PATH}"))
         btn_open_pen = QPushButton("テキストエディタで penalties.yml を開く"); btn_open_pen.clicked.connect(self._open_penalties_file)
         penalties_layout.addWidget(btn_open_pen)
-        penalties_layout.addWidget(QLabel("変更は次回の画像処理時またはアプリ再起動時に反映。"))
+        penalties_layout.addWidget(QLabel("保存すると、保存済みのタグ確率から全画像のスコアを自動で再計算します。\n"
+                                          "書式: タグ: 減点値 / タグ: {penalty: 減点値, threshold: しきい値} / _default_threshold: 0.5"))
         layout.addWidget(penalties_group)
         model_group = QGroupBox("AIモデル設定"); model_layout = QVBoxLayout(model_group)
         self.force_cpu_checkbox = QCheckBox("CPUでAI処理を強制実行 (GPUがあっても使用しない)")
         self.force_cpu_checkbox.setChecked(self.parent().settings.value("force_cpu", False, type=bool))
         model_layout.addWidget(self.force_cpu_checkbox)
+        backend_form = QFormLayout(); self.aesthetic_backend_combo = QComboBox()
+        self.aesthetic_backend_combo.addItem("PyTorch (標準)", "torch"); self.aesthetic_backend_combo.addItem("ONNX Runtime int8 (CPU時のみ)", "onnx_int8")
+        backend_idx = self.aesthetic_backend_combo.findData(self.parent().settings.value("aesthetic_backend", scoring_module.AESTHETIC_BACKEND, type=str))
+        self.aesthetic_backend_combo.setCurrentIndex(max(0, backend_idx))
+        backend_form.addRow("Aesthetic 推論バックエンド:", self.aesthetic_backend_combo)
+        self.onnx_threads_spin = QSpinBox(); self.onnx_threads_spin.setRange(0, 256); self.onnx_threads_spin.setSpecialValueText("自動")
+        self.onnx_threads_spin.setValue(self.parent().settings.value("onnx_intra_op_threads", scoring_module.ONNX_INTRA_OP_THREADS, type=int))
+        backend_form.addRow("ONNX Runtime スレッド数:", self.onnx_threads_spin)
+        self.torch_accel_combo = QComboBox()
+        self.torch_accel_combo.addItem("標準 (eager float32)", "eager"); self.torch_accel_combo.addItem("CPU 高速化 (inference_mode / bf16 / channels-last / compile)", "cpu_accel")
+        self.torch_accel_combo.setCurrentIndex(max(0, self.torch_accel_combo.findData(self.parent().settings.value("torch_accel_profile", scoring_module.TORCH_ACCEL_PROFILE, type=str))))
+        backend_form.addRow("PyTorch 高速化プロファイル:", self.torch_accel_combo)
+        self.torch_threads_spin = QSpinBox(); self.torch_threads_spin.setRange(0, 256); self.torch_threads_spin.setSpecialValueText("自動")
+        self.torch_threads_spin.setValue(self.parent().settings.value("torch_intra_op_threads", scoring_module.TORCH_INTRA_OP_THREADS, type=int))
+        backend_form.addRow("PyTorch スレッド数 (高速化時):", self.torch_threads_spin)
+        self.ddb_runtime_combo = QComboBox()
+        for label, value in [("自動 (ONNX 変換済みなら ONNX)", "auto"), ("Keras (TensorFlow)", "keras"), ("ONNX Runtime (未変換なら初回に変換)", "onnx")]: self.ddb_runtime_combo.addItem(label, value)
+        self.ddb_runtime_combo.setCurrentIndex(max(0, self.ddb_runtime_combo.findData(self.parent().settings.value("ddb_runtime", scoring_module.DDB_RUNTIME, type=str))))
+        backend_form.addRow("DeepDanbooru 実行方式:", self.ddb_runtime_combo)
+        model_layout.addLayout(backend_form)
         model_layout.addWidget(QLabel("変更はアプリ再起動後に有効になります。"))
+        self.reduced_decode_checkbox = QCheckBox("縮小デコード (大きな画像をモデル入力・サムネイルに必要な解像度で読み込む)")
+        self.reduced_decode_checkbox.setChecked(self.parent().settings.value("reduced_decode", scoring_module.REDUCED_DECODE, type=bool))
+        model_layout.addWidget(self.reduced_decode_checkbox)
+        self.concurrent_inference_checkbox = QCheckBox("CLIP と DeepDanbooru を同時に推論 (メモリを多く使う代わりに速くなる、スレッド配分は再起動後に有効)")
+        self.concurrent_inference_checkbox.setChecked(self.parent().settings.value("concurrent_inference", scoring_module.CONCURRENT_INFERENCE, type=bool))
+        model_layout.addWidget(self.concurrent_inference_checkbox)
+        near_dup_form = QFormLayout(); self.near_dup_mode_combo = QComboBox()
+        self.near_dup_mode_combo.addItem("使わない (常に推論)", "off"); self.near_dup_mode_combo.addItem("知覚ハッシュが近いスコア済み画像のスコアを流用", "copy")
+        self.near_dup_mode_combo.setCurrentIndex(max(0, self.near_dup_mode_combo.findData(self.parent().settings.value("near_dup_mode", scoring_module.NEAR_DUP_MODE, type=str))))
+        near_dup_form.addRow("近似重複画像:", self.near_dup_mode_combo)
+        self.near_dup_distance_spin = QSpinBox(); self.near_dup_distance_spin.setRange(0, phash_index_module.MAX_INDEXED_RADIUS)
+        self.near_dup_distance_spin.setValue(self.parent().settings.value("near_dup_max_distance", scoring_module.NEAR_DUP_MAX_DISTANCE, type=int))
+        near_dup_form.addRow("近似とみなすハミング距離 (64bit 中):", self.near_dup_distance_spin)
+        model_layout.addLayout(near_dup_form)
+        cascade_form = QFormLayout(); self.cascade_mode_combo = QComboBox()
+        for label, value in [("使わない (全画像を ViT-L で採点)", "off"), ("ViT-B/32 で仮採点 (再起動後に有効)", "clip_b32"), ("DeepDanbooru の減点だけで仮採点", "ddb")]: self.cascade_mode_combo.addItem(label, value)
+        self.cascade_mode_combo.setCurrentIndex(max(0, self.cascade_mode_combo.findData(self.parent().settings.value("cascade_mode", scoring_module.CASCADE_MODE, type=str))))
+        cascade_form.addRow("カスケード採点:", self.cascade_mode_combo)
+        self.cascade_threshold_spin = QDoubleSpinBox(); self.cascade_threshold_spin.setRange(0.0, 10.0); self.cascade_threshold_spin.setSingleStep(0.1)
+        self.cascade_threshold_spin.setValue(self.parent().settings.value("cascade_delete_threshold", scoring_module.CASCADE_DELETE_THRESHOLD, type=float))
+        cascade_form.addRow("削除の目安 (score_final):", self.cascade_threshold_spin)
+        self.cascade_band_spin = QDoubleSpinBox(); self.cascade_band_spin.setRange(0.0, 10.0); self.cascade_band_spin.setSingleStep(0.1)
+        self.cascade_band_spin.setValue(self.parent().settings.value("cascade_band", scoring_module.CASCADE_BAND, type=float))
+        cascade_form.addRow("ViT-L で採点し直す幅 (±):", self.cascade_band_spin)
+        model_layout.addLayout(cascade_form)
+        batch_form = QFormLayout(); self.batch_size_spin = QSpinBox(); self.batch_size_spin.setRange(1, 256)
+        self.batch_size_spin.setValue(self.parent().settings.value("scoring_batch_size", scoring_module.SCORING_BATCH_SIZE, type=int))
+        batch_form.addRow("スコアリング バッチサイズ:", self.batch_size_spin)
+        self.decode_workers_spin = QSpinBox(); self.decode_workers_spin.setRange(1, 32)
+        self.decode_workers_spin.setValue(self.parent().settings.value("pipeline_decode_workers", pipeline_module.PIPELINE_DECODE_WORKERS, type=int))
+        batch_form.addRow("デコードワーカー数:", self.decode_workers_spin)
+        self.ready_queue_spin = QSpinBox(); self.ready_queue_spin.setRange(1, 1024)
+        self.ready_queue_spin.setValue(self.parent().settings.value("pipeline_ready_queue_size", pipeline_module.PIPELINE_READY_QUEUE_SIZE, type=int))
+        batch_form.addRow("前処理済みキュー上限 (枚):", self.ready_queue_spin)
+        self.persist_queue_spin = QSpinBox(); self.persist_queue_spin.setRange(1, 1024)
+        self.persist_queue_spin.setValue(self.parent().settings.value("pipeline_persist_queue_size", pipeline_module.PIPELINE_PERSIST_QUEUE_SIZE, type=int))
+        batch_form.addRow("保存待ちキュー上限 (枚):", self.persist_queue_spin)
+        self.pool_workers_spin = QSpinBox(); self.pool_workers_spin.setRange(0, 64); self.pool_workers_spin.setSpecialValueText("無効 (単一プロセス)")
+        self.pool_workers_spin.setValue(self.parent().settings.value("score_pool_workers", score_pool_module.SCORE_POOL_WORKERS, type=int))
+        batch_form.addRow("プロセスプール ワーカー数:", self.pool_workers_spin)
+        self.pool_threads_spin = QSpinBox(); self.pool_threads_spin.setRange(0, 64); self.pool_threads_spin.setSpecialValueText("自動")
+        self.pool_threads_spin.setValue(self.parent().settings.value("score_pool_threads_per_worker", score_pool_module.SCORE_POOL_THREADS_PER_WORKER, type=int))
+        batch_form.addRow("ワーカーあたりのスレッド数:", self.pool_threads_spin)
+        self.job_chunk_spin = QSpinBox(); self.job_chunk_spin.setRange(1, 4096)
+        self.job_chunk_spin.setValue(self.parent().settings.value("job_chunk_size", job_queue_module.JOB_CHUNK_SIZE, type=int))
+        batch_form.addRow("ジョブの割り込み単位 (枚):", self.job_chunk_spin)
+        self.job_checkpoint_spin = QSpinBox(); self.job_checkpoint_spin.setRange(1, 100000)
+        self.job_checkpoint_spin.setValue(self.parent().settings.value("job_checkpoint_interval", job_queue_module.JOB_CHECKPOINT_INTERVAL, type=int))
+        batch_form.addRow("途中保存の間隔 (枚):", self.job_checkpoint_spin)
+        self.autotune_checkbox = QCheckBox("起動時に自動チューニング (バッチサイズ・デコードワーカー数・torch スレッド数を上の設定より優先)")
+        self.autotune_checkbox.setChecked(self.parent().settings.value("autotune_enabled", autotune_module.AUTOTUNE_ENABLED, type=bool))
+        batch_form.addRow(self.autotune_checkbox)
+        self.autotune_cap_spin = QDoubleSpinBox(); self.autotune_cap_spin.setRange(100.0, 60000.0); self.autotune_cap_spin.setDecimals(0); self.autotune_cap_spin.setSingleStep(500.0)
+        self.autotune_cap_spin.setValue(self.parent().settings.value("autotune_latency_cap_ms", autotune_module.AUTOTUNE_LATENCY_CAP_MS, type=float))
+        batch_form.addRow("自動チューニング: 1 バッチの推論時間の上限 (ms):", self.autotune_cap_spin)
+        self.autotune_retune_checkbox = QCheckBox("次回起動時に測り直す")
+        batch_form.addRow(self.autotune_retune_checkbox)
+        model_layout.addLayout(batch_form)
         layout.addWidget(model_group)
         button_box = QDialogButtonBox(QDialogButtonBox.Save | QDialogButtonBox.Cancel)
         button_box.accepted.connect(self.accept); button_box.rejected.connect(self.reject)
@@ -158,27 +281,96 @@ class SettingsDialog(QDialog): # 変更なし
                 self.parent().gemini_api_key_loaded = new_api_key
             except Exception as e: QMessageBox.critical(self, "保存エラー", f".envへのAPIキー保存失敗: {e}")
         self.parent().settings.setValue("force_cpu", self.force_cpu_checkbox.isChecked())
+        self.parent().settings.setValue("aesthetic_backend", self.aesthetic_backend_combo.currentData())
+        self.parent().settings.setValue("onnx_intra_op_threads", self.onnx_threads_spin.value())
+        self.parent().settings.setValue("torch_accel_profile", self.torch_accel_combo.currentData())
+        self.parent().settings.setValue("torch_intra_op_threads", self.torch_threads_spin.value())
+        self.parent().settings.setValue("ddb_runtime", self.ddb_runtime_combo.currentData())
+        self.parent().settings.setValue("reduced_decode", self.reduced_decode_checkbox.isChecked())
+        self.parent().settings.setValue("concurrent_inference", self.concurrent_inference_checkbox.isChecked())
+        self.parent().settings.setValue("near_dup_mode", self.near_dup_mode_combo.currentData())
+        self.parent().settings.setValue("near_dup_max_distance", self.near_dup_distance_spin.value())
+        self.parent().settings.setValue("cascade_mode", self.cascade_mode_combo.currentData())
+        self.parent().settings.setValue("cascade_delete_threshold", self.cascade_threshold_spin.value())
+        self.parent().settings.setValue("cascade_band", self.cascade_band_spin.value())
+        self.parent().settings.setValue("scoring_batch_size", self.batch_size_spin.value())
+        self.parent().settings.setValue("pipeline_decode_workers", self.decode_workers_spin.value())
+        self.parent().settings.setValue("pipeline_ready_queue_size", self.ready_queue_spin.value())
+        self.parent().settings.setValue("pipeline_persist_queue_size", self.persist_queue_spin.value())
+        self.parent().settings.setValue("score_pool_workers", self.pool_workers_spin.value())
+        self.parent().settings.setValue("score_pool_threads_per_worker", self.pool_threads_spin.value())
+        self.parent().settings.setValue("job_chunk_size", self.job_chunk_spin.value())
+        self.parent().settings.setValue("job_checkpoint_interval", self.job_checkpoint_spin.value())
+        self.parent().settings.setValue("autotune_enabled", self.autotune_checkbox.isChecked())
+        self.parent().settings.setValue("autotune_latency_cap_ms", self.autotune_cap_spin.value())
+        if self.autotune_retune_checkbox.isChecked(): self.parent().settings.remove("autotune_result")
+        self.parent().apply_scoring_settings()
         super().accept()
 
 class MainWindow(QMainWindow): # _update_dataframes_and_combined_view 以外は変更なし
     def __init__(self):
         super().__init__()
         self.setWindowTitle(f"{APP_NAME} - {APP_VERSION}"); self.setGeometry(50, 50, 1600, 900)
-        self.settings = QSettings("AIImageScorerOrg", APP_NAME)
+        self.settings = QSettings("AIImageScorerOrg", APP_NAME); self.apply_scoring_settings()
         self.all_scores_data = {}; self.all_metadata = {}; self.df_scores = pd.DataFrame()
         self.df_metadata = pd.DataFrame(); self.df_combined = pd.DataFrame()
         self.current_display_image_ids = []; self.delete_mode = False; self.penalties_config = {}
         self.gemini_api_key_loaded = os.getenv("GOOGLE_API_KEY", "")
         self.models_initialized_properly = False
-        self._init_dirs_and_files(); self.penalties_config = scoring_module.load_penalties()
-        self._init_ui(); self._load_all_data_from_json(); self._update_dataframes_and_combined_view()
-        self.model_init_thread = ModelInitializationThread(force_cpu=self.settings.value("force_cpu", False, type=bool))
+        self._init_dirs_and_files(); self.penalties_config = scoring_module.load_penalties(); self.tag_store = get_tag_store(); self.embedding_store = get_embedding_store()
+        self.phash_index = phash_index_module.get_phash_index(); self.job_queue = job_queue_module.get_job_queue()
+        self._current_job_chunk = []; self._chunk_path_of = {}; self._chunk_delivered = set(); self._uncheckpointed_paths = []; self._run_done = 0; self._closing = False
+        self._repenalize_pending = False; self._init_ui(); self._load_all_data_from_json(); self._update_dataframes_and_combined_view()
+        self.penalties_watcher = QFileSystemWatcher([str(PENALTIES_YML_PATH)], self)
+        self.penalties_watcher.fileChanged.connect(lambda _path: QTimer.singleShot(300, self.on_penalties_file_changed))
+        self.model_init_thread = ModelInitializationThread(force_cpu=self.settings.value("force_cpu", False, type=bool), autotune_cached=self._load_autotune_result())
+        self.model_init_thread.autotune_finished.connect(self.on_autotune_finished)
         self.model_init_thread.initialization_progress.connect(self.handle_model_init_progress)
         self.model_init_thread.initialization_finished.connect(self.handle_model_init_finished)
         self.model_init_thread.start()
         self.restoreGeometry(self.settings.value("geometry", self.saveGeometry(), type=bytes))
         self.restoreState(self.settings.value("windowState", self.saveState(), type=bytes))
+        mark_startup("メインウィンドウ構築完了")
 
+    def apply_scoring_settings(self):
+        """QSettings のスコアリング関連設定をモジュール変数に反映 (次回の処理から有効)。"""
+        scoring_module.SCORING_BATCH_SIZE = self.settings.value("scoring_batch_size", scoring_module.SCORING_BATCH_SIZE, type=int)
+        scoring_module.AESTHETIC_BACKEND = self.settings.value("aesthetic_backend", scoring_module.AESTHETIC_BACKEND, type=str)
+        scoring_module.ONNX_INTRA_OP_THREADS = self.settings.value("onnx_intra_op_threads", scoring_module.ONNX_INTRA_OP_THREADS, type=int)
+        scoring_module.TORCH_ACCEL_PROFILE = self.settings.value("torch_accel_profile", scoring_module.TORCH_ACCEL_PROFILE, type=str)
+        scoring_module.TORCH_INTRA_OP_THREADS = self.settings.value("torch_intra_op_threads", scoring_module.TORCH_INTRA_OP_THREADS, type=int)
+        scoring_module.DDB_RUNTIME = self.settings.value("ddb_runtime", scoring_module.DDB_RUNTIME, type=str)
+        scoring_module.REDUCED_DECODE = self.settings.value("reduced_decode", scoring_module.REDUCED_DECODE, type=bool)
+        scoring_module.CONCURRENT_INFERENCE = self.settings.value("concurrent_inference", scoring_module.CONCURRENT_INFERENCE, type=bool)
+        scoring_module.NEAR_DUP_MODE = self.settings.value("near_dup_mode", scoring_module.NEAR_DUP_MODE, type=str)
+        scoring_module.NEAR_DUP_MAX_DISTANCE = self.settings.value("near_dup_max_distance", scoring_module.NEAR_DUP_MAX_DISTANCE, type=int)
+        scoring_module.CASCADE_MODE = self.settings.value("cascade_mode", scoring_module.CASCADE_MODE, type=str)
+        scoring_module.CASCADE_DELETE_THRESHOLD = self.settings.value("cascade_delete_threshold", scoring_module.CASCADE_DELETE_THRESHOLD, type=float)
+        scoring_module.CASCADE_BAND = self.settings.value("cascade_band", scoring_module.CASCADE_BAND, type=float)
+        pipeline_module.PIPELINE_DECODE_WORKERS = self.settings.value("pipeline_decode_workers", pipeline_module.PIPELINE_DECODE_WORKERS, type=int)
+        pipeline_module.PIPELINE_READY_QUEUE_SIZE = self.settings.value("pipeline_ready_queue_size", pipeline_module.PIPELINE_READY_QUEUE_SIZE, type=int)
+        pipeline_module.PIPELINE_PERSIST_QUEUE_SIZE = self.settings.value("pipeline_persist_queue_size", pipeline_module.PIPELINE_PERSIST_QUEUE_SIZE, type=int)
+        score_pool_module.SCORE_POOL_WORKERS = self.settings.value("score_pool_workers", score_pool_module.SCORE_POOL_WORKERS, type=int)
+        score_pool_module.SCORE_POOL_THREADS_PER_WORKER = self.settings.value("score_pool_threads_per_worker", score_pool_module.SCORE_POOL_THREADS_PER_WORKER, type=int)
+        job_queue_module.JOB_CHUNK_SIZE = self.settings.value("job_chunk_size", job_queue_module.JOB_CHUNK_SIZE, type=int)
+        job_queue_module.JOB_CHECKPOINT_INTERVAL = self.settings.value("job_checkpoint_interval", job_queue_module.JOB_CHECKPOINT_INTERVAL, type=int)
+        autotune_module.AUTOTUNE_ENABLED = self.settings.value("autotune_enabled", autotune_module.AUTOTUNE_ENABLED, type=bool)
+        autotune_module.AUTOTUNE_LATENCY_CAP_MS = self.settings.value("autotune_latency_cap_ms", autotune_module.AUTOTUNE_LATENCY_CAP_MS, type=float)
+        if autotune_module.AUTOTUNE_ENABLED: autotune_module.apply_result(getattr(self, 'autotune_result', None), scoring_module, pipeline_module)  # バッチサイズ/デコードワーカー数の設定値より優先
+        pool = getattr(self, 'score_pool', None)
+        if pool and (pool.workers != score_pool_module.SCORE_POOL_WORKERS or pool.threads_per_worker != (score_pool_module.SCORE_POOL_THREADS_PER_WORKER or score_pool_module.default_threads_per_worker(pool.workers))):
+            if not (getattr(self, 'scoring_thread', None) and self.scoring_thread.isRunning()): self._shutdown_score_pool()
+    def _get_score_pool(self):
+        """プロセスプールモードが有効ならプールを返す (初回呼び出し時に生成、ワーカーは最初の処理で起動)。"""
+        if score_pool_module.SCORE_POOL_WORKERS <= 0: return None
+        allowed, unsafe = scoring_module.scorer_plugins_module.process_pool_allowed(scoring_module.SCORER_PLUGINS)
+        if not allowed: print(f"[ScorePool] マルチプロセス非対応のプラグイン ({', '.join(unsafe)}) があるため、プロセスプールを使いません。"); return None
+        if getattr(self, 'score_pool', None) is None:
+            self.score_pool = score_pool_module.ScoringProcessPool(score_pool_module.SCORE_POOL_WORKERS, score_pool_module.SCORE_POOL_THREADS_PER_WORKER)
+        return self.score_pool
+    def _shutdown_score_pool(self):
+        pool = getattr(self, 'score_pool', None); self.score_pool = None
+        if pool: pool.shutdown(wait=True)
     def _init_dirs_and_files(self):
         for p in [IMAGES_ORIGINALS_DIR, IMAGES_THUMBNAILS_DIR, DELETED_DIR, ASSETS_SOUNDS_DIR, LOG_DIR, FILTERS_DIR, MODELS_DIR]:
             p.mkdir(parents=True, exist_ok=True)
@@ -197,11 +389,19 @@ class MainWindow(QMainWindow): # _update_dataframes_and_combined_view 以外は
         main_widget = QWidget(); self.setCentralWidget(main_widget); layout = QVBoxLayout(main_widget)
         menubar = self.menuBar(); file_menu = menubar.addMenu("&ファイル")
         settings_action = QAction(QIcon.fromTheme("preferences-system"), "設定(&S)...", self); settings_action.triggered.connect(self.open_settings_dialog)
-        file_menu.addAction(settings_action); file_menu.addSeparator()
+        file_menu.addAction(settings_action)
+        repenalize_action = QAction("ペナルティを全画像に再適用(&P)", self); repenalize_action.triggered.connect(lambda: self.reload_penalties_and_repenalize(force=True))
+        file_menu.addAction(repenalize_action)
+        head_rescore_action = QAction("Aesthetic ヘッドのみで再スコア(&H)...", self); head_rescore_action.triggered.connect(self.rescore_with_aesthetic_heads)
+        file_menu.addAction(head_rescore_action)
+        near_dup_action = QAction("近似重複の一覧(&D)...", self); near_dup_action.triggered.connect(self.show_near_duplicates_dialog)
+        file_menu.addAction(near_dup_action); file_menu.addSeparator()
         exit_action = QAction(QIcon.fromTheme("application-exit"), "終了(&X)", self); exit_action.triggered.connect(self.close)
         file_menu.addAction(exit_action)
         help_menu = menubar.addMenu("&ヘルプ")
         about_action = QAction(QIcon.fromTheme("help-about"),"このアプリについて(&A)", self); about_action.triggered.connect(self.show_about_dialog)
+        perf_action = QAction("パフォーマンス統計(&T)...", self); perf_action.triggered.connect(self.show_perf_stats_dialog)
+        help_menu.addAction(perf_action)
         help_menu.addAction(about_action)
         self.tab_widget = QTabWidget(); self.gallery_tab_widget = QWidget(); gallery_layout = QVBoxLayout(self.gallery_tab_widget)
         top_controls_layout = QHBoxLayout()
@@ -224,18 +424,33 @@ class MainWindow(QMainWindow): # _update_dataframes_and_combined_view 以外は
         layout.addWidget(self.tab_widget); self.status_bar_label = QLabel("準備完了"); self.statusBar().addWidget(self.status_bar_label)
         self.status_bar_progress = QProgressBar(); self.status_bar_progress.setVisible(False); self.status_bar_progress.setMaximumHeight(15)
         self.status_bar_progress.setMaximumWidth(200); self.statusBar().addPermanentWidget(self.status_bar_progress)
+        self.perf_status_label = QLabel(""); self.perf_status_label.setToolTip("ステージ別処理時間 (ヘルプ > パフォーマンス統計 で詳細)")
+        self.statusBar().addPermanentWidget(self.perf_status_label)
+        self.perf_timer = QTimer(self); self.perf_timer.setInterval(1000); self.perf_timer.timeout.connect(self.update_perf_status)
 
     @Slot(str, int)
     def handle_model_init_progress(self, message, percent):
         self.show_status_message(f"モデル初期化中: {message} ({percent}%)", 0)
         self.status_bar_progress.setVisible(True); self.status_bar_progress.setRange(0,100)
         self.status_bar_progress.setValue(percent)
+    def _load_autotune_result(self):
+        try: return json.loads(self.settings.value("autotune_result", "", type=str) or "null")
+        except json.JSONDecodeError: return None
+    @Slot(dict, bool)
+    def on_autotune_finished(self, result, reused):
+        self.autotune_result = result
+        if not reused: self.settings.setValue("autotune_result", json.dumps(result, ensure_ascii=False))
+        self.apply_scoring_settings()
+        self.show_status_message(f"自動チューニング{'(保存済み)' if reused else ''}: バッチ {result['batch_size']}, デコードワーカー {result['decode_workers']}, "
+                                 f"torch スレッド {result.get('torch_threads') or '既定'} ({result['images_per_sec']:.1f}枚/秒)", 8000)
     @Slot(bool)
     def handle_model_init_finished(self, success):
         self.status_bar_progress.setVisible(False); self.models_initialized_properly = success
+        mark_startup("AIモデル初期化完了" if success else "AIモデル初期化失敗"); log_startup_timing()
         if success:
             self.show_status_message("AIモデルの初期化が完了しました。", 5000)
             self.perform_initial_sync(); self.start_fs_watcher()
+            if len(self.job_queue): self.show_status_message(f"前回未完了のジョブ {len(self.job_queue)}件を再開します。", 5000); self._start_next_scoring_chunk()
             if not self.all_scores_data: self._scan_and_process_new_images()
         else:
             self.show_status_message("AIモデルの初期化に失敗。機能が限定されます。", 0)
@@ -364,6 +579,7 @@ class MainWindow(QMainWindow): # _update_dataframes_and_combined_view 以外は
         except Exception as e: print(f"ローカルファイル移動/削除エラー ({image_id}): {e}")
         if image_id in self.all_scores_data: del self.all_scores_data[image_id]
         if image_id in self.all_metadata: del self.all_metadata[image_id]
+        self.tag_store.remove(image_id)
         del_reqs = []
         if DELETE_REQUESTS_JSON_PATH.exists():
             try:
@@ -424,23 +640,164 @@ class MainWindow(QMainWindow): # _update_dataframes_and_combined_view 以外は
         self.show_status_message("新規画像をスキャン中...", 0)
         to_process = [str(p) for p in IMAGES_ORIGINALS_DIR.glob("*") if p.suffix.lower() in FS_WATCHED_EXTENSIONS and p.stem not in self.all_scores_data]
         if not to_process: self.show_status_message("処理対象の新規画像なし。"); return
-        self.status_bar_progress.setRange(0, len(to_process)); self.status_bar_progress.setValue(0)
-        self.status_bar_progress.setVisible(True); self.show_status_message(f"{len(to_process)}件の新規画像を処理中...", 0)
-        if hasattr(self, 'scoring_thread') and self.scoring_thread and self.scoring_thread.isRunning():
-            QMessageBox.information(self, "処理中", "現在別の画像処理が実行中です。完了後に再度お試しください。"); return
-        self.scoring_thread = ScoringAndMetadataThread(to_process, self.penalties_config)
-        self.scoring_thread.progress.connect(lambda curr, total: self.status_bar_progress.setValue(curr))
+        self.enqueue_scoring_jobs(to_process, job_queue_module.PRIORITY_RESCAN, "rescan")
+    def enqueue_scoring_jobs(self, image_paths, priority, source):
+        """ジョブキューに画像を追加し、処理中でなければ処理を始める (処理中なら次の区切りで優先度順に取り込まれる)。"""
+        added = self.job_queue.enqueue(image_paths, priority, source)
+        running = hasattr(self, 'scoring_thread') and self.scoring_thread and self.scoring_thread.isRunning()
+        if added and running:
+            self.status_bar_progress.setRange(0, self._run_done + len(self._current_job_chunk) + self.job_queue.pending_count())
+            self.show_status_message(f"{added}件をキューに追加 (待ち {len(self.job_queue)}件)", 3000)
+        if not self.models_initialized_properly:
+            if added: self.show_status_message(f"モデル未初期化のため {added}件をキューに保留しました。", 0)
+            return
+        self._start_next_scoring_chunk()
+    def _start_next_scoring_chunk(self):
+        """キューから優先度順に JOB_CHUNK_SIZE 件を取り出してスコアリングスレッドを起動する。"""
+        if self._closing or not self.models_initialized_properly: return
+        if hasattr(self, 'scoring_thread') and self.scoring_thread and self.scoring_thread.isRunning(): return
+        # 対話的な再スコアはそれだけのチャンクにして、スコアキャッシュを使わずに推論し直す
+        chunk = self.job_queue.take(job_queue_module.JOB_CHUNK_SIZE, priority=job_queue_module.PRIORITY_INTERACTIVE); use_cache = not chunk
+        if use_cache: chunk = self.job_queue.take(job_queue_module.JOB_CHUNK_SIZE)
+        if not chunk: return
+        self._current_job_chunk = chunk; done_before = self._run_done
+        self._chunk_path_of = {str(Path(p)): p for p in chunk}; self._chunk_delivered = set()  # 結果の path (Path で正規化済み) → キューに入れたときの表記
+        self.status_bar_progress.setRange(0, done_before + len(chunk) + self.job_queue.pending_count()); self.status_bar_progress.setValue(done_before)
+        self.status_bar_progress.setVisible(True); self.show_status_message(f"画像を処理中... (残り {len(self.job_queue)}件)", 0)
+        score_pool = self._get_score_pool()
+        if score_pool: self.scoring_thread = ScoringProcessPoolThread(score_pool, chunk, self.penalties_config, use_cache)
+        else: self.scoring_thread = ScoringAndMetadataThread(chunk, self.penalties_config, use_cache)
+        self.scoring_thread.progress.connect(lambda curr, total: self.status_bar_progress.setValue(done_before + curr))
         self.scoring_thread.image_processed.connect(self.on_single_image_processed)
-        self.scoring_thread.finished.connect(self.on_all_images_processed)
-        self.scoring_thread.start()
+        self.scoring_thread.finished.connect(self.on_scoring_chunk_finished)
+        self.scoring_thread.start(); self.perf_timer.start()
+    def _checkpoint_results(self):
+        """ここまでの結果を保存し、保存できた画像のジョブを完了にする。"""
+        if not self._uncheckpointed_paths: return
+        self.tag_store.save(); self.embedding_store.flush(); self.phash_index.save(); self._save_all_data_to_json()
+        self.job_queue.mark_done(self._uncheckpointed_paths); self._uncheckpointed_paths = []
+    @Slot()
+    def on_scoring_chunk_finished(self):
+        if self._closing: return
+        # 結果が届かなかった画像は、削除されたものだけ完了にする。残りはスレッドの失敗 (プール/パイプラインの異常終了) なので次回起動時に再開する
+        self._checkpoint_results()
+        undelivered = [p for p in self._current_job_chunk if p not in self._chunk_delivered]; gone = [p for p in undelivered if not Path(p).exists()]
+        self.job_queue.mark_done(gone); self.job_queue.release([p for p in undelivered if p not in gone], retry=False)
+        if len(undelivered) > len(gone): self.show_status_message(f"{len(undelivered) - len(gone)}件を処理できませんでした (次回起動時に再試行します)", 5000)
+        self._run_done += len(self._current_job_chunk); self._current_job_chunk = []
+        if self.job_queue.pending_count(): self._start_next_scoring_chunk()
+        else: self.on_all_images_processed()
     @Slot(str, dict, dict)
     def on_single_image_processed(self, image_id, score_data, metadata):
-        self.all_scores_data[image_id] = score_data; self.all_metadata[image_id] = metadata
+        with perf_stats_module.timed("persist"):
+            self.tag_store.absorb(image_id, score_data.pop(scoring_module.TAG_PROBS_KEY, None))
+            self.embedding_store.add(score_data.get("content_hash"), score_data.pop(scoring_module.CLIP_EMBEDDING_KEY, None), scoring_module.aesthetic_embedding_model_id())
+            if score_data.get(phash_index_module.PHASH_KEY): self.phash_index.add(score_data.get("content_hash"), phash_index_module.phash_from_hex(score_data[phash_index_module.PHASH_KEY]))
+            self.all_scores_data[image_id] = score_data; self.all_metadata[image_id] = metadata
+        perf_stats_module.get_perf_stats().image_done()
+        result_path = score_data.get("path", str(IMAGES_ORIGINALS_DIR / image_id)); job_path = self._chunk_path_of.get(str(Path(result_path)), result_path)
+        self._chunk_delivered.add(job_path); self._uncheckpointed_paths.append(job_path)
+        if len(self._uncheckpointed_paths) >= job_queue_module.JOB_CHECKPOINT_INTERVAL: self._checkpoint_results()
     @Slot()
     def on_all_images_processed(self):
-        self.status_bar_progress.setVisible(False); self.show_status_message("新規画像の処理完了。", 3000)
+        self.status_bar_progress.setVisible(False); self.show_status_message("新規画像の処理完了。", 3000); self._run_done = 0
+        self.perf_timer.stop(); self.update_perf_status(); perf_stats_module.get_perf_stats().flush(reason="run_complete")
+        self.tag_store.save(); self.embedding_store.flush(); self.phash_index.save()
+        if self._repenalize_pending: self.reload_penalties_and_repenalize()
         self._save_all_data_to_json(); self._update_dataframes_and_combined_view()
         QMessageBox.information(self, "処理完了", "新規画像の処理が完了しました。")
+    @Slot()
+    def update_perf_status(self):
+        stats = perf_stats_module.get_perf_stats()
+        self.perf_status_label.setText(stats.status_text()); stats.maybe_flush()
+    def show_perf_stats_dialog(self):
+        dialog = QDialog(self); dialog.setWindowTitle("パフォーマンス統計"); dialog.resize(640, 360); layout = QVBoxLayout(dialog)
+        text = QTextEdit(); text.setReadOnly(True); text.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        cascade_text = scoring_module.cascade_report_text()
+        text.setPlainText(perf_stats_module.get_perf_stats().table_text() + (f"\n\n{cascade_text}" if cascade_text else "") + f"\n\nログ: {perf_stats_module.PERF_LOG_PATH}"); layout.addWidget(text)
+        button_box = QDialogButtonBox(QDialogButtonBox.Close); button_box.rejected.connect(dialog.reject); layout.addWidget(button_box)
+        dialog.exec()
+    @Slot()
+    def on_penalties_file_changed(self):
+        # エディタによっては保存時にファイルを置き換えるため、監視対象を登録し直す
+        if PENALTIES_YML_PATH.exists() and str(PENALTIES_YML_PATH) not in self.penalties_watcher.files(): self.penalties_watcher.addPath(str(PENALTIES_YML_PATH))
+        self.reload_penalties_and_repenalize()
+    def reload_penalties_and_repenalize(self, force=False):
+        """penalties.yml を読み直し、変更があれば保存済みタグ確率から全画像のスコアを再計算する。"""
+        old_config = (self.penalties_config, scoring_module.DEEPDANBOORU_THRESHOLD, dict(scoring_module.TAG_THRESHOLDS))
+        self.penalties_config = scoring_module.load_penalties()
+        if not force and old_config == (self.penalties_config, scoring_module.DEEPDANBOORU_THRESHOLD, scoring_module.TAG_THRESHOLDS): return
+        if hasattr(self, 'scoring_thread') and self.scoring_thread and self.scoring_thread.isRunning():
+            self._repenalize_pending = True; self.show_status_message("画像処理の完了後にペナルティを再適用します。", 3000); return
+        self._repenalize_pending = False; start = time.perf_counter()
+        changed = self.tag_store.repenalize(self.all_scores_data, self.penalties_config, scoring_module.DEEPDANBOORU_THRESHOLD, scoring_module.TAG_THRESHOLDS)
+        if changed: self._save_all_data_to_json(); self._update_dataframes_and_combined_view()
+        provisional = sum(1 for d in self.all_scores_data.values() if d.get("score_stage") == scoring_module.CASCADE_STAGE_PRIOR)
+        self.show_status_message(f"ペナルティ再適用: {changed}/{len(self.all_scores_data)}件更新 ({time.perf_counter() - start:.1f}秒)"
+                                 + (f", カスケードの仮スコア {provisional}件は対象外 (再スコアで更新)" if provisional else ""), 5000)
+    def rescore_with_aesthetic_heads(self):
+        """保存済み CLIP 埋め込みに Aesthetic ヘッドだけを適用し、score_aesthetic_heads に並べて記録する。"""
+        if hasattr(self, 'scoring_thread') and self.scoring_thread and self.scoring_thread.isRunning():
+            QMessageBox.information(self, "処理中", "現在画像処理が実行中です。完了後に再度お試しください。"); return
+        specs_text, ok = QInputDialog.getText(self, "Aesthetic ヘッドのみで再スコア",
+                                              "ヘッド (カンマ区切り、current = ロード済みヘッド / HF repo id / .safetensors パス):",
+                                              text=self.settings.value("aesthetic_head_specs", "current", type=str))
+        specs = [s.strip() for s in specs_text.split(",") if s.strip()] if ok else []
+        if not specs: return
+        self.settings.setValue("aesthetic_head_specs", ", ".join(specs))
+        make_primary = QMessageBox.question(self, "主スコアの置き換え", f"先頭のヘッド ({specs[0]}) のスコアで score_moe を置き換え、ペナルティを再適用しますか？",
+                                            QMessageBox.Yes | QMessageBox.No, QMessageBox.No) == QMessageBox.Yes
+        self.show_status_message("Aesthetic ヘッドを読み込み中...", 0); QApplication.processEvents()
+        try: heads = [aesthetic_heads_module.load_head(spec) for spec in specs]
+        except Exception as e: QMessageBox.critical(self, "ヘッド読込エラー", str(e)); self.show_status_message("ヘッド読込失敗", 3000); return
+        start = time.perf_counter()
+        try: written, skipped = aesthetic_heads_module.rescore_with_heads(self.all_scores_data, heads, primary=heads[0].name if make_primary else None)
+        except Exception as e: QMessageBox.critical(self, "再スコアエラー", str(e)); self.show_status_message("再スコア失敗", 3000); return
+        if make_primary and written: self.tag_store.repenalize(self.all_scores_data, self.penalties_config, scoring_module.DEEPDANBOORU_THRESHOLD, scoring_module.TAG_THRESHOLDS)
+        if written: self._save_all_data_to_json(); self._update_dataframes_and_combined_view()
+        self.show_status_message(f"ヘッドのみ再スコア: {written}件 ({len(heads)}ヘッド, {time.perf_counter() - start:.1f}秒), 埋め込みなし {skipped}件", 8000)
+    def _backfill_phash_index(self):
+        """知覚ハッシュ未登録の画像 (機能追加前にスコアしたもの) を元画像から計算して登録。中断されたら False。"""
+        missing = [(img_id, d) for img_id, d in self.all_scores_data.items() if d.get("content_hash") and d["content_hash"] not in self.phash_index]
+        if not missing: return True
+        progress = QProgressDialog("知覚ハッシュを計算中...", "中止", 0, len(missing), self); progress.setWindowModality(Qt.WindowModal); progress.setMinimumDuration(500)
+        changed = False
+        for i, (img_id, d) in enumerate(missing):
+            if progress.wasCanceled(): break
+            progress.setValue(i)
+            value = phash_index_module.phash_from_hex(d[phash_index_module.PHASH_KEY]) if d.get(phash_index_module.PHASH_KEY) else None
+            if value is None and d.get("path") and Path(d["path"]).exists():
+                value = scoring_module.compute_phash_for_path(d["path"])
+                if value is not None: d[phash_index_module.PHASH_KEY] = phash_index_module.phash_to_hex(value); changed = True
+            self.phash_index.add(d["content_hash"], value)
+        canceled = progress.wasCanceled(); progress.setValue(len(missing)); self.phash_index.save()
+        if changed: self._save_all_data_to_json()
+        return not canceled
+    def show_near_duplicates_dialog(self):
+        """知覚ハッシュのハミング距離で近い画像をグループにまとめて一覧表示する。"""
+        if hasattr(self, 'scoring_thread') and self.scoring_thread and self.scoring_thread.isRunning():
+            QMessageBox.information(self, "処理中", "現在画像処理が実行中です。完了後に再度お試しください。"); return
+        radius, ok = QInputDialog.getInt(self, "近似重複の一覧", "ハミング距離 (64bit 中):", scoring_module.NEAR_DUP_MAX_DISTANCE, 0, phash_index_module.MAX_INDEXED_RADIUS)
+        if not ok or not self._backfill_phash_index(): return
+        start = time.perf_counter(); groups = self.phash_index.duplicate_groups(radius); elapsed = time.perf_counter() - start
+        ids_by_hash = {}
+        for img_id, d in self.all_scores_data.items():
+            if d.get("content_hash"): ids_by_hash.setdefault(d["content_hash"], []).append(img_id)
+        dialog = QDialog(self); dialog.setWindowTitle("近似重複の一覧"); dialog.resize(720, 480); layout = QVBoxLayout(dialog)
+        tree = QTreeWidget(); tree.setHeaderLabels(["画像", "スコア", "距離", "備考"]); shown = 0
+        for group in groups:
+            members = [(h, img_id) for h in group for img_id in ids_by_hash.get(h, [])]
+            if len(members) < 2: continue
+            shown += 1; group_item = QTreeWidgetItem(tree, [f"グループ {shown} ({len(members)}枚)"]); ref_hash = self.phash_index.get(members[0][0])
+            for h, img_id in members:
+                d = self.all_scores_data[img_id]; dist = bin(self.phash_index.get(h) ^ ref_hash).count("1")
+                note = f"{d['near_duplicate_of'][:12]}... から流用" if d.get("score_source") == "near_duplicate" and d.get("near_duplicate_of") else ""
+                QTreeWidgetItem(group_item, [d.get("filename", img_id), f"{d.get('score_final', 0.0):.2f}", str(dist), note])
+        tree.expandAll(); layout.addWidget(tree)
+        for column in range(4): tree.resizeColumnToContents(column)
+        layout.addWidget(QLabel(f"{shown}グループ / 登録 {len(self.phash_index)}件 (検索 {elapsed * 1000:.0f} ms, 距離はグループ先頭の画像から)"))
+        button_box = QDialogButtonBox(QDialogButtonBox.Close); button_box.rejected.connect(dialog.reject); layout.addWidget(button_box)
+        dialog.exec()
     def start_fs_watcher(self):
         self.fs_watcher_thread = FileSystemWatcherThread(str(IMAGES_ORIGINALS_DIR))
         self.fs_watcher_thread.new_image_detected.connect(self.handle_new_image_from_watcher)
@@ -450,8 +807,7 @@ class MainWindow(QMainWindow): # _update_dataframes_and_combined_view 以外は
     @Slot(str)
     def handle_new_image_from_watcher(self, image_path_str):
         self.show_status_message(f"新規画像検出: {Path(image_path_str).name}", 0)
-        if self.models_initialized_properly: self._scan_and_process_new_images()
-        else: self.show_status_message(f"モデル未初期化のため、{Path(image_path_str).name}の自動処理スキップ。",0)
+        if Path(image_path_str).stem not in self.all_scores_data: self.enqueue_scoring_jobs([image_path_str], job_queue_module.PRIORITY_WATCHER, "watcher")
     def toggle_delete_mode(self, checked):
         self.delete_mode = checked; self.delete_mode_button.setText("削除モード ON" if checked else "削除モード OFF")
         self.delete_mode_button.setStyleSheet("background-color: red; color: white;" if checked else "")
@@ -460,8 +816,8 @@ class MainWindow(QMainWindow): # _update_dataframes_and_combined_view 以外は
         dialog = SettingsDialog(self)
         if dialog.exec():
             self.gemini_api_key_loaded = os.getenv("GOOGLE_API_KEY", "")
-            self.penalties_config = scoring_module.load_penalties()
             self.show_status_message("設定を保存。一部は再起動後に有効。", 3000)
+            self.reload_penalties_and_repenalize()
             if hasattr(self.analysis_tab, 'gemini_thread') and self.analysis_tab.gemini_thread:
                  if self.analysis_tab.gemini_thread.isRunning(): self.analysis_tab.gemini_thread.cancel()
                  self.analysis_tab.gemini_thread = None
@@ -486,6 +842,9 @@ class MainWindow(QMainWindow): # _update_dataframes_and_combined_view 以外は
         item = QGraphicsPixmapItem(pixmap); scene.addItem(item); view = QGraphicsView(scene)
         view.setRenderHints(QPainter.Antialiasing | QPainter.SmoothPixmapTransform); view.setDragMode(QGraphicsView.ScrollHandDrag)
         view.setTransformationAnchor(QGraphicsView.AnchorUnderMouse); layout.addWidget(view)
+        rescore_button = QPushButton("この画像を再スコア"); layout.addWidget(rescore_button)
+        def rescore_this_image(): dialog.accept(); self.enqueue_scoring_jobs([orig_p_str], job_queue_module.PRIORITY_INTERACTIVE, "interactive")
+        rescore_button.clicked.connect(rescore_this_image)
         dialog.resize(min(pixmap.width() + 40, self.width() - 100), min(pixmap.height() + 40, self.height() - 100))
         view.fitInView(item, Qt.KeepAspectRatio); dialog.exec()
     def show_about_dialog(self):
@@ -494,7 +853,7 @@ class MainWindow(QMainWindow): # _update_dataframes_and_combined_view 以外は
         self.settings.setValue("geometry", self.saveGeometry())
         self.settings.setValue("windowState", self.saveState())
         self.settings.setValue("gallery_columns", self.columns_slider.value())
-        active_threads = []
+        self._closing = True; active_threads = []
         for thread_attr in ['fs_watcher_thread', 'model_init_thread', 'scoring_thread', 'sync_thread']:
             thread = getattr(self, thread_attr, None)
             if thread and thread.isRunning(): active_threads.append(thread)
@@ -507,6 +866,9 @@ class MainWindow(QMainWindow): # _update_dataframes_and_combined_view 以外は
                 elif hasattr(thread, 'stop'): thread.stop()
                 elif hasattr(thread, 'cancel'): thread.cancel()
                 thread.quit(); thread.wait(1500)
+        self._checkpoint_results()  # 未保存の結果を残し、残りのジョブは次回起動時に再開
+        self._shutdown_score_pool(); self.tag_store.save(); self.phash_index.save()
+        self.embedding_store.prune(d.get("content_hash") for d in self.all_scores_data.values()); self.embedding_store.flush()
         QApplication.instance().quit(); event.accept()
 
 class AnalysisTab(QWidget): # _update_filter_status, apply_filters 以外は変更なし
@@ -714,8 +1076,10 @@ class AnalysisTab(QWidget): # _update_filter_status, apply_filters 以外は変
         self.gemini_result_edit.append("\n\n[ユーザーにより解析がキャンセルされました]")
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # スコアリングプール (spawn) 用
     app = QApplication(sys.argv)
     main_win = MainWindow()
     main_win.show()
+    QTimer.singleShot(0, lambda: mark_startup("ウィンドウ表示 (操作可能)"))
     sys.exit(app.exec())
 
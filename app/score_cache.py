@@ -0,0 +1,94 @@
+# app/score_cache.py
+# ファイル内容ハッシュ + スコアラー + モデルバージョンをキーにした永続スコアキャッシュ (SQLite)。
+# リネーム・deleted/ からの復元・別名コピーされた画像を再推論せずに済ませるために使います。
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+BASE_DIR_CACHE = Path(__file__).resolve().parent.parent
+SCORE_CACHE_DB_PATH = BASE_DIR_CACHE / "cache" / "score_cache.sqlite"
+SCORE_CACHE_KEEP_VERSIONS = 3  # スコアラーごとに残すモデルバージョン数 (最近登録されたもの。GUI・ワーカー・CLI が別の構成で同じ DB を使うため)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    content_hash TEXT NOT NULL, scorer_id TEXT NOT NULL, model_version TEXT NOT NULL,
+    score_moe REAL, failure_tags TEXT NOT NULL, metadata TEXT NOT NULL, created_at TEXT NOT NULL,
+    tag_probs TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (content_hash, scorer_id, model_version));
+CREATE TABLE IF NOT EXISTS model_versions (
+    scorer_id TEXT NOT NULL, model_version TEXT NOT NULL, registered_at TEXT NOT NULL,
+    PRIMARY KEY (scorer_id, model_version));
+"""
+
+class ScoreCache:
+    """スレッドセーフな SQLite キャッシュ。プロセスごとに 1 接続 (WAL モードで複数プロセスからの同時利用可)。"""
+    def __init__(self, db_path=SCORE_CACHE_DB_PATH):
+        self.db_path = Path(db_path); self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            version_pk = [row[1] for row in self._conn.execute("PRAGMA table_info(model_versions)") if row[5]]
+            if version_pk == ["scorer_id"]: self._conn.execute("DROP TABLE model_versions")  # 旧形式 (スコアラーごとに 1 版だけ) は登録し直す
+            self._conn.executescript(_SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(scores)")}
+            if "tag_probs" not in columns: self._conn.execute("ALTER TABLE scores ADD COLUMN tag_probs TEXT NOT NULL DEFAULT '{}'")
+
+    def get_many(self, content_hashes, scorer_id, model_version):
+        """{content_hash: {"score_moe", "failure_tags", "metadata", "tag_probs"}} を返す (ヒットしたものだけ)。"""
+        hashes = list({h for h in content_hashes if h}); hits = {}
+        with self._lock:
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT content_hash, score_moe, failure_tags, metadata, tag_probs FROM scores WHERE scorer_id=? AND model_version=? "
+                    f"AND content_hash IN ({','.join('?' * len(chunk))})", [scorer_id, model_version, *chunk]).fetchall()
+                for content_hash, score_moe, tags_json, meta_json, probs_json in rows:
+                    hits[content_hash] = {"score_moe": score_moe, "failure_tags": json.loads(tags_json), "metadata": json.loads(meta_json),
+                                          "tag_probs": json.loads(probs_json)}
+        return hits
+
+    def get(self, content_hash, scorer_id, model_version):
+        return self.get_many([content_hash], scorer_id, model_version).get(content_hash)
+
+    def put_many(self, entries, scorer_id, model_version, created_at):
+        """entries: [(content_hash, score_moe, failure_tags, metadata, tag_probs), ...]"""
+        rows = [(h, scorer_id, model_version, score_moe, json.dumps(tags, ensure_ascii=False), json.dumps(meta, ensure_ascii=False, default=str),
+                 created_at, json.dumps(probs or {}, ensure_ascii=False))
+                for h, score_moe, tags, meta, probs in entries if h]
+        if not rows: return
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO scores (content_hash, scorer_id, model_version, score_moe, failure_tags, metadata, created_at, tag_probs) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def register_model_version(self, scorer_id, model_version, registered_at, keep=None):
+        """
+        使用中のモデルバージョンを登録 (登録日時を更新) し、同じスコアラーで最近登録された keep 版より古いバージョンのエントリを削除する。削除件数を返す。
+        別のプロセスが別のバージョン (ONNX 量子化の有無など) で同時に使っていても、keep 版以内なら互いのキャッシュを消さない。
+        """
+        keep = max(1, int(keep or SCORE_CACHE_KEEP_VERSIONS))
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO model_versions VALUES (?, ?, ?)", (scorer_id, model_version, registered_at))
+            kept = [row[0] for row in self._conn.execute("SELECT model_version FROM model_versions WHERE scorer_id=? ORDER BY registered_at DESC LIMIT ?", (scorer_id, keep))]
+            marks = ",".join("?" * len(kept))
+            self._conn.execute(f"DELETE FROM model_versions WHERE scorer_id=? AND model_version NOT IN ({marks})", (scorer_id, *kept))
+            evicted = self._conn.execute(f"DELETE FROM scores WHERE scorer_id=? AND model_version NOT IN ({marks})", (scorer_id, *kept)).rowcount
+        return evicted
+
+    def count(self):
+        with self._lock: return self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def close(self):
+        with self._lock: self._conn.close()
+
+_cache_instance = None; _cache_instance_lock = threading.Lock()
+
+def get_score_cache():
+    """プロセス内で共有するキャッシュを返す。開けない場合は None (キャッシュなしで続行)。"""
+    global _cache_instance
+    with _cache_instance_lock:
+        if _cache_instance is None:
+            try: _cache_instance = ScoreCache(SCORE_CACHE_DB_PATH)
+            except Exception as e_cache: print(f"[ScoreCache] キャッシュDBを開けません ({SCORE_CACHE_DB_PATH}): {e_cache}"); return None
+        return _cache_instance
@@ -0,0 +1,209 @@
+# app/score_cli.py
+# GUI (PySide6) なしで画像をまとめてスコアリングするコマンドライン版。
+# サーバーや cron で大量のアーカイブを埋めるときに使います。
+#   python -m app.score_cli images/originals --store                       # scores.json / metadata.json に直接書き込む
+#   python -m app.score_cli /data/archive -r --jsonl out.jsonl --skip-existing
+#   python -m app.score_cli --file-list paths.txt --workers 4 --device cpu --jsonl -
+# 進捗は標準エラー出力に出します (--jsonl - のとき標準出力は結果だけ)。
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+BASE_DIR_SCORE_CLI = Path(__file__).resolve().parent.parent
+SCORES_JSON_PATH = BASE_DIR_SCORE_CLI / "scores.json"       # GUI (qt_launcher) と同じ保存先
+METADATA_JSON_PATH = BASE_DIR_SCORE_CLI / "metadata.json"
+THUMBNAILS_DIR = BASE_DIR_SCORE_CLI / "images" / "thumbnails"
+DEFAULT_CHECKPOINT_INTERVAL = 500  # --store: この枚数ごとに途中保存
+PROGRESS_INTERVAL_SEC = 2.0
+
+def log(message): print(f"[ScoreCLI] {message}", file=sys.stderr, flush=True)
+
+class _LogProgress:
+    """scoring の初期化は Qt の Signal と同じ emit(msg, pct) で進捗を通知するので、それをログに流す。"""
+    def emit(self, message, _percent=None): log(message)
+
+def collect_image_paths(inputs, file_list=None, recursive=False, extensions=None):
+    """ディレクトリ/ファイル/ファイル一覧から対象画像のパスを重複なく集める (指定順)。"""
+    from . import scoring as scoring_module
+    extensions = tuple(extensions or scoring_module.WATCHED_EXTENSIONS); found = {}
+    def add(path):
+        path = Path(path)
+        if path.suffix.lower() in extensions: found.setdefault(str(path.resolve()), None)
+    for entry in inputs:
+        entry = Path(entry)
+        if entry.is_dir():
+            for path in sorted(entry.rglob("*") if recursive else entry.glob("*")):
+                if path.is_file(): add(path)
+        elif entry.is_file(): add(entry)
+        else: log(f"見つかりません: {entry}")
+    if file_list:
+        stream = sys.stdin if file_list == "-" else open(file_list, 'r', encoding='utf-8')
+        try:
+            for line in stream:
+                if line.strip(): add(line.strip())
+        finally:
+            if stream is not sys.stdin: stream.close()
+    return list(found)
+
+def _load_json(path, default):
+    if not Path(path).exists(): return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f: return json.load(f)
+    except Exception as e_load: log(f"{Path(path).name} の読込失敗: {e_load}"); raise
+
+def _write_json_atomic(path, data):
+    path = Path(path); tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+class StoreSink:
+    """
+    結果を GUI と同じ scores.json / metadata.json と、タグ確率・CLIP 埋め込み・知覚ハッシュの各ストアに書き込む。
+    (MainWindow.on_single_image_processed と同じ受け取り方)
+    """
+    def __init__(self, scores_path=SCORES_JSON_PATH, metadata_path=METADATA_JSON_PATH, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, embedding_model_id=None):
+        from . import scoring as scoring_module, phash_index as phash_index_module
+        from .tag_store import get_tag_store
+        from .embedding_store import get_embedding_store
+        self.scoring = scoring_module; self.phash = phash_index_module
+        self.scores_path = Path(scores_path); self.metadata_path = Path(metadata_path); self.checkpoint_interval = max(1, checkpoint_interval)
+        self.scores = _load_json(self.scores_path, {}); self.metadata = _load_json(self.metadata_path, {})
+        self.tag_store = get_tag_store(); self.embedding_store = get_embedding_store(); self.phash_index = phash_index_module.get_phash_index()
+        self.embedding_model_id = embedding_model_id  # 既定のモデルID (None なら自プロセスのモデル)
+        self._lock = threading.Lock(); self._since_checkpoint = 0
+
+    def existing_ids(self): return set(self.scores)
+
+    def __call__(self, image_id, score_data, metadata, embedding_model_id=None):
+        """embedding_model_id: 埋め込みを推論したモデルのID (別マシンの結果を受け取る score_cluster が画像ごとに渡す)。"""
+        with self._lock:
+            self.tag_store.absorb(image_id, score_data.pop(self.scoring.TAG_PROBS_KEY, None))
+            model_id = embedding_model_id or self.embedding_model_id or self.scoring.aesthetic_embedding_model_id()
+            self.embedding_store.add(score_data.get("content_hash"), score_data.pop(self.scoring.CLIP_EMBEDDING_KEY, None), model_id)
+            if score_data.get(self.phash.PHASH_KEY): self.phash_index.add(score_data.get("content_hash"), self.phash.phash_from_hex(score_data[self.phash.PHASH_KEY]))
+            self.scores[image_id] = score_data; self.metadata[image_id] = metadata; self._since_checkpoint += 1
+            if self._since_checkpoint >= self.checkpoint_interval: self._save_locked()
+
+    def _save_locked(self):
+        self.tag_store.save(); self.embedding_store.flush(); self.phash_index.save()
+        _write_json_atomic(self.scores_path, self.scores); _write_json_atomic(self.metadata_path, self.metadata); self._since_checkpoint = 0
+
+    def close(self):
+        with self._lock: self._save_locked()
+
+class JsonlSink:
+    """1 画像 1 行 ({"id", "score", "metadata"}) で書き出す。path が "-" なら標準出力。追記モード。"""
+    def __init__(self, path):
+        from . import scoring as scoring_module
+        self.scoring = scoring_module; self.path = path; self._lock = threading.Lock()
+        self._existing = set()
+        if path != "-" and Path(path).exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try: self._existing.add(json.loads(line)["id"])
+                    except (json.JSONDecodeError, KeyError): continue
+        self._stream = sys.stdout if path == "-" else open(path, 'a', encoding='utf-8')
+
+    def existing_ids(self): return self._existing
+
+    def __call__(self, image_id, score_data, metadata, embedding_model_id=None):
+        score_data.pop(self.scoring.CLIP_EMBEDDING_KEY, None); tag_probs = score_data.pop(self.scoring.TAG_PROBS_KEY, None)
+        line = json.dumps({"id": image_id, "score": score_data, "metadata": metadata, "tag_probs": tag_probs}, ensure_ascii=False, default=str)
+        with self._lock: self._stream.write(line + "\n"); self._stream.flush()
+
+    def close(self):
+        if self._stream is not sys.stdout: self._stream.close()
+
+class ProgressReporter:
+    """一定間隔で処理枚数・速度・残り時間を標準エラー出力に出す。"""
+    def __init__(self, total):
+        self.total = total; self.start = time.perf_counter(); self._last = 0.0; self.done = 0
+
+    def __call__(self, done, _total=None):
+        self.done = done; now = time.perf_counter()
+        if now - self._last < PROGRESS_INTERVAL_SEC and done < self.total: return
+        self._last = now; elapsed = now - self.start; rate = done / elapsed if elapsed > 0 else 0.0
+        eta = f"{(self.total - done) / rate:.0f}秒" if rate > 0 else "-"
+        log(f"{done}/{self.total} ({rate:.2f} 枚/秒, 残り {eta})")
+
+def _run_interruptible(target, stop):
+    """target を別スレッドで実行し、Ctrl+C なら stop() を呼んで終了を待つ。中断されたら True。"""
+    worker = threading.Thread(target=target, name="score-cli", daemon=True); worker.start()
+    try:
+        while worker.is_alive(): worker.join(0.5)
+        return False
+    except KeyboardInterrupt:
+        log("中断要求を受け付けました。処理中のバッチを終えて保存します..."); stop(); worker.join()
+        return True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.score_cli", description="GUI なしで画像をまとめてスコアリングします。")
+    parser.add_argument("inputs", nargs="*", help="画像ファイルまたはディレクトリ")
+    parser.add_argument("--file-list", default=None, help="1 行 1 パスのファイル (- で標準入力)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="ディレクトリを再帰的に探す")
+    out_group = parser.add_mutually_exclusive_group(required=True)
+    out_group.add_argument("--jsonl", default=None, help="結果を JSON Lines で書き出す (- で標準出力)")
+    out_group.add_argument("--store", action="store_true", help="GUI と同じ scores.json / metadata.json に書き込む")
+    parser.add_argument("--workers", type=int, default=0, help="プロセスプールのワーカー数 (0 = 単一プロセスのパイプライン)")
+    parser.add_argument("--threads-per-worker", type=int, default=0, help="ワーカーあたりのスレッド数 (0 = 自動)")
+    parser.add_argument("--batch-size", type=int, default=None, help="推論バッチサイズ")
+    parser.add_argument("--device", choices=("auto", "cpu"), default="auto", help="cpu で GPU を使わない (プロセスプールは常に CPU)")
+    parser.add_argument("--skip-existing", action="store_true", help="出力先に同じ画像IDがあればスキップ")
+    parser.add_argument("--thumbnails", default=None, help="サムネイルの保存先 (--store の既定は images/thumbnails、--jsonl の既定は作らない)")
+    parser.add_argument("--cascade", choices=("off", "clip_b32", "ddb"), default=None, help="カスケード採点 (仮スコアが削除の目安付近の画像だけ ViT-L で採点)")
+    parser.add_argument("--delete-threshold", type=float, default=None, help="--cascade: 削除の目安にしている score_final")
+    parser.add_argument("--concurrent-inference", action="store_true", help="CLIP と DeepDanbooru を同時に推論 (メモリを多く使う)")
+    parser.add_argument("--checkpoint", type=int, default=DEFAULT_CHECKPOINT_INTERVAL, help="--store: 途中保存の間隔 (枚)")
+    args = parser.parse_args(argv)
+
+    from . import scoring as scoring_module, pipeline as pipeline_module, score_pool as score_pool_module, perf_stats as perf_stats_module
+    paths = collect_image_paths(args.inputs, args.file_list, args.recursive)
+    if not paths: log("対象画像がありません。"); return 1
+    sink = StoreSink(checkpoint_interval=args.checkpoint) if args.store else JsonlSink(args.jsonl)
+    if args.skip_existing:
+        existing = sink.existing_ids(); before = len(paths); paths = [p for p in paths if Path(p).stem not in existing]
+        log(f"既存の {before - len(paths)}件をスキップします。")
+    if not paths: log("処理対象はすべて処理済みです。"); sink.close(); return 0
+    thumbnail_dir = Path(args.thumbnails) if args.thumbnails else (THUMBNAILS_DIR if args.store else None)
+    if thumbnail_dir is not None: thumbnail_dir.mkdir(parents=True, exist_ok=True)
+    if args.batch_size: scoring_module.SCORING_BATCH_SIZE = max(1, args.batch_size)
+    if args.cascade: scoring_module.CASCADE_MODE = args.cascade
+    if args.concurrent_inference: scoring_module.CONCURRENT_INFERENCE = True
+    if args.delete_threshold is not None: scoring_module.CASCADE_DELETE_THRESHOLD = args.delete_threshold
+    pool_allowed, unsafe_plugins = scoring_module.scorer_plugins_module.process_pool_allowed(scoring_module.SCORER_PLUGINS)
+    if args.workers > 0 and not pool_allowed: log(f"マルチプロセス非対応のプラグイン ({', '.join(unsafe_plugins)}) があるため、単一プロセスで処理します。"); args.workers = 0
+    penalties_config = scoring_module.load_penalties(); progress = ProgressReporter(len(paths))
+    log(f"{len(paths)}枚をスコアリングします ({'プロセスプール ' + str(args.workers) + 'ワーカー' if args.workers > 0 else '単一プロセス'}, バッチ {scoring_module.SCORING_BATCH_SIZE})")
+
+    lost_paths = []; pipeline_error = None
+    try:
+        if args.workers > 0:
+            pool = score_pool_module.ScoringProcessPool(args.workers, args.threads_per_worker); stop_event = threading.Event()
+            runtime_settings = scoring_module.export_runtime_settings()
+            if pool.start(runtime_settings, progress_callback=lambda msg, _p: log(msg)) == 0: log("ワーカーのモデル初期化に失敗しました。"); return 2
+            try:
+                interrupted = _run_interruptible(lambda: pool.score(paths, penalties_config, thumbnail_dir=thumbnail_dir, on_result=sink, on_progress=progress,
+                                                                    stop_event=stop_event, runtime_settings=runtime_settings), stop_event.set)
+                lost_paths = pool.lost_paths
+            finally: pool.shutdown(wait=True)
+        else:
+            scoring_module.initialize_all_models(force_cpu=args.device == "cpu", progress_callback=_LogProgress())
+            if not scoring_module.INITIALIZED_SUCCESSFULLY: log("モデル初期化に失敗しました。"); return 2
+            ingest_pipeline = pipeline_module.IngestPipeline(paths, penalties_config, thumbnail_dir=thumbnail_dir, on_result=sink, on_progress=progress)
+            interrupted = _run_interruptible(ingest_pipeline.run, ingest_pipeline.stop)
+            lost_paths = ingest_pipeline.failed_paths; pipeline_error = ingest_pipeline.error
+    finally: sink.close()
+    perf_stats_module.get_perf_stats().flush(reason="score_cli")
+    if scoring_module.cascade_report_text(): log(scoring_module.cascade_report_text())
+    elapsed = time.perf_counter() - progress.start
+    log(f"{'中断' if interrupted else '完了'}: {progress.done}/{len(paths)}枚, {elapsed:.1f}秒 ({progress.done / elapsed if elapsed > 0 else 0:.2f} 枚/秒)")
+    if lost_paths: log(f"スコアリングできなかった画像 {len(lost_paths)}件: {lost_paths[:5]}")
+    if pipeline_error: log(f"処理を途中で中止しました ({pipeline_error})"); return 1
+    return 130 if interrupted else (3 if lost_paths else 0)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+# app/score_cluster.py
+# 複数マシンでのスコアリング。コーディネーターが画像一覧をシャードに分け、
+# 各マシンで動いている score_service (python -m app.score_service --host 0.0.0.0 --path-root ...) の
+# /score_shard に HTTP で配ります。ワーカーはモデルを起動時に 1 回だけロードし、以後シャードを処理し続けます。
+# 落ちたワーカーのシャードは他のワーカーに回し直し、結果は scores.json / metadata.json (または JSONL) にまとめます。
+#   python -m app.score_cluster /mnt/archive -r --store --worker http://host1:8765 --worker http://host2:8765
+#   python -m app.score_cluster /mnt/archive -r --jsonl out.jsonl --worker ... --path-map /mnt/archive=D:/archive
+# 画像はワーカーからも見える共有ストレージに置いておきます (パスの見え方が違う場合は --path-map)。
+import argparse
+import base64
+import collections
+import http.client
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from . import score_cli as score_cli_module
+
+CLUSTER_SHARD_SIZE = 64            # 1 シャードの枚数
+CLUSTER_INFLIGHT_PER_WORKER = 2    # ワーカーごとに同時に送るシャード数 (転送と推論を重ねる)
+CLUSTER_SHARD_TIMEOUT = 600.0      # 1 シャードの応答待ち上限 (秒)
+CLUSTER_MAX_ATTEMPTS = 3           # シャードを諦めるまでの試行回数
+CLUSTER_WORKER_RETRY_SEC = 30.0    # 失敗したワーカーに再び送るまでの待ち時間
+CLUSTER_STARTUP_TIMEOUT = 600.0    # ワーカーのモデル初期化を待つ上限 (秒)
+REPORT_INTERVAL_SEC = 10.0
+
+def log(message): print(f"[ScoreCluster] {message}", file=sys.stderr, flush=True)
+
+def _http_json(url, payload=None, timeout=30.0):
+    data = None if payload is None else json.dumps(payload).encode("utf-8")
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"} if data else {})
+    with urllib.request.urlopen(request, timeout=timeout) as response: return json.load(response)
+
+def parse_path_map(specs):
+    """["SRC=DST", ...] を [(SRC, DST), ...] に (長い SRC から順に当てる)。"""
+    pairs = []
+    for spec in specs or []:
+        src, sep, dst = spec.partition("=")
+        if not sep: raise ValueError(f"--path-map は SRC=DST の形式で指定してください: {spec}")
+        pairs.append((src.rstrip("/\\"), dst.rstrip("/\\")))
+    return sorted(pairs, key=lambda p: len(p[0]), reverse=True)
+
+def map_path(path, path_map):
+    for src, dst in path_map:
+        if path == src or path.startswith(src + "/") or path.startswith(src + "\\"): return dst + path[len(src):]
+    return path
+
+class WorkerNode:
+    """1 台のワーカー (score_service) の状態と処理実績。"""
+    def __init__(self, url):
+        self.url = url.rstrip("/"); self.images = 0; self.shards = 0; self.failures = 0; self.busy_sec = 0.0
+        self.available_at = 0.0; self.embedding_model_id = None; self.alive = False
+
+    def wait_ready(self, timeout):
+        """/health がモデル初期化済みを返すまで待つ。"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                health = _http_json(self.url + "/health", timeout=10.0)
+                if health.get("models_initialized"):
+                    self.embedding_model_id = health.get("embedding_model_id"); self.alive = True
+                    log(f"{self.url}: 準備完了 (device={health.get('device')})"); return True
+            except (urllib.error.URLError, OSError, ValueError): pass
+            time.sleep(2.0)
+        log(f"{self.url}: {timeout:.0f}秒以内に準備できませんでした。"); return False
+
+class ClusterCoordinator:
+    """
+    シャードの待ち行列をワーカーごとのスレッドで取り合う。失敗したシャードは待ち行列に戻し (最大 CLUSTER_MAX_ATTEMPTS 回)、
+    失敗したワーカーは CLUSTER_WORKER_RETRY_SEC だけ休ませてから再び使う。全ワーカーが使えなくなったら終了する。
+    """
+    def __init__(self, worker_urls, sink, shard_size=None, inflight=None, path_map=None, thumbnail_dir=None):
+        self.workers = [WorkerNode(u) for u in worker_urls]; self.sink = sink
+        self.shard_size = max(1, int(shard_size or CLUSTER_SHARD_SIZE)); self.inflight = max(1, int(inflight or CLUSTER_INFLIGHT_PER_WORKER))
+        self.path_map = path_map or []; self.thumbnail_dir = Path(thumbnail_dir) if thumbnail_dir else None
+        self._shards = collections.deque(); self._lock = threading.Lock(); self._stop_event = threading.Event()
+        self._ready = []; self.started_at = None; self._outstanding = 0; self.done_images = 0; self.failed_paths = []; self.missing_paths = []; self.retried_shards = 0; self.total = 0
+
+    def stop(self): self._stop_event.set()
+
+    def run(self, paths):
+        """全画像を処理し終える (または stop / 全ワーカー停止) まで待つ。処理した枚数を返す。"""
+        paths = list(paths); self.total = len(paths)
+        self._shards.extend((paths[i:i + self.shard_size], 0) for i in range(0, len(paths), self.shard_size)); self._outstanding = len(self._shards)
+        ready = self._ready = [w for w in self.workers if w.wait_ready(CLUSTER_STARTUP_TIMEOUT)]
+        if not ready: log("使えるワーカーがありません。"); return 0
+        if len({w.embedding_model_id for w in ready}) > 1: log("注意: ワーカー間でモデルが異なります (埋め込みはそれぞれのモデルIDで保存されます)。")
+        self.started_at = time.perf_counter()
+        threads = [threading.Thread(target=self._worker_loop, args=(w,), name=f"cluster-{i}-{j}", daemon=True) for i, w in enumerate(ready) for j in range(self.inflight)]
+        reporter = threading.Thread(target=self._report_loop, name="cluster-report", daemon=True)
+        for t in threads: t.start()
+        reporter.start()
+        for t in threads: t.join()
+        self._stop_event.set(); reporter.join()
+        with self._lock: self.failed_paths.extend(p for shard, _ in self._shards for p in shard); self._shards.clear()
+        return self.done_images
+
+    def _take(self, worker):
+        """次のシャードを取り出す。待ちがなく未完了もなければ None (終了)。"""
+        while not self._stop_event.is_set():
+            with self._lock:
+                if self._outstanding == 0 or worker.failures >= CLUSTER_MAX_ATTEMPTS: return None  # 連続で失敗し続けるワーカーは外す
+                if all(w.failures >= CLUSTER_MAX_ATTEMPTS for w in self._ready): return None
+                if worker.available_at <= time.monotonic() and self._shards: return self._shards.popleft()
+            time.sleep(0.2)
+        return None
+
+    def _worker_loop(self, worker):
+        while True:
+            item = self._take(worker)
+            if item is None: return
+            shard, attempts = item; start = time.perf_counter()
+            try: response = _http_json(worker.url + "/score_shard", {"paths": [map_path(p, self.path_map) for p in shard], "thumbnails": self.thumbnail_dir is not None}, timeout=CLUSTER_SHARD_TIMEOUT)
+            except (urllib.error.URLError, http.client.HTTPException, OSError, ValueError) as e_shard:
+                self._shard_failed(worker, shard, attempts, e_shard); continue
+            try: self._merge(worker, shard, response)
+            except Exception as e_merge:  # 書き出し側の失敗はワーカーのせいではないので再試行せず、シャードを失敗として数える (スレッドごと落とさない)
+                log(f"{worker.url}: シャード ({len(shard)}枚) の結果を書き出せませんでした: {e_merge}")
+                with self._lock: self.failed_paths.extend(shard); self._outstanding -= 1
+                continue
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                worker.shards += 1; worker.images += len(response.get("results", [])); worker.busy_sec += elapsed; worker.failures = 0; worker.alive = True
+                self._outstanding -= 1
+
+    def _shard_failed(self, worker, shard, attempts, error):
+        with self._lock:
+            worker.failures += 1; worker.alive = False; worker.available_at = time.monotonic() + CLUSTER_WORKER_RETRY_SEC
+            if attempts + 1 < CLUSTER_MAX_ATTEMPTS: self._shards.append((shard, attempts + 1)); self.retried_shards += 1; note = "他のワーカーで再試行します"
+            else: self.failed_paths.extend(shard); self._outstanding -= 1; note = f"{CLUSTER_MAX_ATTEMPTS}回失敗したため諦めます"
+        log(f"{worker.url}: シャード ({len(shard)}枚) 失敗: {error} ({note})")
+
+    def _merge(self, worker, shard, response):
+        """
+        ワーカーの結果をコーディネーター側のパスに戻して sink に渡す。埋め込みのモデルIDは呼び出しごとに渡す (sink は全スレッドで共有)。
+        ワーカーから見えなかった画像 (missing) は失敗として数える。
+        """
+        import numpy as np
+        by_worker_path = {map_path(p, self.path_map): p for p in shard}; model_id = response.get("embedding_model_id") or worker.embedding_model_id
+        scoring_module = self.sink.scoring
+        for item in response.get("results", []):
+            local_path = by_worker_path.get(item["path"], item["path"]); score_data = item["score"]; score_data["path"] = local_path
+            if item.get("embedding") is not None: score_data[scoring_module.CLIP_EMBEDDING_KEY] = np.asarray(item["embedding"], dtype=np.float32)
+            if item.get("thumbnail_jpeg_b64") and self.thumbnail_dir is not None:
+                thumb_name = f"{item['id']}.jpg"; (self.thumbnail_dir / thumb_name).write_bytes(base64.b64decode(item["thumbnail_jpeg_b64"]))
+                score_data["thumbnail_path_local"] = str(self.thumbnail_dir / thumb_name); score_data["thumbnail_web_path"] = f"{scoring_module.THUMBNAIL_WEB_PREFIX}/{thumb_name}"
+            self.sink(item["id"], score_data, item["metadata"], embedding_model_id=model_id)
+        missing = [by_worker_path.get(p, p) for p in response.get("missing", [])]
+        with self._lock:
+            self.done_images += len(response.get("results", [])); worker.embedding_model_id = model_id
+            self.missing_paths.extend(missing); self.failed_paths.extend(missing)
+
+    def throughput_report(self):
+        elapsed = max(1e-9, time.perf_counter() - (self.started_at or time.perf_counter()))
+        with self._lock:
+            lines = [f"{self.done_images}/{self.total}枚 ({self.done_images / elapsed:.2f} 枚/秒, 再試行 {self.retried_shards}シャード, 失敗 {len(self.failed_paths)}枚)"]
+            for w in self.workers:
+                state = "稼働" if w.alive else ("停止" if w.failures >= CLUSTER_MAX_ATTEMPTS or w not in self._ready else "休止")
+                lines.append(f"  {w.url:<32} {state}  {w.images:>7}枚 {w.shards:>5}シャード  {w.images / elapsed:.2f} 枚/秒 (処理中 {w.images / w.busy_sec if w.busy_sec else 0:.2f})")
+        return "\n".join(lines)
+
+    def _report_loop(self):
+        while not self._stop_event.wait(REPORT_INTERVAL_SEC): log(self.throughput_report())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.score_cluster", description="複数マシンの score_service に画像を分配してスコアリングします。")
+    parser.add_argument("inputs", nargs="*", help="画像ファイルまたはディレクトリ")
+    parser.add_argument("--file-list", default=None, help="1 行 1 パスのファイル (- で標準入力)")
+    parser.add_argument("-r", "--recursive", action="store_true")
+    parser.add_argument("--worker", action="append", required=True, help="ワーカーの URL (例: http://host1:8765、複数指定)")
+    out_group = parser.add_mutually_exclusive_group(required=True)
+    out_group.add_argument("--jsonl", default=None, help="結果を JSON Lines で書き出す (- で標準出力)")
+    out_group.add_argument("--store", action="store_true", help="scores.json / metadata.json に書き込む")
+    parser.add_argument("--shard-size", type=int, default=CLUSTER_SHARD_SIZE); parser.add_argument("--inflight", type=int, default=CLUSTER_INFLIGHT_PER_WORKER)
+    parser.add_argument("--path-map", action="append", default=None, help="コーディネーターのパス=ワーカーのパス (先頭一致、複数可)")
+    parser.add_argument("--skip-existing", action="store_true"); parser.add_argument("--no-thumbnails", action="store_true", help="--store でもサムネイルを作らない")
+    parser.add_argument("--checkpoint", type=int, default=score_cli_module.DEFAULT_CHECKPOINT_INTERVAL)
+    parser.add_argument("--report", default=None, help="最終的な処理実績 (JSON) の保存先")
+    args = parser.parse_args(argv)
+
+    try: path_map = parse_path_map(args.path_map)
+    except ValueError as e_map: log(str(e_map)); return 1
+    paths = score_cli_module.collect_image_paths(args.inputs, args.file_list, args.recursive)
+    if not paths: log("対象画像がありません。"); return 1
+    sink = score_cli_module.StoreSink(checkpoint_interval=args.checkpoint) if args.store else score_cli_module.JsonlSink(args.jsonl)
+    if args.skip_existing:
+        existing = sink.existing_ids(); before = len(paths); paths = [p for p in paths if Path(p).stem not in existing]
+        log(f"既存の {before - len(paths)}件をスキップします。")
+    thumbnail_dir = score_cli_module.THUMBNAILS_DIR if args.store and not args.no_thumbnails else None
+    if thumbnail_dir is not None: thumbnail_dir.mkdir(parents=True, exist_ok=True)
+    coordinator = ClusterCoordinator(args.worker, sink, args.shard_size, args.inflight, path_map, thumbnail_dir)
+    log(f"{len(paths)}枚を {len(args.worker)}台のワーカーに {coordinator.shard_size}枚ずつ配ります。")
+    try: interrupted = score_cli_module._run_interruptible(lambda: coordinator.run(paths), coordinator.stop) if paths else False
+    finally: sink.close()
+    if coordinator.started_at is not None: log("最終結果:\n" + coordinator.throughput_report())
+    if coordinator.missing_paths: log(f"ワーカーから見えなかった画像 {len(coordinator.missing_paths)}件 (--path-map を確認してください): {coordinator.missing_paths[:5]}")
+    if args.report:
+        Path(args.report).write_text(json.dumps({"done": coordinator.done_images, "total": coordinator.total, "failed": coordinator.failed_paths, "missing": coordinator.missing_paths,
+                                                 "workers": [{"url": w.url, "images": w.images, "shards": w.shards, "busy_sec": round(w.busy_sec, 2)} for w in coordinator.workers]},
+                                                indent=2, ensure_ascii=False), encoding="utf-8")
+    if interrupted: return 130
+    return 0 if not coordinator.failed_paths else 3
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# app/score_pool.py
+# CPU 専用ホスト向けのマルチプロセス スコアリングプール。
+# 各ワーカープロセスが CLIP Aesthetic Predictor と DeepDanbooru を 1 回だけロードし、
+# 割り当てられたコア数のスレッドで推論します (GIL と単一プロセスのスレッド設定の制約を回避)。
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from . import perf_stats as perf_stats_module
+
+SCORE_POOL_WORKERS = 0             # 0 = 無効 (スレッドパイプラインを使用)
+SCORE_POOL_THREADS_PER_WORKER = 0  # 0 = CPU コア数 / ワーカー数
+
+def default_threads_per_worker(workers):
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+def _limit_threads(threads, worker_index):
+    # ネイティブライブラリのスレッド数を制限し、可能ならコアのスライスに固定する
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    if hasattr(os, "sched_setaffinity"):
+        cpu_count = os.cpu_count() or 1; start = (worker_index * threads) % cpu_count
+        try: os.sched_setaffinity(0, {(start + i) % cpu_count for i in range(threads)})
+        except OSError as e_aff: print(f"[ScorePool] CPUアフィニティ設定失敗: {e_aff}")
+
+def _worker_init(worker_counter, threads, runtime_settings):
+    with worker_counter.get_lock():
+        worker_index = worker_counter.value; worker_counter.value += 1
+    _limit_threads(threads, worker_index)
+    from . import scoring as scoring_module
+    if scoring_module.load_backend("torch"):
+        scoring_module.torch.set_num_threads(threads); scoring_module.torch.set_num_interop_threads(1)
+    scoring_module.apply_runtime_settings(runtime_settings)
+    scoring_module.ONNX_INTRA_OP_THREADS = scoring_module.TORCH_INTRA_OP_THREADS = threads  # ONNX Runtime / torch 高速化プロファイルをワーカーの割当コア数に合わせる
+    print(f"[ScorePool] ワーカー {worker_index} (pid {os.getpid()}, {threads}スレッド) モデル初期化中...")
+    scoring_module.initialize_all_models(force_cpu=True, progress_callback=None)
+    perf_stats_module.get_perf_stats().export_enabled = True  # ステージ計測を結果と一緒に親プロセスへ返す
+
+def _worker_ready():
+    from . import scoring as scoring_module
+    return os.getpid(), scoring_module.INITIALIZED_SUCCESSFULLY
+
+def _worker_process(image_path_strs, penalties_config, thumbnail_dir, runtime_settings=None, use_cache=True):
+    from . import scoring as scoring_module
+    if runtime_settings: scoring_module.apply_runtime_settings(runtime_settings)  # 起動後に変わったしきい値等を反映
+    results = scoring_module.process_images_batch(image_path_strs, penalties_config, thumbnail_dir=thumbnail_dir, use_cache=use_cache)
+    return results, perf_stats_module.get_perf_stats().drain_samples()
+
+class ScoringProcessPool:
+    """
+    K 個のワーカープロセスを保持するプール。モデルは各ワーカーの起動時に 1 回だけロードされ、
+    shutdown() まで使い回されます。画像はパスで渡し、ワーカー側で 1 回デコードします。
+    """
+    def __init__(self, workers, threads_per_worker=0):
+        self.workers = max(1, int(workers))
+        self.threads_per_worker = int(threads_per_worker) or default_threads_per_worker(self.workers)
+        self._executor = None; self._lock = threading.Lock(); self.lost_paths = []
+
+    @property
+    def started(self): return self._executor is not None
+
+    def start(self, runtime_settings=None, progress_callback=None):
+        """ワーカーを起動し、全ワーカーのモデルロード完了まで待つ。成功したワーカー数を返す。"""
+        with self._lock:
+            if self._executor is not None: return self.workers
+            ctx = multiprocessing.get_context("spawn")
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=_worker_init,
+                                                 initargs=(ctx.Value("i", 0), self.threads_per_worker, runtime_settings or {}))
+        if progress_callback: progress_callback(f"スコアリングプール起動中 ({self.workers}ワーカー × {self.threads_per_worker}スレッド)...", 0)
+        ready = set(); futures = [self._executor.submit(_worker_ready) for _ in range(self.workers * 2)]
+        for future in as_completed(futures):
+            try:
+                pid, ok = future.result()
+                if ok: ready.add(pid)
+            except Exception as e_ready: print(f"[ScorePool] ワーカー起動失敗: {e_ready}")
+        print(f"[ScorePool] 初期化済みワーカー: {len(ready)}/{self.workers}")
+        return len(ready)
+
+    def score(self, image_path_strs, penalties_config, thumbnail_dir=None, batch_size=None,
+              on_result=None, on_progress=None, stop_event=None, runtime_settings=None, use_cache=True):
+        """
+        画像を batch_size 枚ずつワーカーに配り、完了したものから on_result(image_id, score_data, metadata) で返す。
+        stop_event がセットされると未着手のバッチを取り消す。use_cache=False ならスコアキャッシュを使わない。処理した枚数を返す。
+        ワーカープロセスが落ちて (BrokenProcessPool) プールが使えなくなったら、プールを作り直して未完了のバッチを 1 回だけ再投入する。
+        それでも処理できなかった画像は lost_paths に残す。
+        """
+        if not self.started: self.start(runtime_settings)
+        from . import scoring as scoring_module
+        batch_size = max(1, int(batch_size or scoring_module.SCORING_BATCH_SIZE))
+        paths = [str(p) for p in image_path_strs]; total = len(paths); done = 0; self.lost_paths = []
+        thumb_dir_str = str(thumbnail_dir) if thumbnail_dir is not None else None
+        chunks = [paths[i:i + batch_size] for i in range(0, total, batch_size)]
+        for attempt in range(2):
+            futures = {self._executor.submit(_worker_process, chunk, penalties_config, thumb_dir_str, runtime_settings, use_cache): chunk for chunk in chunks}; broken = []
+            for future in as_completed(futures):
+                if stop_event is not None and stop_event.is_set():
+                    for f in futures: f.cancel()
+                    return done
+                try: results, perf_samples = future.result(); perf_stats_module.get_perf_stats().merge_samples(perf_samples)
+                except BrokenProcessPool: broken.append(futures[future]); continue  # 残りのバッチも同じ例外で終わるので、まとめて後で扱う
+                except Exception as e_worker:
+                    print(f"[ScorePool] ワーカーでのスコアリング失敗: {e_worker}"); results = []
+                for image_id, score_data, metadata in results:
+                    if on_result: on_result(image_id, score_data, metadata)
+                done += len(futures[future])
+                if on_progress: on_progress(done, total)
+            if not broken: break
+            lost = sum(len(chunk) for chunk in broken)
+            if attempt == 0:
+                print(f"[ScorePool] ワーカープロセスが異常終了しました。プールを作り直し、未完了の {lost}枚を再投入します。")
+                self.shutdown(wait=False)
+                if self.start(runtime_settings) > 0: chunks = broken; continue
+            self.lost_paths = [p for chunk in broken for p in chunk]
+            print(f"[ScorePool] ワーカープロセスの異常終了により {lost}枚をスコアリングできませんでした (例: {self.lost_paths[:3]})")
+            done += lost  # 進捗は最後まで進める (失敗したバッチと同じ扱い)
+            if on_progress: on_progress(done, total)
+            break
+        return done
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+            print("[ScorePool] ワーカープロセスを終了しました。")
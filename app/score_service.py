@@ -0,0 +1,278 @@
+# app/score_service.py
+# LAN 内の生成ホストからスコアを問い合わせるための常駐 HTTP サービス (asyncio、標準ライブラリのみ)。
+# 同時に届いたリクエストを短い時間窓でまとめ、process_images_batch の 1 回の推論で処理します。
+#   python -m app.score_service                              # 127.0.0.1:8765 で待ち受け
+#   python -m app.score_service --host 0.0.0.0 --path-root D:/outputs
+# エンドポイント:
+#   POST /score    画像本体 (Content-Type: image/* または application/octet-stream、?filename=xxx.png で拡張子を指定)
+#                  または JSON {"path": "..."} (--path-root 以下のファイルのみ)
+#   POST /score_shard  JSON {"paths": [...], "thumbnails": bool} をまとめて処理 (score_cluster のコーディネーターが使う)
+#   GET  /health   モデルの状態と待ち行列
+#   GET  /metrics  リクエスト数・バッチサイズ・レイテンシ・ステージ別時間
+import argparse
+import asyncio
+import base64
+import collections
+import json
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+BASE_DIR_SCORE_SERVICE = Path(__file__).resolve().parent.parent
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+SERVICE_BATCH_WINDOW_MS = 25      # 最初のリクエストからこの時間だけ後続を待ってバッチにする
+SERVICE_MAX_QUEUE = 256           # 待ち行列の上限 (超えたら 503 + Retry-After)
+SERVICE_REQUEST_TIMEOUT = 60.0    # 1 リクエストの待ち時間上限 (秒、超えたら 504)
+SERVICE_MAX_BODY_BYTES = 64 * 2**20
+SERVICE_UPLOAD_DIR = BASE_DIR_SCORE_SERVICE / "cache" / "service_uploads"
+SERVICE_PATH_ROOTS = (BASE_DIR_SCORE_SERVICE / "images" / "originals",)  # JSON の path で読める場所
+_LATENCY_WINDOW = 2000
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout", 411: "Length Required",
+            413: "Payload Too Large", 415: "Unsupported Media Type", 500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+class ServiceError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message); self.status = status; self.headers = headers or {}
+
+class _Job:
+    __slots__ = ("path", "future", "enqueued", "cleanup")
+    def __init__(self, path, future, cleanup):
+        self.path = path; self.future = future; self.enqueued = time.perf_counter(); self.cleanup = cleanup
+
+class ScoringService:
+    """
+    asyncio の HTTP サーバーと、待ち行列からバッチを作って推論スレッドに渡すバッチャー。
+    推論は 1 スレッドの executor で直列に実行し、イベントループは受付・応答だけを行う。
+    """
+    def __init__(self, host=None, port=None, batch_size=None, batch_window_ms=None, max_queue=None, request_timeout=None, path_roots=None):
+        from . import scoring as scoring_module
+        self.scoring = scoring_module
+        self.host = host or SERVICE_HOST; self.port = SERVICE_PORT if port is None else port
+        self.batch_size = max(1, int(batch_size or scoring_module.SCORING_BATCH_SIZE))
+        self.batch_window = (SERVICE_BATCH_WINDOW_MS if batch_window_ms is None else batch_window_ms) / 1000.0
+        self.max_queue = max(1, int(max_queue or SERVICE_MAX_QUEUE)); self.request_timeout = request_timeout or SERVICE_REQUEST_TIMEOUT
+        self.path_roots = [Path(p).resolve() for p in (path_roots or SERVICE_PATH_ROOTS)]
+        self.penalties_config = scoring_module.load_penalties()
+        self._queue = None; self._server = None; self._batcher = None; self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="score-service")
+        self._started = time.time(); self._latencies = collections.deque(maxlen=_LATENCY_WINDOW); self._batch_sizes = collections.deque(maxlen=_LATENCY_WINDOW)
+        self._counters = collections.Counter(); self.bound_port = None
+
+    # --- 起動/停止 ---
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._batcher = asyncio.create_task(self._batch_loop())
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.bound_port = self._server.sockets[0].getsockname()[1]
+        print(f"[ScoreService] http://{self.host}:{self.bound_port}/ で待ち受け中 (バッチ {self.batch_size}枚 / {self.batch_window * 1000:.0f}ms, 待ち行列 {self.max_queue})")
+        return self
+
+    async def serve_forever(self):
+        if self._server is None: await self.start()
+        async with self._server: await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None: self._server.close(); await self._server.wait_closed()
+        if self._batcher is not None: self._batcher.cancel()
+        self._executor.shutdown(wait=True)
+
+    # --- バッチ処理 ---
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self._queue.get()]; deadline = loop.time() + self.batch_window
+            while len(jobs) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0: break
+                try: jobs.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError: break
+            expired = [j for j in jobs if j.future.done()]; jobs = [j for j in jobs if not j.future.done()]  # タイムアウト済みのリクエストは推論しない
+            for job in expired:
+                if job.cleanup: Path(job.path).unlink(missing_ok=True)  # アップロードの一時ファイルはここで消す (推論中のものは下の finally で消える)
+            if not jobs: continue
+            self._counters["batches"] += 1; self._batch_sizes.append(len(jobs))
+            try:
+                results = await loop.run_in_executor(self._executor, self.scoring.process_images_batch, [j.path for j in jobs], self.penalties_config)
+                for job, result in zip(jobs, results):
+                    if not job.future.done(): job.future.set_result(result)
+            except Exception as e_batch:
+                print(f"[ScoreService] バッチ推論エラー: {e_batch}")
+                for job in jobs:
+                    if not job.future.done(): job.future.set_exception(ServiceError(500, f"スコアリング失敗: {e_batch}"))
+            finally:
+                for job in jobs:
+                    if job.cleanup: Path(job.path).unlink(missing_ok=True)
+
+    async def score_path(self, path, cleanup=False):
+        """パスの画像をバッチ待ち行列に入れ、結果 (image_id, score_data, metadata) を待つ。"""
+        if not self.scoring.INITIALIZED_SUCCESSFULLY: raise ServiceError(503, "モデル初期化中です", {"Retry-After": "5"})
+        future = asyncio.get_running_loop().create_future()
+        try: self._queue.put_nowait(_Job(str(path), future, cleanup))
+        except asyncio.QueueFull:
+            self._counters["rejected"] += 1
+            if cleanup: Path(path).unlink(missing_ok=True)
+            raise ServiceError(503, "待ち行列が一杯です", {"Retry-After": "1"})
+        try: return await asyncio.wait_for(future, self.request_timeout)  # タイムアウト時は future がキャンセルされ、バッチャーが読み飛ばす
+        except asyncio.TimeoutError:
+            self._counters["timeouts"] += 1
+            raise ServiceError(504, f"{self.request_timeout:.0f}秒以内にスコアリングが終わりませんでした")
+
+    # --- HTTP ---
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line: break
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive: break
+        except (ConnectionError, asyncio.IncompleteReadError): pass
+        finally:
+            writer.close()
+            try: await writer.wait_closed()
+            except ConnectionError: pass
+
+    async def _handle_request(self, request_line, reader, writer):
+        start = time.perf_counter(); status = 500
+        try:
+            method, target, version = request_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        except ValueError: self._respond(writer, 400, {"error": "不正なリクエスト行"}, keep_alive=False); return False
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""): break
+            name, _, value = line.decode("latin-1").partition(":"); headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+        url = urlsplit(target); query = parse_qs(url.query)
+        try:
+            if url.path == "/health" and method == "GET": status, body = 200, self.health()
+            elif url.path == "/metrics" and method == "GET": status, body = 200, self.metrics()
+            elif url.path == "/score_shard":
+                if method != "POST": raise ServiceError(405, "POST のみ対応しています")
+                self._counters["shards"] += 1
+                status, body = 200, await self._score_shard_request(await self._read_body(reader, headers))
+            elif url.path == "/score":
+                if method != "POST": raise ServiceError(405, "POST のみ対応しています")
+                self._counters["requests"] += 1
+                status, body = 200, await self._score_request(headers, await self._read_body(reader, headers), query)
+                self._counters["succeeded"] += 1; self._latencies.append(time.perf_counter() - start)
+            else: raise ServiceError(404, f"{url.path} はありません")
+            self._respond(writer, status, body, keep_alive=keep_alive)
+        except ServiceError as e_service:
+            status = e_service.status; self._counters[f"status_{status}"] += 1
+            self._respond(writer, status, {"error": str(e_service)}, e_service.headers, keep_alive=keep_alive and status < 500)
+            keep_alive = keep_alive and status < 500
+        except Exception as e_request:
+            self._counters["status_500"] += 1; print(f"[ScoreService] リクエスト処理エラー: {e_request}")
+            self._respond(writer, 500, {"error": str(e_request)}, keep_alive=False); keep_alive = False
+        return keep_alive
+
+    async def _read_body(self, reader, headers):
+        if "chunked" in headers.get("transfer-encoding", "").lower(): raise ServiceError(411, "Content-Length を指定してください")
+        try: length = int(headers.get("content-length", "0"))
+        except ValueError: raise ServiceError(400, "Content-Length が不正です")
+        if length > SERVICE_MAX_BODY_BYTES: raise ServiceError(413, f"本文が上限 ({SERVICE_MAX_BODY_BYTES // 2**20}MB) を超えています")
+        return await reader.readexactly(length) if length else b""
+
+    async def _score_request(self, headers, body, query):
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        if content_type == "application/json":
+            try: path = Path(json.loads(body or b"{}")["path"]).resolve()
+            except (ValueError, KeyError, TypeError): raise ServiceError(400, 'JSON は {"path": "..."} の形式で送ってください')
+            if not any(path.is_relative_to(root) for root in self.path_roots): raise ServiceError(400, "許可されていない場所のパスです (--path-root)")
+            if not path.is_file(): raise ServiceError(404, f"ファイルがありません: {path.name}")
+            cleanup = False; display_name = path.name
+        elif content_type.startswith("image/") or content_type == "application/octet-stream":
+            if not body: raise ServiceError(400, "画像データが空です")
+            filename = Path((query.get("filename") or ["upload.png"])[0]).name
+            suffix = Path(filename).suffix.lower() or "." + content_type.split("/")[-1]
+            if suffix not in self.scoring.WATCHED_EXTENSIONS: raise ServiceError(415, f"対応していない形式です: {suffix}")
+            SERVICE_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+            path = SERVICE_UPLOAD_DIR / f"{Path(filename).stem}__{uuid.uuid4().hex[:8]}{suffix}"; path.write_bytes(body); cleanup = True; display_name = filename
+        else: raise ServiceError(415, "画像本体 (image/*) か JSON {\"path\"} を送ってください")
+        _image_id, score_data, metadata = await self.score_path(path, cleanup)
+        return self._response_body(display_name, score_data, metadata)
+
+    async def _score_shard_request(self, body):
+        """
+        複数パスを 1 回の process_images_batch で処理し、保存に必要なもの (タグ確率・CLIP 埋め込み・サムネイル) も含めて返す。
+        マイクロバッチの待ち行列は通さず、推論スレッドだけを共有する。
+        """
+        if not self.scoring.INITIALIZED_SUCCESSFULLY: raise ServiceError(503, "モデル初期化中です", {"Retry-After": "5"})
+        try: request = json.loads(body or b"{}"); requested = [(str(p), Path(p).resolve()) for p in request["paths"]]
+        except (ValueError, KeyError, TypeError): raise ServiceError(400, 'JSON は {"paths": [...]} の形式で送ってください')
+        if not all(any(p.is_relative_to(root) for root in self.path_roots) for _, p in requested): raise ServiceError(400, "許可されていない場所のパスがあります (--path-root)")
+        found = [(name, p) for name, p in requested if p.is_file()]; missing = [name for name, p in requested if not p.is_file()]  # パスは送られてきた表記のまま返す
+        thumb_dir = (SERVICE_UPLOAD_DIR / f"thumbs_{uuid.uuid4().hex[:8]}") if request.get("thumbnails") else None
+        start = time.perf_counter(); loop = asyncio.get_running_loop()
+        try:
+            if thumb_dir is not None: thumb_dir.mkdir(parents=True, exist_ok=True)
+            results = await loop.run_in_executor(self._executor, lambda: self.scoring.process_images_batch([str(p) for _, p in found], self.penalties_config, thumbnail_dir=thumb_dir))
+            items = []
+            for (path, _), (image_id, score_data, metadata) in zip(found, results):
+                embedding = score_data.pop(self.scoring.CLIP_EMBEDDING_KEY, None); thumbnail = None
+                if score_data.get("thumbnail_path_local"):
+                    thumb_path = Path(score_data.pop("thumbnail_path_local")); thumbnail = base64.b64encode(thumb_path.read_bytes()).decode("ascii"); thumb_path.unlink(missing_ok=True)
+                items.append({"path": path, "id": image_id, "score": score_data, "metadata": metadata, "thumbnail_jpeg_b64": thumbnail,
+                              "embedding": None if embedding is None else np.asarray(embedding, dtype=np.float32).tolist()})
+        finally:
+            if thumb_dir is not None and thumb_dir.exists():
+                for leftover in thumb_dir.iterdir(): leftover.unlink(missing_ok=True)
+                thumb_dir.rmdir()
+        self._counters["shard_images"] += len(items)
+        return {"results": items, "missing": missing, "elapsed_sec": round(time.perf_counter() - start, 3), "embedding_model_id": self.scoring.aesthetic_embedding_model_id()}
+
+    def _response_body(self, display_name, score_data, metadata):
+        score_data.pop(self.scoring.CLIP_EMBEDDING_KEY, None); tag_probs = score_data.pop(self.scoring.TAG_PROBS_KEY, None) or {}
+        return {"filename": display_name,
+                "score_final": score_data.get("score_final"), "score_moe": score_data.get("score_moe"),
+                "failure_tags": score_data.get("failure_tags", []), "penalties_applied": score_data.get("penalties_applied", {}),
+                "tags": dict(sorted(((t, round(float(p), 4)) for t, p in tag_probs.items()), key=lambda tp: -tp[1])),
+                "content_hash": score_data.get("content_hash"), "score_source": score_data.get("score_source", "inference"),
+                "metadata": metadata}
+
+    def _respond(self, writer, status, body, headers=None, keep_alive=True):
+        payload = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", "Content-Type: application/json; charset=utf-8", f"Content-Length: {len(payload)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"] + [f"{k}: {v}" for k, v in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload)
+
+    # --- 状態 ---
+    def health(self):
+        return {"status": "ok" if self.scoring.INITIALIZED_SUCCESSFULLY else "initializing", "models_initialized": bool(self.scoring.INITIALIZED_SUCCESSFULLY),
+                "device": self.scoring.DEVICE, "embedding_model_id": self.scoring.aesthetic_embedding_model_id() if self.scoring.INITIALIZED_SUCCESSFULLY else None,
+                "queue_depth": self._queue.qsize() if self._queue else 0, "uptime_sec": round(time.time() - self._started, 1)}
+
+    def metrics(self):
+        from . import perf_stats as perf_stats_module
+        latencies = np.array(self._latencies, dtype=np.float64) * 1000.0; sizes = np.array(self._batch_sizes, dtype=np.float64)
+        latency = {f"p{q}_ms": round(float(np.percentile(latencies, q)), 1) for q in (50, 95, 99)} if len(latencies) else {}
+        return {"counters": dict(self._counters), "queue_depth": self._queue.qsize() if self._queue else 0, "max_queue": self.max_queue,
+                "batch_size": {"limit": self.batch_size, "window_ms": round(self.batch_window * 1000, 1), "mean": round(float(sizes.mean()), 2) if len(sizes) else None},
+                "latency": latency, "stages": perf_stats_module.get_perf_stats().summary()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.score_service", description="画像スコアリングの HTTP サービス")
+    parser.add_argument("--host", default=SERVICE_HOST, help="待ち受けアドレス (LAN に公開するなら 0.0.0.0)")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT); parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--batch-window-ms", type=float, default=SERVICE_BATCH_WINDOW_MS, help="バッチを集める待ち時間")
+    parser.add_argument("--max-queue", type=int, default=SERVICE_MAX_QUEUE); parser.add_argument("--timeout", type=float, default=SERVICE_REQUEST_TIMEOUT)
+    parser.add_argument("--path-root", action="append", default=None, help="JSON の path で読んでよいディレクトリ (複数可)")
+    parser.add_argument("--device", choices=("auto", "cpu"), default="auto")
+    args = parser.parse_args(argv)
+    from . import scoring as scoring_module
+    service = ScoringService(args.host, args.port, args.batch_size, args.batch_window_ms, args.max_queue, args.timeout, args.path_root)
+    # モデルのロード中も /health には応答できるよう、初期化は別スレッドで行う
+    threading.Thread(target=scoring_module.initialize_all_models, kwargs={"force_cpu": args.device == "cpu", "progress_callback": None}, daemon=True).start()
+    try: asyncio.run(service.serve_forever())
+    except KeyboardInterrupt: print("[ScoreService] 停止しました。")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+# app/scorer_plugin_example.py
+# プラグイン API (v2) の例。plugins/ ディレクトリ (アプリのルート直下) に好きな名前の .py でコピーするか、
+# app/custom_scoring.py として保存してください。詳しい約束事は scorer_plugins.py の ScorerPlugin を参照。
+import numpy as np
+
+PLUGIN_API_VERSION = 2
+
+try: from app.scorer_plugins import ScorerPlugin  # plugins/ から読み込まれるとき
+except ImportError: from .scorer_plugins import ScorerPlugin
+
+class SharpnessPlugin(ScorerPlugin):
+    """グレースケール 256x256 の画素差分からピンボケを検出する (標準モデルと併用する例)。"""
+    name = "sharpness"; model_version = "1"
+    input_size = (256, 256); color_mode = "L"
+    replaces_standard = False; base_weight = 0.5
+    thread_safe = True; process_safe = True
+    default_penalties = {"custom_blur": 1.0}
+
+    def initialize(self, force_cpu=False, progress_callback=None):
+        # ここでモデルを読み込む (失敗したら例外を投げると、このプラグインだけ無効になる)
+        print("[SharpnessPlugin] 初期化完了。")
+
+    def score_batch(self, images, paths):
+        batch = images[..., 0].astype(np.float32) / 255.0  # (N, 256, 256)
+        sharpness = np.abs(np.diff(batch, axis=1)).mean(axis=(1, 2)) + np.abs(np.diff(batch, axis=2)).mean(axis=(1, 2))
+        blur_prob = np.clip(1.0 - sharpness * 20.0, 0.0, 1.0)
+        return [{"base_score": float(np.clip(s * 200.0, 0.0, 10.0)), "tag_probs": {"custom_blur": round(float(p), 3)}} for s, p in zip(sharpness, blur_prob)]
+
+def create_plugin():
+    return SharpnessPlugin()
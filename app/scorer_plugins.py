@@ -0,0 +1,170 @@
+# app/scorer_plugins.py
+# カスタムスコアラーのプラグイン API (バージョン 2) と、旧来の custom_scoring.py (score_one_custom) 用アダプター。
+#
+# プラグインは app/custom_scoring.py か plugins/*.py に置き、次のどちらかを定義します。
+#   v2: PLUGIN_API_VERSION = 2 と create_plugin() (ScorerPlugin のインスタンスを返す。リストも可)
+#   v1: initialize_custom_models(force_cpu, progress_callback) と score_one_custom(image_path, penalties)
+#       (penalties.yml の内容を渡し、返した final_score / applied_penalties をそのまま使う。v1 だけで動かすときは従来どおり)
+# v2 のプラグインは、デコード済み画像を宣言した大きさ・色形式の配列でバッチごと受け取り、
+# {"base_score": 0〜10 | None, "tag_probs": {tag: 確率}, "failure_tags": [tag, ...]} を画像ごとに返します。
+# タグは全プラグイン (と標準の DeepDanbooru) の和集合、減点は penalties.yml (+ プラグインの default_penalties) で計算します。
+import importlib.util
+import threading
+from importlib import import_module
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+PLUGIN_API_VERSION = 2
+BASE_DIR_SCORER_PLUGINS = Path(__file__).resolve().parent.parent
+PLUGINS_DIR = BASE_DIR_SCORER_PLUGINS / "plugins"
+COLOR_MODES = ("RGB", "L")
+
+class ScorerPlugin:
+    """
+    v2 プラグインの基底クラス。属性を上書きし、initialize / score_batch を実装する。
+      name              プラグイン名 (結果・キャッシュキー・ログに使う)
+      model_version     モデルの版。変えるとスコアキャッシュが無効になる
+      input_size        (幅, 高さ) ならその大きさにリサイズして (N, H, W, C) の配列で渡す。None なら元の大きさの配列のリスト
+      color_mode        "RGB" または "L"
+      needs_pixels      False なら配列を作らない (パスだけで動くプラグイン)
+      replaces_standard True なら標準モデル (CLIP Aesthetic / DeepDanbooru) を読み込まず、このプラグインの base_score を使う
+      base_weight       標準モデルと併用するとき base_score を平均する重み (標準モデルは 1.0)
+      thread_safe       False なら score_batch を同時に 1 スレッドからしか呼ばない
+      process_safe      False ならマルチプロセスプール (score_pool / score_cli --workers) では使えない
+      default_penalties penalties.yml に書かれていないタグの減点値
+    """
+    api_version = PLUGIN_API_VERSION
+    name = "plugin"; model_version = "0"
+    input_size = None; color_mode = "RGB"; needs_pixels = True
+    replaces_standard = False; base_weight = 1.0
+    thread_safe = False; process_safe = True
+    default_penalties = {}
+
+    def initialize(self, force_cpu=False, progress_callback=None):
+        """モデルのロード。失敗したら例外を投げる (そのプラグインだけ無効になる)。"""
+
+    def score_batch(self, images, paths):
+        """images: input_size があれば (N, H, W, C) uint8 配列、なければ (H, W, C) 配列のリスト。paths は元画像のパス (不明なら None)。"""
+        raise NotImplementedError
+
+class LegacyScorerAdapter(ScorerPlugin):
+    """v1 (score_one_custom) を v2 として扱う。1 枚ずつ、パスから自分で画像を開く。戻り値の final_score / applied_penalties も結果に残す。"""
+    needs_pixels = False; replaces_standard = True; thread_safe = False; process_safe = True
+
+    def __init__(self, module):
+        self.module = module; self.name = getattr(module, "PLUGIN_NAME", module.__name__.rsplit(".", 1)[-1])
+        self.model_version = str(getattr(module, "MODEL_VERSION", "custom")); self.api_version = 1
+
+    def initialize(self, force_cpu=False, progress_callback=None): self.module.initialize_custom_models(force_cpu=force_cpu, progress_callback=progress_callback)
+
+    def score_batch(self, images, paths, penalties=None):
+        results = []
+        for path in paths:
+            if path is None: results.append({}); continue
+            base, tags, final, applied = self.module.score_one_custom(Path(path), dict(penalties or {}))
+            results.append({"base_score": base, "failure_tags": list(tags), "final_score": final, "applied_penalties": dict(applied or {})})
+        return results
+
+def _plugins_from_module(module):
+    version = getattr(module, "PLUGIN_API_VERSION", None)
+    if version == PLUGIN_API_VERSION and callable(getattr(module, "create_plugin", None)):
+        created = module.create_plugin(); plugins = created if isinstance(created, (list, tuple)) else [created]
+        for plugin in plugins:
+            if plugin.color_mode not in COLOR_MODES: raise ValueError(f"{plugin.name}: color_mode は {COLOR_MODES} のいずれかにしてください")
+        return list(plugins)
+    if version not in (None, 1) and version != PLUGIN_API_VERSION: raise ValueError(f"未対応のプラグイン API バージョン {version} (対応: 1, {PLUGIN_API_VERSION})")
+    if callable(getattr(module, "score_one_custom", None)) and callable(getattr(module, "initialize_custom_models", None)): return [LegacyScorerAdapter(module)]
+    return []
+
+def discover_plugins(plugins_dir=PLUGINS_DIR):
+    """app/custom_scoring.py と plugins/*.py からプラグインを集める (読めないものは警告して飛ばす)。"""
+    found = []
+    try: found.extend(_plugins_from_module(import_module(".custom_scoring", package=__package__)))
+    except ModuleNotFoundError: pass
+    except Exception as e_custom: print(f"[Plugins] custom_scoring.py の読込エラー: {e_custom}")
+    for path in sorted(Path(plugins_dir).glob("*.py")) if Path(plugins_dir).is_dir() else []:
+        if path.name.startswith("_"): continue
+        try:
+            spec = importlib.util.spec_from_file_location(f"scorer_plugin_{path.stem}", path); module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module)
+            found.extend(_plugins_from_module(module))
+        except Exception as e_plugin: print(f"[Plugins] {path.name} の読込エラー: {e_plugin}")
+    names = set()
+    for plugin in found:
+        if plugin.name in names: raise ValueError(f"プラグイン名が重複しています: {plugin.name}")
+        names.add(plugin.name); plugin._call_lock = None if plugin.thread_safe else threading.Lock()
+        print(f"[Plugins] {plugin.name} (API v{plugin.api_version}, model {plugin.model_version}{', 標準モデルを置き換え' if plugin.replaces_standard else ''}) を検出。")
+    return found
+
+def initialize_plugins(plugins, force_cpu=False, progress_callback=None):
+    """各プラグインを初期化し、成功したものだけのリストを返す。"""
+    ready = []
+    for plugin in plugins:
+        try: plugin.initialize(force_cpu=force_cpu, progress_callback=progress_callback); ready.append(plugin)
+        except Exception as e_init: print(f"[Plugins] {plugin.name} の初期化失敗 (無効にします): {e_init}")
+    return ready
+
+def required_decode_size(plugins):
+    """縮小デコードで満たすべき (幅, 高さ)。元の大きさが必要なプラグインがあれば None、配列不要なら (0, 0)。"""
+    width = height = 0
+    for plugin in plugins:
+        if not plugin.needs_pixels: continue
+        if plugin.input_size is None: return None
+        width = max(width, int(plugin.input_size[0])); height = max(height, int(plugin.input_size[1]))
+    return width, height
+
+def prepare_inputs(plugins, img_rgb):
+    """デコード済み RGB 画像から {プラグイン名: 配列} を作る (前処理ワーカースレッドから呼ぶ)。"""
+    inputs = {}
+    for plugin in plugins:
+        if not plugin.needs_pixels: continue
+        img = img_rgb.convert(plugin.color_mode) if plugin.color_mode != "RGB" else img_rgb
+        if plugin.input_size is not None: img = img.resize(tuple(plugin.input_size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        arr = np.asarray(img, dtype=np.uint8); inputs[plugin.name] = arr[..., None] if arr.ndim == 2 else arr
+    return inputs
+
+def run_plugins(plugins, inputs_list, paths, penalties=None):
+    """
+    全プラグインをバッチで実行し、画像ごとに統合した {"base_score", "base_weight", "tag_probs", "failure_tags", "legacy_result"} を返す。
+    base_score は base_weight で重み付き平均、tag_probs はタグごとの最大値、failure_tags は和集合。
+    penalties は v1 プラグインの score_one_custom に渡す。legacy_result は v1 が返した (base, tags, final, applied) (なければ None)。
+    """
+    merged = [{"base_score": None, "base_weight": 0.0, "tag_probs": {}, "failure_tags": [], "legacy_result": None} for _ in inputs_list]
+    for plugin in plugins:
+        idx = [i for i, inputs in enumerate(inputs_list) if not plugin.needs_pixels or (inputs or {}).get(plugin.name) is not None]
+        if not idx: continue
+        images = [inputs_list[i][plugin.name] for i in idx] if plugin.needs_pixels else [None] * len(idx)
+        if plugin.needs_pixels and plugin.input_size is not None: images = np.stack(images)
+        kwargs = {"penalties": penalties} if isinstance(plugin, LegacyScorerAdapter) else {}
+        try:
+            if plugin._call_lock is None: results = plugin.score_batch(images, [paths[i] if paths else None for i in idx], **kwargs)
+            else:
+                with plugin._call_lock: results = plugin.score_batch(images, [paths[i] if paths else None for i in idx], **kwargs)
+            if len(results) != len(idx): raise ValueError(f"{len(idx)}枚に対して {len(results)}件の結果が返りました")
+        except Exception as e_plugin:
+            print(f"[Plugins] {plugin.name} の推論エラー: {e_plugin}"); results = [{"failure_tags": ["custom_err"]} for _ in idx]
+        for i, result in zip(idx, results):
+            out = merged[i]; base = (result or {}).get("base_score")
+            if base is not None:
+                weight = float(plugin.base_weight); total = out["base_weight"] + weight
+                out["base_score"] = float(base) if out["base_score"] is None else (out["base_score"] * out["base_weight"] + float(base) * weight) / total
+                out["base_weight"] = total
+            for tag, prob in ((result or {}).get("tag_probs") or {}).items(): out["tag_probs"][tag] = max(float(prob), out["tag_probs"].get(tag, 0.0))
+            out["failure_tags"].extend(t for t in (result or {}).get("failure_tags") or [] if t not in out["failure_tags"])
+            if (result or {}).get("final_score") is not None: out["legacy_result"] = (base, list(result.get("failure_tags") or []), result["final_score"], result.get("applied_penalties") or {})
+    return merged
+
+def default_penalties(plugins):
+    penalties = {}
+    for plugin in plugins: penalties.update({str(k): float(v) for k, v in (plugin.default_penalties or {}).items()})
+    return penalties
+
+def plugins_identity(plugins):
+    """キャッシュキーに含める "name@version,..."。"""
+    return ",".join(f"{p.name}@{p.model_version}" for p in plugins)
+
+def process_pool_allowed(plugins):
+    """全プラグインがマルチプロセスで使えるか (使えないものの名前のリストも返す)。"""
+    unsafe = [p.name for p in plugins if not p.process_safe]
+    return not unsafe, unsafe
@@ -9,24 +9,40 @@ import numpy as np
 from pathlib import Path
 import hashlib
 import sys
+import threading
+import time
 
-# --- AIライブラリのインポート ---
+# --- AIライブラリ (遅延ロード) ---
+# torch / transformers / aesthetics_predictor / deepdanbooru (TensorFlow) はインポートだけで数秒〜数十秒かかるため、
+# モジュール読込時には読み込まず、load_backend() / load_ml_backends() で初めて必要になった時点でインポートします
+# (通常は ModelInitializationThread 内の initialize_all_models から)。
+torch = CLIPProcessor = CLIPModel = CLIPConfig = CLIPVisionModelWithProjection = hf_hub_download = None
 _AestheticPredictorActualClass = None
 _aesthetic_predictor_import_error = "AestheticPredictor not attempted to import yet."
 _deepdanbooru_module = None
 _deepdanbooru_import_error = "DeepDanbooru has not been attempted to import yet."
+BACKEND_LOAD_TIMES = {}  # バックエンド名 -> インポート所要秒 (起動時間の内訳表示用)
+_backend_status = {}; _backend_lock = threading.RLock()
 
-try:
-    import torch
-    from transformers import CLIPProcessor, CLIPModel, CLIPConfig
-    from huggingface_hub import hf_hub_download, HfFolder
+def _load_torch_backend():
+    global torch, CLIPProcessor, CLIPModel, CLIPConfig, CLIPVisionModelWithProjection, hf_hub_download
+    try:
+        import torch as torch_module
+        from transformers import CLIPProcessor as processor_cls, CLIPModel as model_cls, CLIPConfig as config_cls, CLIPVisionModelWithProjection as vision_cls
+        from huggingface_hub import hf_hub_download as hub_download
+    except ImportError as e_main:
+        print(f"[Scoring] 必須AIコアライブラリ(torch, transformers等)のインポートに失敗: {e_main}"); return False
+    torch, CLIPProcessor, CLIPModel, CLIPConfig, CLIPVisionModelWithProjection, hf_hub_download = torch_module, processor_cls, model_cls, config_cls, vision_cls, hub_download
     print("[Scoring] torch, transformers, huggingface_hub のインポートに成功。")
+    return True
 
+def _load_aesthetics_predictor_backend():
+    global _AestheticPredictorActualClass, _aesthetic_predictor_import_error
+    if not load_backend("torch"): _aesthetic_predictor_import_error = "torch/transformers unavailable"; return False
     try:
         # AestheticsPredictorV2Linear を優先的に試す
         from aesthetics_predictor import AestheticsPredictorV2Linear
-        _AestheticPredictorActualClass = AestheticsPredictorV2Linear
-        _aesthetic_predictor_import_error = None
+        _AestheticPredictorActualClass = AestheticsPredictorV2Linear; _aesthetic_predictor_import_error = None
         print(f"[Scoring] 'aesthetics_predictor.AestheticsPredictorV2Linear' のインポート/選択に成功。")
     except ImportError as e_ap_v2:
         _aesthetic_predictor_import_error = f"Failed to import AestheticsPredictorV2Linear: {e_ap_v2}. "
@@ -34,8 +50,7 @@ try:
         # V2LinearがダメならV1も試す
         try:
             from aesthetics_predictor import AestheticsPredictorV1
-            _AestheticPredictorActualClass = AestheticsPredictorV1
-            _aesthetic_predictor_import_error = None
+            _AestheticPredictorActualClass = AestheticsPredictorV1; _aesthetic_predictor_import_error = None
             print(f"[Scoring] Fallback: 'aesthetics_predictor.AestheticsPredictorV1' のインポートに成功。")
         except ImportError as e_ap_v1:
             _aesthetic_predictor_import_error += f" Also failed to import AestheticsPredictorV1: {e_ap_v1}"
@@ -43,46 +58,53 @@ try:
     except Exception as e_ap_other:
         _aesthetic_predictor_import_error = f"Unexpected error importing from aesthetics_predictor: {e_ap_other}"
         print(f"[Scoring] Error: {_aesthetic_predictor_import_error}")
+    return _AestheticPredictorActualClass is not None
 
+def _load_deepdanbooru_backend():
+    global _deepdanbooru_module, _deepdanbooru_import_error
     try:
         import deepdanbooru as ddb
-        _deepdanbooru_module = ddb
-        _deepdanbooru_import_error = None
+        _deepdanbooru_module = ddb; _deepdanbooru_import_error = None
         print(f"[Scoring] 'deepdanbooru' のインポートに成功。")
     except ImportError as e_ddb_import:
-        _deepdanbooru_import_error = f"Failed to import deepdanbooru: {e_ddb_import}"
-        print(f"[Scoring] Error: {_deepdanbooru_import_error}")
-        ddb = None
+        _deepdanbooru_import_error = f"Failed to import deepdanbooru: {e_ddb_import}"; print(f"[Scoring] Error: {_deepdanbooru_import_error}")
     except Exception as e_ddb_other:
-        _deepdanbooru_import_error = f"Unexpected error importing deepdanbooru: {e_ddb_other}"
-        print(f"[Scoring] Error: {_deepdanbooru_import_error}")
-        ddb = None
-
-except ImportError as e_main:
-    print(f"[Scoring] 必須AIコアライブラリ(torch, transformers等)のインポートに失敗: {e_main}")
-    torch = CLIPProcessor = CLIPModel = HfFolder = CLIPConfig = None
-    if ddb is None and _deepdanbooru_import_error is None : _deepdanbooru_import_error = str(e_main)
-    if _AestheticPredictorActualClass is None and _aesthetic_predictor_import_error is None : _aesthetic_predictor_import_error = str(e_main)
-except Exception as e_unexpected_main_import:
-    print(f"[Scoring] AIライブラリのインポート中に予期せぬエラー (メインブロック): {e_unexpected_main_import}")
-    torch = CLIPProcessor = CLIPModel = HfFolder = ddb = CLIPConfig = None
-    _AestheticPredictorActualClass = None
+        _deepdanbooru_import_error = f"Unexpected error importing deepdanbooru: {e_ddb_other}"; print(f"[Scoring] Error: {_deepdanbooru_import_error}")
+    return _deepdanbooru_module is not None
+
+# バックエンド名 -> ローダー (初回の load_backend でのみ実行)
+BACKEND_LOADERS = {"torch": _load_torch_backend, "aesthetics_predictor": _load_aesthetics_predictor_backend, "deepdanbooru": _load_deepdanbooru_backend}
+
+def load_backend(name):
+    """バックエンドを (未ロードなら) インポートし、利用可能なら True を返す。2 回目以降は結果を返すだけ。"""
+    with _backend_lock:
+        if name in _backend_status: return _backend_status[name]
+        start = time.perf_counter()
+        try: ok = bool(BACKEND_LOADERS[name]())
+        except Exception as e_backend: print(f"[Scoring] バックエンド {name} のロード中に予期せぬエラー: {e_backend}"); ok = False
+        _backend_status[name] = ok; BACKEND_LOAD_TIMES[name] = time.perf_counter() - start
+    print(f"[Scoring] バックエンド {name}: {'ロード完了' if ok else '利用不可'} ({BACKEND_LOAD_TIMES[name]:.2f}秒)")
+    return ok
+
+def load_ml_backends(names=None):
+    """標準スコアラーが使うバックエンドをまとめてロード。全て利用可能なら True。"""
+    return all([load_backend(name) for name in (names or BACKEND_LOADERS)])
 
 try:
     from pillow_heif import register_heif_opener
     PILLOW_HEIF_AVAILABLE = True
 except ImportError: PILLOW_HEIF_AVAILABLE = False
 
-CUSTOM_SCORER_AVAILABLE = False
-try:
-    from importlib import import_module
-    custom_scoring_module = import_module(".custom_scoring", package=__package__)
-    if hasattr(custom_scoring_module, 'score_one_custom') and callable(custom_scoring_module.score_one_custom) and \
-       hasattr(custom_scoring_module, 'initialize_custom_models') and callable(custom_scoring_module.initialize_custom_models):
-        score_one_custom = custom_scoring_module.score_one_custom; initialize_custom_models = custom_scoring_module.initialize_custom_models
-        CUSTOM_SCORER_AVAILABLE = True; print("[Scoring] カスタムスコアラー検出、優先。")
-except ModuleNotFoundError: pass
-except Exception as e_custom: print(f"[Scoring] カスタムスコアラー読込エラー: {e_custom}。標準を使用。")
+from .ingest import ImageIngest, open_rgb
+from . import perf_stats as perf_stats_module
+from .score_cache import get_score_cache
+from . import phash_index as phash_index_module
+
+from . import scorer_plugins as scorer_plugins_module
+
+SCORER_PLUGINS = scorer_plugins_module.discover_plugins()  # 初期化後は初期化に成功したものだけ
+CUSTOM_SCORER_AVAILABLE = any(p.replaces_standard for p in SCORER_PLUGINS)  # 標準モデルを置き換えるプラグインがあるか
+if CUSTOM_SCORER_AVAILABLE: print("[Scoring] カスタムスコアラー検出、優先。")
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 MODELS_DIR = BASE_DIR / "models"
@@ -90,27 +112,194 @@ AESTHETIC_MODEL_CACHE_DIR = MODELS_DIR / "aesthetic_models_cache"
 DEEPDANBOORU_PROJECT_PATH = MODELS_DIR / "deepdanbooru_standard_model"
 PENALTIES_YML_PATH = BASE_DIR / "penalties.yml"
 METADATA_JSON_PATH = BASE_DIR / "metadata.json"
+THUMBNAIL_WEB_PREFIX = "cloude_image/thumbnails"
+THUMBNAIL_SIZE = (256, 256)
 
+# STD_CLIP_MODEL_AESTHETIC は共有 CLIP 画像バックボーン (Aesthetic Predictor 自身の vision tower + projection) を指す
 STD_CLIP_MODEL_AESTHETIC = STD_CLIP_PROCESSOR_AESTHETIC = STD_AESTHETIC_PREDICTOR = STD_DEEPDANBOORU_MODEL = STD_DEEPDANBOORU_TAGS = None
+STD_AESTHETIC_ACCEL = None  # TORCH_ACCEL_PROFILE == "cpu_accel" 時の torch_accel.AcceleratedForward
+STD_AESTHETIC_ONNX = None  # ONNX Runtime int8 バックエンド使用時の OnnxAestheticRunner (この間 STD_AESTHETIC_PREDICTOR は None)
+STD_CASCADE_PREDICTOR = None  # CASCADE_MODE == "clip_b32" の安価な段 (ViT-B/32 + Aesthetic ヘッド)
+MODEL_MEMORY_REPORT = {}  # 初期化時のモデルメモリ内訳 (MB)
 DEVICE = "cpu"; INITIALIZED_SUCCESSFULLY = False
 AESTHETIC_CLIP_MODEL_ID = "laion/CLIP-ViT-L-14-laion2B-s32B-b82K"
 AESTHETIC_PREDICTOR_V2_HF_MODEL_ID = "shunk031/aesthetics-predictor-v2-ava-logos-l14-linearMSE"
+CASCADE_CHEAP_MODEL_ID = "shunk031/aesthetics-predictor-v1-vit-base-patch32"  # 前処理 (224px, CLIP 正規化) は ViT-L/14 と共通
 
 WATCHED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.heic', '.heif')
+SCORING_BATCH_SIZE = 8  # score_batch の既定バッチサイズ (設定画面から上書き)
+DEEPDANBOORU_THRESHOLD = 0.5  # この値以上のタグを "破綻タグ" として収集 (penalties.yml の _default_threshold で上書き)
+TAG_THRESHOLDS = {}  # タグ別しきい値 (penalties.yml の {penalty, threshold} 形式から load_penalties が設定)
+TAG_PROB_STORE_FLOOR = 0.1  # この確率以上のタグを候補として tag_store に保存 (再ペナルティ計算用)
+TAG_PROBS_KEY = "_tag_probs"  # score_data に一時的に載せるタグ確率 {tag: prob} (保存前に tag_store が取り除く)
+CLIP_EMBEDDING_KEY = "_clip_embedding"  # score_data に一時的に載せる CLIP 画像埋め込み (保存前に embedding_store が取り除く)
+SCORE_CACHE_ENABLED = True  # 内容ハッシュによるスコアキャッシュ (score_cache) を使う
+AESTHETIC_BACKEND = "torch"  # "torch" または "onnx_int8" (CPU 時のみ有効、設定画面から上書き、再起動後に有効)
+ONNX_INTRA_OP_THREADS = 0  # ONNX Runtime のスレッド数 (0 = 自動)
+TORCH_ACCEL_PROFILE = "eager"  # PyTorch (CPU) の Aesthetic 推論: "eager" / "cpu_accel" (torch_accel の高速化プロファイル、再起動後に有効)
+TORCH_INTRA_OP_THREADS = 0  # cpu_accel 時の torch スレッド数 (0 = 自動)
+USE_MODEL_SNAPSHOT = True  # models/snapshot/ (model_snapshot) から Hub を介さずにロードし、なければ初回ロード後に作る
+REDUCED_DECODE = True  # 大きな画像をモデル入力・サムネイルに必要な解像度まで縮小してデコード (JPEG draft / reduce)
+NEAR_DUP_MODE = "off"  # "copy": 知覚ハッシュが近いスコア済み画像のスコアを流用 (推論しない) / "off"
+NEAR_DUP_MAX_DISTANCE = 4  # 流用するハミング距離の上限 (64bit dHash)
+DDB_RUNTIME = "auto"  # DeepDanbooru: "auto" (変換済み ONNX があれば使用) / "keras" / "onnx" (未変換なら初回に変換)
+CASCADE_MODE = "off"  # "clip_b32": ViT-B/32 で仮スコア (再起動後に有効) / "ddb": DeepDanbooru の減点だけで仮スコア / "off": 全画像 ViT-L
+CASCADE_DELETE_THRESHOLD = 4.0  # 削除の目安にしている score_final
+CASCADE_BAND = 1.0  # 仮の score_final が削除の目安 ± この幅に入った画像だけ ViT-L で採点し直す
+CASCADE_DDB_PRIOR_SCORE = 6.0  # "ddb" モードで ViT-L を省いた画像に記録する基本スコア
+CASCADE_STAGE_CHEAP = "cascade_cheap"; CASCADE_STAGE_FULL = "full"  # score_data["score_stage"] の値
+CASCADE_STAGE_PRIOR = "cascade_prior"  # "ddb" モードで ViT-L を省いた画像 (score_moe は推論値ではなく CASCADE_DDB_PRIOR_SCORE)。tag_store.PRIOR_SCORE_STAGE と同じ値
+LEGACY_CUSTOM_STAGE = "custom_v1"  # v1 カスタムスコアラー単独の結果 (減点もスコアラー自身が計算済み)。tag_store.LEGACY_SCORE_STAGE と同じ値
+CONCURRENT_INFERENCE = False  # CLIP と DeepDanbooru を専用スレッドで同時に推論 (両モデルの作業メモリが同時に要る代わりにバッチの待ち時間が縮む)
+CONCURRENT_CLIP_THREAD_SHARE = 0.5  # 同時推論時 (CPU) に CLIP 側へ割り当てるスレッドの割合 (残りは DeepDanbooru、再起動後に有効)
+# 別プロセス (score_pool) に引き継ぐ実行時設定のモジュール変数名
+RUNTIME_SETTING_NAMES = ["SCORING_BATCH_SIZE", "DEEPDANBOORU_THRESHOLD", "TAG_THRESHOLDS", "SCORE_CACHE_ENABLED", "AESTHETIC_BACKEND", "ONNX_INTRA_OP_THREADS", "TORCH_ACCEL_PROFILE", "TORCH_INTRA_OP_THREADS", "DDB_RUNTIME", "REDUCED_DECODE", "NEAR_DUP_MODE", "NEAR_DUP_MAX_DISTANCE",
+                         "CASCADE_MODE", "CASCADE_DELETE_THRESHOLD", "CASCADE_BAND", "CASCADE_DDB_PRIOR_SCORE",
+                         "CONCURRENT_INFERENCE", "CONCURRENT_CLIP_THREAD_SHARE"]
+
+def export_runtime_settings():
+    return {name: globals()[name] for name in RUNTIME_SETTING_NAMES}
+
+def apply_runtime_settings(settings):
+    for name, value in (settings or {}).items():
+        if name in RUNTIME_SETTING_NAMES: globals()[name] = value
+
+def _module_bytes(module):
+    return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+
+def _report_clip_memory(clip_config):
+    """共有バックボーンの使用量と、以前の構成 (別途フル CLIPModel をロード) で余分に使っていた量を表示する。"""
+    try:
+        MODEL_MEMORY_REPORT.clear(); MODEL_MEMORY_REPORT["aesthetic_predictor_mb"] = round(_module_bytes(STD_AESTHETIC_PREDICTOR) / 2**20, 1)
+        if clip_config is not None:
+            with torch.device("meta"): full_clip = CLIPModel(clip_config)  # 重みを確保せずにサイズだけ数える
+            MODEL_MEMORY_REPORT["avoided_clip_model_mb"] = round(_module_bytes(full_clip) / 2**20, 1); del full_clip
+        saved = f", 別途の CLIPModel ロードを省略して約 {MODEL_MEMORY_REPORT['avoided_clip_model_mb']} MB 節約" if "avoided_clip_model_mb" in MODEL_MEMORY_REPORT else ""
+        print(f"[Scoring] メモリ: 共有CLIPバックボーン+Aestheticヘッド {MODEL_MEMORY_REPORT['aesthetic_predictor_mb']} MB ({DEVICE}){saved}。")
+    except Exception as e_mem: print(f"[Scoring] メモリ集計失敗: {e_mem}")
+
+def _inference_threads(model, configured=0):
+    """
+    model ("clip" / "ddb") の推論スレッド数。CPU で同時推論するときは configured (0 = 全コア) を
+    CONCURRENT_CLIP_THREAD_SHARE で分け合い、2 つのモデルがコアを奪い合わないようにする。それ以外は configured のまま。
+    """
+    if not CONCURRENT_INFERENCE or DEVICE != "cpu": return configured
+    total = configured or os.cpu_count() or 1; clip_threads = min(max(1, round(total * CONCURRENT_CLIP_THREAD_SHARE)), max(1, total - 1))
+    return clip_threads if model == "clip" else max(1, total - clip_threads)
+
+def _limit_tensorflow_threads():
+    """同時推論時、Keras の DeepDanbooru のスレッド数を割当分に絞る (TensorFlow の初回実行前にしか変えられない)。"""
+    threads = _inference_threads("ddb")
+    if not threads: return
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads); tf.config.threading.set_inter_op_parallelism_threads(1)
+    except Exception as e_tf_threads: print(f"[Scoring] TensorFlow のスレッド数を変更できません (既定のまま): {e_tf_threads}")
+
+def _init_onnx_aesthetic(progress_callback=None):
+    """
+    ONNX int8 の Aesthetic モデルを開く (なければ STD_AESTHETIC_PREDICTOR からエクスポート)。
+    成功したら PyTorch 側の predictor は解放する。失敗時は PyTorch のまま続行。
+    """
+    global STD_AESTHETIC_ONNX, STD_AESTHETIC_PREDICTOR, STD_CLIP_MODEL_AESTHETIC
+    if progress_callback: progress_callback.emit("Aesthetic ONNX int8 モデル準備中...", 45)
+    try:
+        from . import onnx_aesthetic as onnx_aesthetic_module
+        crop = getattr(getattr(STD_CLIP_PROCESSOR_AESTHETIC, "image_processor", None), "crop_size", None) or {"height": 224, "width": 224}
+        STD_AESTHETIC_ONNX = onnx_aesthetic_module.load_or_build(AESTHETIC_MODEL_CACHE_DIR, _aesthetic_model_id(), _inference_threads("clip", ONNX_INTRA_OP_THREADS),
+                                                                 predictor=STD_AESTHETIC_PREDICTOR, torch=torch, input_size=(crop["height"], crop["width"]))
+    except Exception as e_onnx:
+        print(f"[Scoring] ONNX int8 バックエンドの準備に失敗 (PyTorch を使用): {e_onnx}"); STD_AESTHETIC_ONNX = None
+    if STD_AESTHETIC_ONNX is not None and STD_AESTHETIC_PREDICTOR is not None:
+        STD_AESTHETIC_PREDICTOR = STD_CLIP_MODEL_AESTHETIC = None
+        import gc; gc.collect()
+
+def _snapshot_model_ids():
+    return {"clip": AESTHETIC_CLIP_MODEL_ID, "aesthetic_predictor": AESTHETIC_PREDICTOR_V2_HF_MODEL_ID,
+            "aesthetic_class": _AestheticPredictorActualClass.__name__ if _AestheticPredictorActualClass else None}
+
+def _load_predictor_from_snapshot(manifest):
+    """スナップショットの model.safetensors (メモリマップ) から Aesthetic Predictor をロードする。失敗時はスナップショットを無効化して None。"""
+    from . import model_snapshot as model_snapshot_module
+    predictor_dir = model_snapshot_module.predictor_dir(manifest)
+    if not hasattr(_AestheticPredictorActualClass, "from_pretrained") or not predictor_dir.exists(): return None
+    try:
+        predictor = _AestheticPredictorActualClass.from_pretrained(str(predictor_dir), local_files_only=True, use_safetensors=True)
+        print(f"[Scoring] Aesthetic Predictor をスナップショットからロード: {predictor_dir}")
+        return predictor
+    except Exception as e_snap: print(f"[Scoring] スナップショットからのロード失敗 (Hub から再取得): {e_snap}"); model_snapshot_module.invalidate(manifest); return None
+
+def _write_model_snapshot(clip_config):
+    """Hub からロードした前処理設定と Aesthetic Predictor をスナップショットに書き出す (.to(DEVICE) の前に呼ぶ)。"""
+    if clip_config is None or not hasattr(STD_AESTHETIC_PREDICTOR, "save_pretrained"): return
+    try:
+        from . import model_snapshot as model_snapshot_module
+        model_snapshot_module.write_snapshot(_snapshot_model_ids(), STD_CLIP_PROCESSOR_AESTHETIC, clip_config, STD_AESTHETIC_PREDICTOR)
+    except Exception as e_write: print(f"[Scoring] モデルスナップショットの保存失敗 (次回も Hub からロード): {e_write}")
+
+def _init_torch_accel():
+    """CPU で TORCH_ACCEL_PROFILE == "cpu_accel" なら STD_AESTHETIC_PREDICTOR を高速化ラッパーで包む。失敗時は eager のまま。"""
+    global STD_AESTHETIC_ACCEL
+    STD_AESTHETIC_ACCEL = None
+    if TORCH_ACCEL_PROFILE != "cpu_accel" or STD_AESTHETIC_PREDICTOR is None or STD_AESTHETIC_ONNX is not None: return
+    if DEVICE != "cpu": print(f"[Scoring] cpu_accel プロファイルは CPU 専用のため、{DEVICE} では eager を使用します。"); return
+    try:
+        from . import torch_accel as torch_accel_module
+        STD_AESTHETIC_ACCEL = torch_accel_module.AcceleratedForward(STD_AESTHETIC_PREDICTOR, torch, DEVICE, _inference_threads("clip", TORCH_INTRA_OP_THREADS),
+                                                                    cache_dir=AESTHETIC_MODEL_CACHE_DIR / "torch_compile")
+        print(f"[Scoring] PyTorch 高速化プロファイル有効 (bf16: {STD_AESTHETIC_ACCEL.use_bf16}, compile: {STD_AESTHETIC_ACCEL.compiled}, スレッド: {STD_AESTHETIC_ACCEL.threads})")
+    except Exception as e_accel: print(f"[Scoring] PyTorch 高速化プロファイルの準備に失敗 (eager を使用): {e_accel}"); STD_AESTHETIC_ACCEL = None
+
+def _init_cascade_model(progress_callback=None):
+    """CASCADE_MODE == "clip_b32" なら安価な段の ViT-B/32 Aesthetic Predictor をロードする。失敗時は "ddb" 相当で動く。"""
+    global STD_CASCADE_PREDICTOR
+    STD_CASCADE_PREDICTOR = None
+    if CASCADE_MODE != "clip_b32": return
+    if progress_callback: progress_callback.emit(f"カスケード用 CLIP ({CASCADE_CHEAP_MODEL_ID}) ロード中...", 55)
+    try:
+        from aesthetics_predictor import AestheticsPredictorV1
+        STD_CASCADE_PREDICTOR = AestheticsPredictorV1.from_pretrained(CASCADE_CHEAP_MODEL_ID, cache_dir=str(AESTHETIC_MODEL_CACHE_DIR / "cascade_b32")).to(DEVICE).eval()
+        print(f"[Scoring] カスケード用 Aesthetic Predictor ({CASCADE_CHEAP_MODEL_ID}) ロード完了。")
+    except Exception as e_cascade: print(f"[Scoring] カスケード用モデルのロード失敗 (DeepDanbooru の減点だけで仮スコアを出します): {e_cascade}"); STD_CASCADE_PREDICTOR = None
+
+def _deepdanbooru_onnx_wanted():
+    if DDB_RUNTIME == "keras": return False
+    from . import ddb_runtime as ddb_runtime_module
+    return DDB_RUNTIME == "onnx" or ddb_runtime_module.onnx_model_path(DEEPDANBOORU_PROJECT_PATH).exists()
+
+def _init_onnx_deepdanbooru():
+    """変換済み ONNX の DeepDanbooru を開く (DDB_RUNTIME == "onnx" で未変換なら、ここで 1 回だけ変換)。失敗時は Keras にフォールバック。"""
+    global STD_DEEPDANBOORU_MODEL, STD_DEEPDANBOORU_TAGS
+    from . import ddb_runtime as ddb_runtime_module
+    model_path = ddb_runtime_module.onnx_model_path(DEEPDANBOORU_PROJECT_PATH)
+    try:
+        if not model_path.exists():
+            print(f"[Scoring] DeepDanbooru を ONNX に変換中 (初回のみ、TensorFlow を使用)...")
+            if not load_backend("deepdanbooru"): raise RuntimeError(_deepdanbooru_import_error)
+            ddb_runtime_module.convert_project_to_onnx(DEEPDANBOORU_PROJECT_PATH, model_path)
+        STD_DEEPDANBOORU_MODEL = ddb_runtime_module.OnnxDeepDanbooru(model_path, _inference_threads("ddb", ONNX_INTRA_OP_THREADS))
+        STD_DEEPDANBOORU_TAGS = ddb_runtime_module.load_tags(DEEPDANBOORU_PROJECT_PATH)
+        print(f"[Scoring] DeepDanbooru (ONNX Runtime) ロード完了。 ({model_path.name}, {len(STD_DEEPDANBOORU_TAGS)}タグ)")
+    except Exception as e_ddb_onnx:
+        print(f"[Scoring] DeepDanbooru ONNX の準備に失敗 (Keras を使用): {e_ddb_onnx}"); STD_DEEPDANBOORU_MODEL = STD_DEEPDANBOORU_TAGS = None
 
 def initialize_standard_models(force_cpu=False, progress_callback=None):
-    global STD_CLIP_MODEL_AESTHETIC, STD_CLIP_PROCESSOR_AESTHETIC, STD_AESTHETIC_PREDICTOR, \
+    global STD_CLIP_MODEL_AESTHETIC, STD_CLIP_PROCESSOR_AESTHETIC, STD_AESTHETIC_PREDICTOR, STD_AESTHETIC_ONNX, \
            STD_DEEPDANBOORU_MODEL, STD_DEEPDANBOORU_TAGS, DEVICE, INITIALIZED_SUCCESSFULLY, _AestheticPredictorActualClass
 
     if not PILLOW_HEIF_AVAILABLE: print("[Scoring] pillow_heif が見つかりません。HEIF/HEIC形式のサムネイル生成はスキップされます。")
     if not CUSTOM_SCORER_AVAILABLE: print("[Scoring] カスタムスコアラー (custom_scoring.py) なし。標準を使用。")
+    if progress_callback: progress_callback.emit("AIライブラリ (torch / TensorFlow) 読込中...", 0)
+    load_ml_backends(["torch", "aesthetics_predictor"])
+    ddb_onnx_wanted = _deepdanbooru_onnx_wanted()
+    if not ddb_onnx_wanted: load_backend("deepdanbooru")  # ONNX で動かす場合は TensorFlow をインポートしない
 
-    required_libs_present = all([torch, CLIPModel, CLIPProcessor, _deepdanbooru_module, _AestheticPredictorActualClass, CLIPConfig])
+    required_libs_present = all([torch, CLIPModel, CLIPProcessor, ddb_onnx_wanted or _deepdanbooru_module, _AestheticPredictorActualClass, CLIPConfig])
     if not required_libs_present:
         missing_details = [];
         if not torch: missing_details.append("torch")
         if not CLIPModel: missing_details.append("transformers.CLIPModel/Processor/Config")
-        if not _deepdanbooru_module: missing_details.append(f"deepdanbooru (Error: {_deepdanbooru_import_error or 'Unknown'})")
+        if not (ddb_onnx_wanted or _deepdanbooru_module): missing_details.append(f"deepdanbooru (Error: {_deepdanbooru_import_error or 'Unknown'})")
         if not _AestheticPredictorActualClass: missing_details.append(f"AestheticsPredictor (Error: {_aesthetic_predictor_import_error or 'Unknown'})")
         msg = f"標準スコアラー初期化に必要なライブラリ不足: {', '.join(missing_details)}。"
         print(f"[Scoring] {msg}"); INITIALIZED_SUCCESSFULLY = False
@@ -123,65 +312,98 @@ def initialize_standard_models(force_cpu=False, progress_callback=None):
         print(f"[Scoring] 標準モデル初期化中... (デバイス: {DEVICE})")
         AESTHETIC_MODEL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
-        if progress_callback: progress_callback.emit(f"CLIP ({AESTHETIC_CLIP_MODEL_ID}) ロード中 (Aesthetic用)...", 10)
+        if progress_callback: progress_callback.emit(f"CLIP ({AESTHETIC_CLIP_MODEL_ID}) 前処理設定ロード中 (Aesthetic用)...", 10)
+        clip_cache_dir = str(AESTHETIC_MODEL_CACHE_DIR / "clip_for_aesthetic"); clip_config = None
+        from . import model_snapshot as model_snapshot_module
+        snapshot_manifest = model_snapshot_module.valid_snapshot(_snapshot_model_ids()) if USE_MODEL_SNAPSHOT else None
         try:
-            STD_CLIP_PROCESSOR_AESTHETIC = CLIPProcessor.from_pretrained(AESTHETIC_CLIP_MODEL_ID, cache_dir=str(AESTHETIC_MODEL_CACHE_DIR / "clip_for_aesthetic"))
-            STD_CLIP_MODEL_AESTHETIC = CLIPModel.from_pretrained(AESTHETIC_CLIP_MODEL_ID, cache_dir=str(AESTHETIC_MODEL_CACHE_DIR / "clip_for_aesthetic")).to(DEVICE).eval()
-            print(f"[Scoring] Aesthetic用CLIPモデル ({AESTHETIC_CLIP_MODEL_ID}) ロード完了。")
+            # CLIP の重みはここではロードしない (画像バックボーンは Aesthetic Predictor の 1 つだけを共有する)
+            STD_CLIP_PROCESSOR_AESTHETIC = None
+            if snapshot_manifest:
+                try:
+                    STD_CLIP_PROCESSOR_AESTHETIC = CLIPProcessor.from_pretrained(str(model_snapshot_module.processor_dir(snapshot_manifest)), local_files_only=True)
+                    clip_config = CLIPConfig.from_pretrained(str(model_snapshot_module.processor_dir(snapshot_manifest)), local_files_only=True)
+                except Exception as e_snap_clip:
+                    print(f"[Scoring] スナップショットからのCLIP前処理ロード失敗 (Hub から再取得): {e_snap_clip}")
+                    model_snapshot_module.invalidate(snapshot_manifest); snapshot_manifest = None; STD_CLIP_PROCESSOR_AESTHETIC = clip_config = None
+            if STD_CLIP_PROCESSOR_AESTHETIC is None:
+                STD_CLIP_PROCESSOR_AESTHETIC = CLIPProcessor.from_pretrained(AESTHETIC_CLIP_MODEL_ID, cache_dir=clip_cache_dir)
+                clip_config = CLIPConfig.from_pretrained(AESTHETIC_CLIP_MODEL_ID, cache_dir=clip_cache_dir)
+            print(f"[Scoring] Aesthetic用CLIP前処理/設定 ({AESTHETIC_CLIP_MODEL_ID}) ロード完了。{' (スナップショット)' if snapshot_manifest else ''}")
         except Exception as e_clip_aesth:
-            print(f"[Scoring] Aesthetic用CLIPモデルロード失敗: {e_clip_aesth}")
-            if progress_callback: progress_callback.emit(f"Aesthetic用CLIPロード失敗", 25); STD_CLIP_MODEL_AESTHETIC = None
+            print(f"[Scoring] Aesthetic用CLIP前処理/設定ロード失敗: {e_clip_aesth}")
+            if progress_callback: progress_callback.emit(f"Aesthetic用CLIPロード失敗", 25)
 
-        if progress_callback: progress_callback.emit("Aesthetic Predictor インスタンス化中...", 30)
-        try:
-            if _AestheticPredictorActualClass and STD_CLIP_MODEL_AESTHETIC:
-                if _AestheticPredictorActualClass.__name__ == 'AestheticsPredictorV2Linear':
-                    print(f"[Scoring] Attempting to load AestheticsPredictorV2Linear from: {AESTHETIC_PREDICTOR_V2_HF_MODEL_ID}")
-                    STD_AESTHETIC_PREDICTOR = _AestheticPredictorActualClass.from_pretrained(
-                        AESTHETIC_PREDICTOR_V2_HF_MODEL_ID,
-                        cache_dir=str(AESTHETIC_MODEL_CACHE_DIR / "aesthetic_v2_model")
-                    )
-                elif _AestheticPredictorActualClass.__name__ == 'AestheticsPredictorV1':
-                    print(f"[Scoring] Attempting to instantiate AestheticsPredictorV1 with CLIP config.")
-                    class DummyV1Config: pass
-                    try:
-                        config_obj = STD_CLIP_MODEL_AESTHETIC.config
-                        if not hasattr(config_obj, 'hidden_size') and hasattr(config_obj, 'projection_dim'):
-                            config_obj.hidden_size = config_obj.projection_dim
-                        STD_AESTHETIC_PREDICTOR = _AestheticPredictorActualClass(config=config_obj)
-                    except Exception as e_v1_init:
-                         print(f"[Scoring] AestheticsPredictorV1 instantiation with CLIP config failed: {e_v1_init}")
-                         STD_AESTHETIC_PREDICTOR = None
+        # ONNX int8 バックエンド (CPU のみ): キャッシュ済みなら PyTorch の重みはロードしない
+        onnx_wanted = AESTHETIC_BACKEND == "onnx_int8" and DEVICE == "cpu"; STD_AESTHETIC_ONNX = None
+        if AESTHETIC_BACKEND == "onnx_int8" and not onnx_wanted: print(f"[Scoring] ONNX int8 バックエンドは CPU 専用のため、{DEVICE} では PyTorch を使用します。")
+        if onnx_wanted and STD_CLIP_PROCESSOR_AESTHETIC: _init_onnx_aesthetic(progress_callback)
+        if STD_AESTHETIC_ONNX is None:
+            if progress_callback: progress_callback.emit("Aesthetic Predictor インスタンス化中...", 30)
+            try:
+                if _AestheticPredictorActualClass and STD_CLIP_PROCESSOR_AESTHETIC:
+                    STD_AESTHETIC_PREDICTOR = _load_predictor_from_snapshot(snapshot_manifest) if snapshot_manifest else None; predictor_from_snapshot = STD_AESTHETIC_PREDICTOR is not None
+                    if predictor_from_snapshot: pass
+                    elif _AestheticPredictorActualClass.__name__ == 'AestheticsPredictorV2Linear':
+                        print(f"[Scoring] Attempting to load AestheticsPredictorV2Linear from: {AESTHETIC_PREDICTOR_V2_HF_MODEL_ID}")
+                        STD_AESTHETIC_PREDICTOR = _AestheticPredictorActualClass.from_pretrained(
+                            AESTHETIC_PREDICTOR_V2_HF_MODEL_ID,
+                            cache_dir=str(AESTHETIC_MODEL_CACHE_DIR / "aesthetic_v2_model")
+                        )
+                    elif _AestheticPredictorActualClass.__name__ == 'AestheticsPredictorV1':
+                        print(f"[Scoring] Attempting to instantiate AestheticsPredictorV1 with CLIP vision config.")
+                        try:
+                            config_obj = clip_config.vision_config
+                            if not hasattr(config_obj, 'projection_dim'): config_obj.projection_dim = clip_config.projection_dim
+                            STD_AESTHETIC_PREDICTOR = _AestheticPredictorActualClass(config=config_obj)
+                            # 画像側 (vision tower + projection) の重みだけを読み込む。テキスト側はロードしない
+                            vision_state = CLIPVisionModelWithProjection.from_pretrained(AESTHETIC_CLIP_MODEL_ID, cache_dir=clip_cache_dir).state_dict()
+                            missing = STD_AESTHETIC_PREDICTOR.load_state_dict(vision_state, strict=False).missing_keys; del vision_state
+                            if missing: print(f"[Scoring] AestheticsPredictorV1: CLIP重みに無いキー (ヘッド等): {missing}")
+                        except Exception as e_v1_init:
+                             print(f"[Scoring] AestheticsPredictorV1 instantiation with CLIP config failed: {e_v1_init}")
+                             STD_AESTHETIC_PREDICTOR = None
+                    else:
+                        print(f"[Scoring] Attempting to instantiate fallback {_AestheticPredictorActualClass.__name__}.")
+                        STD_AESTHETIC_PREDICTOR = _AestheticPredictorActualClass(model_name="vit_l_14")
+
+                    if STD_AESTHETIC_PREDICTOR:
+                        if USE_MODEL_SNAPSHOT and not predictor_from_snapshot: _write_model_snapshot(clip_config)
+                        if hasattr(STD_AESTHETIC_PREDICTOR, 'to') and callable(getattr(STD_AESTHETIC_PREDICTOR, 'to')):
+                             STD_AESTHETIC_PREDICTOR.to(DEVICE)
+                        if hasattr(STD_AESTHETIC_PREDICTOR, 'eval') and callable(getattr(STD_AESTHETIC_PREDICTOR, 'eval')):
+                             STD_AESTHETIC_PREDICTOR.eval()
+                        STD_CLIP_MODEL_AESTHETIC = STD_AESTHETIC_PREDICTOR  # 共有 CLIP 画像バックボーン
+                        print(f"[Scoring] Aesthetic Predictor ({_AestheticPredictorActualClass.__name__ if _AestheticPredictorActualClass else 'None'}) インスタンス化完了。")
+                        _report_clip_memory(clip_config)
                 else:
-                    print(f"[Scoring] Attempting to instantiate fallback {_AestheticPredictorActualClass.__name__}.")
-                    STD_AESTHETIC_PREDICTOR = _AestheticPredictorActualClass(model_name="vit_l_14")
-
-                if STD_AESTHETIC_PREDICTOR:
-                    if hasattr(STD_AESTHETIC_PREDICTOR, 'to') and callable(getattr(STD_AESTHETIC_PREDICTOR, 'to')):
-                         STD_AESTHETIC_PREDICTOR.to(DEVICE)
-                    if hasattr(STD_AESTHETIC_PREDICTOR, 'eval') and callable(getattr(STD_AESTHETIC_PREDICTOR, 'eval')):
-                         STD_AESTHETIC_PREDICTOR.eval()
-                    print(f"[Scoring] Aesthetic Predictor ({_AestheticPredictorActualClass.__name__ if _AestheticPredictorActualClass else 'None'}) インスタンス化完了。")
-            else:
-                print("[Scoring] _AestheticPredictorActualClass または Aesthetic用CLIPモデルが未ロードのため、初期化できません。")
+                    print("[Scoring] _AestheticPredictorActualClass または Aesthetic用CLIP前処理が未ロードのため、初期化できません。")
+                    STD_AESTHETIC_PREDICTOR = None
+            except Exception as e_ap_init:
+                print(f"[Scoring] Aesthetic Predictor のインスタンス化失敗: {e_ap_init}。クラス: {_AestheticPredictorActualClass}")
                 STD_AESTHETIC_PREDICTOR = None
-        except Exception as e_ap_init:
-            print(f"[Scoring] Aesthetic Predictor のインスタンス化失敗: {e_ap_init}。クラス: {_AestheticPredictorActualClass}")
-            STD_AESTHETIC_PREDICTOR = None
+            if onnx_wanted and STD_AESTHETIC_PREDICTOR: _init_onnx_aesthetic(progress_callback)
+            _init_torch_accel()
+            if STD_AESTHETIC_PREDICTOR is not None and STD_AESTHETIC_ONNX is None and STD_AESTHETIC_ACCEL is None and _inference_threads("clip"):
+                torch.set_num_threads(_inference_threads("clip", TORCH_INTRA_OP_THREADS))
+        _init_cascade_model(progress_callback)
 
         if progress_callback: progress_callback.emit("DeepDanbooruモデル ロード中...", 60)
         if not DEEPDANBOORU_PROJECT_PATH.exists() or not (DEEPDANBOORU_PROJECT_PATH / "project.json").exists():
             print(f"[Scoring] DeepDanbooruプロジェクトなし: {DEEPDANBOORU_PROJECT_PATH}。setup_env.bat実行要。")
         else:
+            if ddb_onnx_wanted: _init_onnx_deepdanbooru()
             try:
-                if _deepdanbooru_module:
+                if STD_DEEPDANBOORU_MODEL is not None: pass
+                elif load_backend("deepdanbooru"):
+                    if CONCURRENT_INFERENCE: _limit_tensorflow_threads()
                     STD_DEEPDANBOORU_MODEL = _deepdanbooru_module.project.load_model_from_project(str(DEEPDANBOORU_PROJECT_PATH))
                     STD_DEEPDANBOORU_TAGS = _deepdanbooru_module.project.load_tags_from_project(str(DEEPDANBOORU_PROJECT_PATH))
                     print(f"[Scoring] DeepDanbooruモデルロード完了。 (プロジェクト: {DEEPDANBOORU_PROJECT_PATH})")
                 else: print("[Scoring] DeepDanbooruモジュール未インポートのためロードスキップ。")
             except Exception as e_ddb: print(f"[Scoring] DeepDanbooruモデルロード失敗: {e_ddb}")
 
-        INITIALIZED_SUCCESSFULLY = bool(STD_CLIP_MODEL_AESTHETIC and STD_AESTHETIC_PREDICTOR and STD_DEEPDANBOORU_MODEL)
+        INITIALIZED_SUCCESSFULLY = bool(_aesthetic_available() and STD_DEEPDANBOORU_MODEL)
         status_msg = "標準モデル初期化完了。" if INITIALIZED_SUCCESSFULLY else "標準モデル初期化に一部失敗。機能限定。"
         print(f"[Scoring] {status_msg}")
         if progress_callback: progress_callback.emit(status_msg, 100)
@@ -189,72 +411,246 @@ def initialize_standard_models(force_cpu=False, progress_callback=None):
         print(f"[Scoring] 標準モデル初期化中に予期せぬエラー: {e_init_std_models}"); INITIALIZED_SUCCESSFULLY = False
         if progress_callback: progress_callback.emit(f"初期化エラー: {e_init_std_models}", 100)
 
-def score_one_standard(image_path: Path, penalties_dict: dict):
-    if not INITIALIZED_SUCCESSFULLY:
-        return round(np.random.uniform(3.0, 7.0), 1), ["dummy_model_not_init"], round(np.random.uniform(10.0, 60.0), 1), {}
-    try: img_pil = Image.open(image_path).convert("RGB")
-    except Exception as e_img_open: return 0.0, [f"image_open_error:{str(e_img_open)[:20]}"], 0.0, {}
+def _dummy_score():
+    return round(np.random.uniform(3.0, 7.0), 1), ["dummy_model_not_init"], round(np.random.uniform(10.0, 60.0), 1), {}
 
-    base_aesthetic_score = 0.0; detected_failure_tags = []
-    raw_aesthetic_score = 0.5
+def _open_error_score(error):
+    return 0.0, [f"image_open_error:{str(error)[:20]}"], 0.0, {}
 
-    if STD_AESTHETIC_PREDICTOR and STD_CLIP_MODEL_AESTHETIC and STD_CLIP_PROCESSOR_AESTHETIC and torch:
+def _open_rgb_images(image_paths, ingests=None):
+    """
+    画像を RGB で開く。ingests があればデコード済み画像を共有する。
+    失敗した画像は None と (0.0, [エラータグ], 0.0, {}) の結果を返す。
+    """
+    images = []; open_errors = {}
+    for idx, image_path in enumerate(image_paths):
+        ingest = ingests[idx] if ingests else None
         try:
-            # --- 修正版: simple-aesthetics-predictor の推論パターン ---
-            # CLIPProcessor で前処理した生画像を直接渡す
-            inputs = STD_CLIP_PROCESSOR_AESTHETIC(images=img_pil, return_tensors="pt").to(DEVICE)
-            with torch.no_grad():
-                outputs = STD_AESTHETIC_PREDICTOR(**inputs)
-                # wrapper の出力は logits 属性
-                score_tensor = outputs.logits
-                # 0〜1 に正規化（必要なら sigmoid、不要なら .item() のみでもOK）
-                raw_aesthetic_score = torch.sigmoid(score_tensor).item()
-            # 0〜10 スケールに変換
-            base_aesthetic_score = raw_aesthetic_score * 10.0
-
-        except ValueError as ve:
-             print(f"[Scoring] Aestheticスコア計算中にValueError ({image_path.name}): {ve}. ダミースコアを使用。")
-             base_aesthetic_score = np.random.uniform(1.0, 5.0)
-        except Exception as e_aesth:
-            print(f"[Scoring] Aestheticスコア計算エラー ({image_path.name}): {e_aesth}")
-            base_aesthetic_score = np.random.uniform(1.0, 5.0)
-    else:
-        base_aesthetic_score = np.random.uniform(4.0, 9.0)
-        if _aesthetic_predictor_import_error:
-            detected_failure_tags.append("aesthetic_predictor_unavailable")
-
-    import inspect
-    print("evaluate signature:", inspect.signature(_deepdanbooru_module.commands.evaluate))
-    # DeepDanbooru 評価呼び出しの直前に追加
-
-    # scoring.py の score_one_standard 内 DeepDanbooru 評価部分
-    # ────────────────────────────────────────────
-    # ─── scoring.py 内の DeepDanbooru 評価部分 ───
-    if STD_DEEPDANBOORU_MODEL and STD_DEEPDANBOORU_TAGS:  
-        try:  
-            # 画像をモデルの入力サイズにリサイズ  
-            input_shape = STD_DEEPDANBOORU_MODEL.input_shape  # (None, H, W, 3)  
-            target_size = (input_shape[1], input_shape[2])  
-            img_resized = img_pil.resize(target_size, Image.Resampling.LANCZOS)  
-  
-            # 前処理: 0-1 に正規化 + バッチ次元追加  
-            img_array = np.asarray(img_resized, dtype=np.float32) / 255.0  
-            batch = np.expand_dims(img_array, axis=0)  
-  
-            # モデル推論  
-            preds = STD_DEEPDANBOORU_MODEL.predict(batch)[0]  # shape: (num_tags,)  
-  
-            # しきい値 0.5 以上を “破綻タグ” として収集  
-            threshold = 0.5  
-            detected_failure_tags.extend([  
-                tag for tag, score in zip(STD_DEEPDANBOORU_TAGS, preds)  
-                if score >= threshold  
-            ])  
-        except Exception as e_infer:  
-            print(f"[Scoring] DeepDanbooru 自前推論エラー ({image_path.name}): {e_infer}")  
-    else:
-        if not _deepdanbooru_module and _deepdanbooru_import_error: detected_failure_tags.append("deepdanbooru_unavailable")
+            if ingest is None:
+                images.append(open_rgb(image_path, decode_target_size())); continue  # open / decode の時間は ImageIngest が記録する
+            img_rgb = ingest.rgb
+            if img_rgb is None: raise OSError(ingest.stage_error("open", "decode"))
+            images.append(img_rgb)
+        except Exception as e_img_open:
+            images.append(None); open_errors[idx] = _open_error_score(e_img_open)
+            if ingest is not None: ingest.record_error("scoring", e_img_open)
+    return images, open_errors
+
+def _aesthetic_available():
+    if not STD_CLIP_PROCESSOR_AESTHETIC: return False
+    return bool(STD_AESTHETIC_ONNX is not None or (STD_AESTHETIC_PREDICTOR and STD_CLIP_MODEL_AESTHETIC and torch))
+
+def _deepdanbooru_available():
+    return bool(STD_DEEPDANBOORU_MODEL and STD_DEEPDANBOORU_TAGS)
+
+def decode_target_size():
+    """
+    縮小デコードの目標 (幅, 高さ): サムネイルと各モデル入力が必要とする最小解像度。REDUCED_DECODE が無効なら None。
+    DeepDanbooru はアスペクト比を無視して入力サイズに合わせるので両辺、CLIP は短辺 (クロップ前のリサイズ先) を満たせばよい。
+    """
+    if not REDUCED_DECODE: return None
+    width, height = THUMBNAIL_SIZE
+    if not CUSTOM_SCORER_AVAILABLE and _aesthetic_available():
+        size = getattr(getattr(STD_CLIP_PROCESSOR_AESTHETIC, "image_processor", None), "size", None) or {}
+        shortest = int(size.get("shortest_edge", 224)) if isinstance(size, dict) else 224; width = max(width, shortest); height = max(height, shortest)
+    if not CUSTOM_SCORER_AVAILABLE and _deepdanbooru_available():
+        input_shape = STD_DEEPDANBOORU_MODEL.input_shape; width = max(width, int(input_shape[2] or 0)); height = max(height, int(input_shape[1] or 0))
+    plugin_size = scorer_plugins_module.required_decode_size(SCORER_PLUGINS)
+    if plugin_size is None: return None  # 元の大きさの画像が必要なプラグインがある
+    return max(width, plugin_size[0]), max(height, plugin_size[1])
+
+def preprocess_for_models(img_rgb):
+    """
+    デコード済み RGB 画像から各モデルの入力配列を作ります (推論は行わないのでワーカースレッドから呼べます)。
+    Returns:
+        dict: "clip" (3, H, W) / "ddb" (H, W, 3) の float32 配列、"plugins" {プラグイン名: uint8 配列}。前処理に失敗したモデルは None。
+    """
+    model_inputs = {"clip": None, "ddb": None, "plugins": None}
+    if SCORER_PLUGINS:
+        try: model_inputs["plugins"] = scorer_plugins_module.prepare_inputs(SCORER_PLUGINS, img_rgb)
+        except Exception as e_plugin_pre: print(f"[Scoring] プラグイン前処理エラー: {e_plugin_pre}")
+    if CUSTOM_SCORER_AVAILABLE: return model_inputs
+    if _aesthetic_available():
+        try:
+            with perf_stats_module.timed("clip_preprocess"): model_inputs["clip"] = STD_CLIP_PROCESSOR_AESTHETIC(images=img_rgb, return_tensors="np")["pixel_values"][0]
+        except Exception as e_clip_pre: print(f"[Scoring] CLIP前処理エラー: {e_clip_pre}")
+    if _deepdanbooru_available():
+        try:
+            input_shape = STD_DEEPDANBOORU_MODEL.input_shape  # (None, H, W, 3)
+            target_size = (input_shape[1], input_shape[2])
+            # モデル入力サイズにリサイズし 0-1 に正規化
+            with perf_stats_module.timed("ddb_resize"): model_inputs["ddb"] = np.asarray(img_rgb.resize(target_size, Image.Resampling.LANCZOS, reducing_gap=3.0), dtype=np.float32) / 255.0
+        except Exception as e_ddb_pre: print(f"[Scoring] DeepDanbooru前処理エラー: {e_ddb_pre}")
+    return model_inputs
+
+def logits_to_aesthetic_score(logits):
+    """Aesthetic ヘッドの出力 (logits, numpy) を 0〜10 のスコアに変換 (ヘッドのみ再スコアでも同じ変換を使う)。"""
+    return 10.0 / (1.0 + np.exp(-np.asarray(logits, dtype=np.float64).reshape(-1)))
+
+def _aesthetic_model_id():
+    return f"{_AestheticPredictorActualClass.__name__ if _AestheticPredictorActualClass else 'none'}:{AESTHETIC_PREDICTOR_V2_HF_MODEL_ID}"
+
+def aesthetic_embedding_model_id():
+    """CLIP 埋め込み/スコアを作ったモデルの識別子 (embedding_store のリセット判定、キャッシュのバージョン用)。int8 は別扱い。"""
+    return _aesthetic_model_id() + ("|onnx_int8" if STD_AESTHETIC_ONNX is not None else "")
+
+def _aesthetic_forward(pixel_values_np):
+    """(N, 3, H, W) float32 -> (logits (N, 1), 正規化済み埋め込み (N, D) or None)。ONNX / PyTorch 高速化 / PyTorch eager を切り替える。"""
+    if STD_AESTHETIC_ONNX is not None: return STD_AESTHETIC_ONNX.run(pixel_values_np)
+    if STD_AESTHETIC_ACCEL is not None: return STD_AESTHETIC_ACCEL.run(pixel_values_np)
+    pixel_values = torch.from_numpy(pixel_values_np).to(DEVICE)
+    with torch.no_grad():
+        outputs = STD_AESTHETIC_PREDICTOR(pixel_values=pixel_values)
+        # hidden_states にはヘッド入力 (正規化済み画像埋め込み (N, D)) が入る
+        embeds = getattr(outputs, "hidden_states", None)
+        return outputs.logits.float().cpu().numpy(), (embeds.float().cpu().numpy() if torch.is_tensor(embeds) and embeds.dim() == 2 else None)
+
+def _aesthetic_scores_batch(pixel_values_list, names):
+    """
+    前処理済み CLIP 入力を 1 テンソル (N, 3, H, W) に積んで Aesthetic Predictor に通し、
+    (0〜10 のスコア, predictor 不在フラグ, 正規化済み CLIP 画像埋め込み (float16, 取れなければ None)) を返す。
+    """
+    embeddings = [None] * len(pixel_values_list)
+    if not _aesthetic_available():
+        return [np.random.uniform(4.0, 9.0) for _ in pixel_values_list], bool(_aesthetic_predictor_import_error), embeddings
+    scores = [None] * len(pixel_values_list)
+    valid_idx = [i for i, pv in enumerate(pixel_values_list) if pv is not None]
+    try:
+        if valid_idx:
+            with perf_stats_module.timed("clip_inference", len(valid_idx)): logits, embeds = _aesthetic_forward(np.stack([pixel_values_list[i] for i in valid_idx]).astype(np.float32, copy=False))
+            # wrapper の出力は logits (N, 1)。0〜1 に正規化してから 0〜10 スケールに変換
+            batch_scores = logits_to_aesthetic_score(logits)
+            batch_embeds = embeds.astype(np.float16) if embeds is not None else None
+            for k, i in enumerate(valid_idx):
+                scores[i] = float(batch_scores[k])
+                if batch_embeds is not None: embeddings[i] = batch_embeds[k]
+    except ValueError as ve:
+        print(f"[Scoring] Aestheticスコア計算中にValueError ({', '.join(names)}): {ve}. ダミースコアを使用。")
+    except Exception as e_aesth:
+        print(f"[Scoring] Aestheticスコア計算エラー ({', '.join(names)}): {e_aesth}")
+    return [s if s is not None else np.random.uniform(1.0, 5.0) for s in scores], False, embeddings
+
+def _cascade_active():
+    return CASCADE_MODE in ("clip_b32", "ddb") and _aesthetic_available()
+
+def _cascade_cheap_scores(pixel_values_list, names):
+    """安価な段の基本スコア (0〜10)。ViT-B/32 が使えなければ CASCADE_DDB_PRIOR_SCORE、前処理や簡易推論に失敗した画像は None (ViT-L に回す)。"""
+    if STD_CASCADE_PREDICTOR is None: return [None if pv is None else CASCADE_DDB_PRIOR_SCORE for pv in pixel_values_list]
+    scores = [None] * len(pixel_values_list); valid_idx = [i for i, pv in enumerate(pixel_values_list) if pv is not None]
+    if not valid_idx: return scores
+    try:
+        batch = np.stack([pixel_values_list[i] for i in valid_idx]).astype(np.float32, copy=False)
+        with perf_stats_module.timed("cascade_cheap_inference", len(valid_idx)):
+            if hasattr(STD_CASCADE_PREDICTOR, "run"): logits = STD_CASCADE_PREDICTOR.run(batch)[0]  # ONNX 形式のランナー
+            else:
+                with torch.no_grad(): logits = STD_CASCADE_PREDICTOR(pixel_values=torch.from_numpy(batch).to(DEVICE)).logits.float().cpu().numpy()
+        for i, score in zip(valid_idx, logits_to_aesthetic_score(logits)): scores[i] = float(score)
+    except Exception as e_cheap: print(f"[Scoring] カスケード簡易推論エラー ({', '.join(names)}): {e_cheap}")
+    return scores
+
+def _cascade_needs_full(cheap_base, tags, penalties_dict):
+    if cheap_base is None: return True
+    if STD_CASCADE_PREDICTOR is None:  # 減点だけ: 基本スコアが満点でも削除の目安 - 幅 を下回る (明らかに破綻した) 画像だけ確定
+        return _apply_penalties(10.0, tags, penalties_dict)[2] >= CASCADE_DELETE_THRESHOLD - CASCADE_BAND
+    return abs(_apply_penalties(cheap_base, tags, penalties_dict)[2] - CASCADE_DELETE_THRESHOLD) <= CASCADE_BAND
+
+def _cascade_base_scores(clip_inputs, names, ddb_tags, penalties_dict):
+    """
+    カスケード: 安価な段の基本スコアと DeepDanbooru の破綻タグで仮の score_final を出し、
+    削除の目安 (CASCADE_DELETE_THRESHOLD) ± CASCADE_BAND に入った画像だけ ViT-L の Aesthetic を通す。
+    Returns: (基本スコア, predictor 不在フラグ, 埋め込み (ViT-L を通した画像のみ), 画像ごとの段)
+    """
+    n = len(clip_inputs); base_scores = _cascade_cheap_scores(clip_inputs, names)
+    escalate = [i for i in range(n) if _cascade_needs_full(base_scores[i], ddb_tags[i], penalties_dict)]
+    embeddings = [None] * n; stages = [CASCADE_STAGE_CHEAP if STD_CASCADE_PREDICTOR is not None else CASCADE_STAGE_PRIOR] * n
+    if escalate:
+        full_scores, _unavailable, full_embeds = _aesthetic_scores_batch([clip_inputs[i] for i in escalate], [names[i] for i in escalate])
+        for k, i in enumerate(escalate): base_scores[i] = full_scores[k]; embeddings[i] = full_embeds[k]; stages[i] = CASCADE_STAGE_FULL
+    perf_stats_module.count("cascade_full", len(escalate)); perf_stats_module.count("cascade_skipped", n - len(escalate))
+    return base_scores, False, embeddings, stages
+
+def cascade_report():
+    """
+    カスケードで ViT-L を通した/省いた枚数と、省いた推論時間の見積もり (perf_stats の CLIP推論 1 枚あたり平均から)。
+    カスケードを使っていなければ None。
+    """
+    summary = perf_stats_module.get_perf_stats().summary(); counters = summary.get("counters", {})
+    full = counters.get("cascade_full", 0); skipped = counters.get("cascade_skipped", 0)
+    if full + skipped == 0: return None
+    report = {"full": full, "skipped": skipped, "skipped_ratio": round(skipped / (full + skipped), 3)}
+    vit_ms = summary["stages"].get("clip_inference", {}).get("mean_ms")
+    if vit_ms is not None:
+        cheap_ms = summary["stages"].get("cascade_cheap_inference", {}).get("mean_ms", 0.0)
+        report["saved_sec"] = round(skipped * vit_ms / 1000.0, 1); report["overhead_sec"] = round((full + skipped) * cheap_ms / 1000.0, 1)
+        report["net_saved_sec"] = round(report["saved_sec"] - report["overhead_sec"], 1)
+    return report
+
+def cascade_report_text():
+    report = cascade_report()
+    if report is None: return ""
+    text = f"カスケード: ViT-L {report['full']}枚 / 省略 {report['skipped']}枚 ({report['skipped_ratio'] * 100:.0f}%)"
+    if "net_saved_sec" in report: text += f", 推論時間 約{report['net_saved_sec']:.1f}秒 節約 (省略 {report['saved_sec']:.1f}秒 - 簡易推論 {report['overhead_sec']:.1f}秒)"
+    return text
+
+def tag_threshold(tag_name):
+    return TAG_THRESHOLDS.get(tag_name, DEEPDANBOORU_THRESHOLD)
+
+def _deepdanbooru_threshold_vector():
+    thresholds = np.full(len(STD_DEEPDANBOORU_TAGS), DEEPDANBOORU_THRESHOLD, dtype=np.float32)
+    if TAG_THRESHOLDS:
+        for idx, tag in enumerate(STD_DEEPDANBOORU_TAGS):
+            if tag in TAG_THRESHOLDS: thresholds[idx] = TAG_THRESHOLDS[tag]
+    return thresholds
+
+def _deepdanbooru_tags_batch(ddb_arrays, names):
+    """
+    前処理済み入力を 1 つの配列 (N, H, W, 3) に積んで DeepDanbooru で推論し、画像ごとに
+    しきい値以上のタグと、TAG_PROB_STORE_FLOOR 以上の候補タグ確率 {tag: prob} を返す。
+    推論できなかった画像の確率は None ({} は「候補タグなし」)。
+    """
+    tags_per_image = [[] for _ in ddb_arrays]; probs_per_image = [None for _ in ddb_arrays]
+    if not _deepdanbooru_available():
+        if not _deepdanbooru_module and _deepdanbooru_import_error:
+            for tags in tags_per_image: tags.append("deepdanbooru_unavailable")
+        return tags_per_image, probs_per_image
+    valid_idx = [i for i, arr in enumerate(ddb_arrays) if arr is not None]
+    if not valid_idx: return tags_per_image, probs_per_image
+    try:
+        batch = np.stack([ddb_arrays[i] for i in valid_idx])
+        with perf_stats_module.timed("ddb_inference", len(valid_idx)): preds_batch = np.asarray(STD_DEEPDANBOORU_MODEL.predict(batch, batch_size=len(valid_idx), verbose=0))  # shape: (N, num_tags)
+        thresholds = _deepdanbooru_threshold_vector()
+        for i, preds in zip(valid_idx, preds_batch):
+            tags_per_image[i].extend(STD_DEEPDANBOORU_TAGS[j] for j in np.nonzero(preds >= thresholds)[0])
+            probs_per_image[i] = {STD_DEEPDANBOORU_TAGS[j]: round(float(preds[j]), 3) for j in np.nonzero(preds >= TAG_PROB_STORE_FLOOR)[0]}
+    except Exception as e_infer:
+        print(f"[Scoring] DeepDanbooru 自前推論エラー ({', '.join(names)}): {e_infer}")
+    return tags_per_image, probs_per_image
+
+_inference_executors = None; _inference_executors_lock = threading.Lock()
+
+def _get_inference_executors():
+    """CLIP 用・DeepDanbooru 用の専用スレッド (各 1 本。同じモデルを複数スレッドから同時に呼ばない)。"""
+    global _inference_executors
+    with _inference_executors_lock:
+        if _inference_executors is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _inference_executors = {"clip": ThreadPoolExecutor(max_workers=1, thread_name_prefix="clip-inference"),
+                                    "ddb": ThreadPoolExecutor(max_workers=1, thread_name_prefix="ddb-inference")}
+        return _inference_executors
+
+def _run_models_concurrently(clip_inputs, ddb_inputs, names):
+    """同じバッチを CLIP と DeepDanbooru に同時に通し、両方を待って返す (どちらも推論カーネル内では GIL を手放す)。"""
+    executors = _get_inference_executors()
+    clip_future = executors["clip"].submit(_aesthetic_scores_batch, clip_inputs, names)
+    ddb_future = executors["ddb"].submit(_deepdanbooru_tags_batch, ddb_inputs, names)
+    return clip_future.result(), ddb_future.result()
+
+def derive_failure_tags(failure_tags, tag_probs):
+    """保存済みタグ確率から現在のしきい値で破綻タグを作り直す。確率を持たないタグ (カスタム等) はそのまま残す。"""
+    if not tag_probs: return list(failure_tags)
+    return [t for t in failure_tags if t not in tag_probs] + [t for t, p in tag_probs.items() if p >= tag_threshold(t)]
 
+def _apply_penalties(base_aesthetic_score, detected_failure_tags, penalties_dict):
     current_total_penalty = 0.0; applied_penalties_actual = {}
     unique_failure_tags = list(set(detected_failure_tags))
     for tag_name in unique_failure_tags:
@@ -264,29 +660,257 @@ def score_one_standard(image_path: Path, penalties_dict: dict):
     final_score = max(0.0, min(10.0, final_score_calc))
     return round(base_aesthetic_score, 2), unique_failure_tags, round(final_score, 2), applied_penalties_actual
 
+def score_preprocessed_batch(model_inputs_list, names, penalties_dict: dict, extras_out=None, paths=None):
+    """
+    preprocess_for_models の結果をまとめて推論し、画像ごとの (base, tags, final, applied) を返す。
+    extras_out (list) を渡すと、画像ごとの付随出力 {"tag_probs": {tag: prob}, "clip_embedding": ndarray|None, "score_stage": カスケードの段|None} を追記する。
+    paths は元画像のパス (プラグインに渡す。v1 のカスタムスコアラーはパスから自分で開く)。
+    プラグインがあれば、その base_score を標準モデルと重み付き平均し (置き換えモードではそのまま使い)、タグは和集合を取る。
+    v1 のカスタムスコアラーだけのときは、従来どおりスコアラーが返した (base, tags, final, applied) をそのまま使う。
+    """
+    n = len(model_inputs_list); stages = [None] * n
+    plugin_outputs = scorer_plugins_module.run_plugins(SCORER_PLUGINS, [mi.get("plugins") for mi in model_inputs_list], paths, penalties_dict) if SCORER_PLUGINS else [None] * n
+    legacy_only = len(SCORER_PLUGINS) == 1 and isinstance(SCORER_PLUGINS[0], scorer_plugins_module.LegacyScorerAdapter)
+    if CUSTOM_SCORER_AVAILABLE: base_scores, aesthetic_unavailable, embeddings = [None] * n, False, [None] * n; ddb_tags, ddb_probs = [[] for _ in range(n)], [{} for _ in range(n)]
+    else:
+        clip_inputs = [mi["clip"] for mi in model_inputs_list]; ddb_inputs = [mi["ddb"] for mi in model_inputs_list]
+        if _cascade_active():  # 仮スコアに DeepDanbooru のタグが要るので順に実行
+            ddb_tags, ddb_probs = _deepdanbooru_tags_batch(ddb_inputs, names)
+            base_scores, aesthetic_unavailable, embeddings, stages = _cascade_base_scores(clip_inputs, names, ddb_tags, penalties_dict)
+        elif CONCURRENT_INFERENCE: (base_scores, aesthetic_unavailable, embeddings), (ddb_tags, ddb_probs) = _run_models_concurrently(clip_inputs, ddb_inputs, names)
+        else:
+            base_scores, aesthetic_unavailable, embeddings = _aesthetic_scores_batch(clip_inputs, names)
+            ddb_tags, ddb_probs = _deepdanbooru_tags_batch(ddb_inputs, names)
+    results = []
+    for i, (base_s, tags, probs, plugin_out) in enumerate(zip(base_scores, ddb_tags, ddb_probs, plugin_outputs)):
+        if legacy_only and plugin_out["legacy_result"] is not None: results.append(plugin_out["legacy_result"]); stages[i] = LEGACY_CUSTOM_STAGE; continue
+        detected_failure_tags = (["aesthetic_predictor_unavailable"] if aesthetic_unavailable else []) + tags
+        if plugin_out is not None:
+            if plugin_out["tag_probs"] and probs is None: probs = ddb_probs[i] = {}
+            for tag, prob in plugin_out["tag_probs"].items():
+                if prob > probs.get(tag, 0.0): probs[tag] = round(prob, 3)
+            detected_failure_tags += [t for t in plugin_out["failure_tags"] if t not in detected_failure_tags]
+            detected_failure_tags += [t for t, p in plugin_out["tag_probs"].items() if p >= tag_threshold(t) and t not in detected_failure_tags]
+            if plugin_out["base_score"] is not None:
+                base_s = plugin_out["base_score"] if base_s is None else (base_s + plugin_out["base_score"] * plugin_out["base_weight"]) / (1.0 + plugin_out["base_weight"])
+        if base_s is None: base_s = np.random.uniform(3.0, 7.0); detected_failure_tags.append("custom_err")  # 置き換えプラグインがスコアを返さなかった
+        results.append(_apply_penalties(base_s, detected_failure_tags, penalties_dict))
+    if extras_out is not None: extras_out.extend({"tag_probs": p, "clip_embedding": e, "score_stage": st} for p, e, st in zip(ddb_probs, embeddings, stages))
+    return results
+
+def _score_chunk_standard(image_paths, penalties_dict, ingests=None, extras_out=None):
+    images, results = _open_rgb_images(image_paths, ingests)
+    valid_idx = [i for i, img in enumerate(images) if img is not None]; chunk_extras = [{} for _ in image_paths]
+    if valid_idx:
+        model_inputs_list = [preprocess_for_models(images[i]) for i in valid_idx]; valid_extras = []
+        scored = score_preprocessed_batch(model_inputs_list, [Path(image_paths[i]).name for i in valid_idx], penalties_dict, extras_out=valid_extras,
+                                          paths=[str(image_paths[i]) for i in valid_idx])
+        for i, score, extras in zip(valid_idx, scored, valid_extras): results[i] = score; chunk_extras[i] = extras
+    if extras_out is not None: extras_out.extend(chunk_extras)
+    return [results[i] for i in range(len(image_paths))]
+
+def score_batch(image_paths, penalties_dict: dict, batch_size=None, ingests=None, extras_out=None):
+    """
+    複数画像をまとめてスコアリングします。
+    batch_size 枚ずつ CLIP 入力を 1 テンソル、DeepDanbooru 入力を 1 配列に積んで推論します。
+    ingests (ImageIngest のリスト) を渡すと、デコード済み画像を再利用します。
+    extras_out (list) を渡すと、画像ごとの付随出力 (タグ確率・CLIP 埋め込み) を追記します。
+    Returns:
+        list[tuple]: 画像ごとの (base_score, failure_tags, final_score, applied_penalties)。score_one_standard と同じ形式。
+    """
+    image_paths = [Path(p) for p in image_paths]
+    if not INITIALIZED_SUCCESSFULLY:
+        if extras_out is not None: extras_out.extend({} for _ in image_paths)
+        return [_dummy_score() for _ in image_paths]
+    batch_size = max(1, int(batch_size or SCORING_BATCH_SIZE)); results = []
+    for start in range(0, len(image_paths), batch_size):
+        chunk_ingests = ingests[start:start + batch_size] if ingests else None
+        results.extend(_score_chunk_standard(image_paths[start:start + batch_size], penalties_dict, chunk_ingests, extras_out))
+    return results
+
+def score_ingested_batch(ingests, model_inputs_list, penalties_dict: dict, extras_out=None):
+    """
+    パイプライン用: ImageIngest と preprocess_for_models の結果 (デコード失敗は None) からスコアを求める。
+    未初期化時のダミーも score_batch / process_images_batch と同じ扱い。
+    """
+    extras = [{} for _ in ingests]
+    if extras_out is not None: extras_out.extend(extras)  # 以下で要素 (dict) を更新する
+    if not INITIALIZED_SUCCESSFULLY: return [_dummy_score() for _ in ingests]
+    results = [None] * len(ingests); valid_idx = []
+    for i, (ingest, model_inputs) in enumerate(zip(ingests, model_inputs_list)):
+        if model_inputs is not None: valid_idx.append(i); continue
+        error = ingest.stage_error("open", "decode"); ingest.record_error("scoring", error)
+        results[i] = _open_error_score(error)
+    if valid_idx:
+        valid_extras = []
+        scored = score_preprocessed_batch([model_inputs_list[i] for i in valid_idx], [ingests[i].path.name for i in valid_idx], penalties_dict, extras_out=valid_extras,
+                                          paths=[str(ingests[i].path) for i in valid_idx])
+        for i, score, e in zip(valid_idx, scored, valid_extras): results[i] = score; extras[i].update(e)
+    return results
+
+def score_one_standard(image_path: Path, penalties_dict: dict):
+    return score_batch([image_path], penalties_dict, batch_size=1)[0]
+
+def build_score_data(image_path, base_s, fail_tags, final_s, applied_pen):
+    image_path = Path(image_path)
+    return {"id": image_path.stem, "filename": image_path.name, "path": str(image_path),
+            "score_final": final_s, "score_moe": base_s,
+            "score_aesthetic_clip": round(base_s / 10.0, 3) if base_s is not None else 0.0,
+            "failure_tags": fail_tags, "penalties_applied": applied_pen,
+            "last_scored_date": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+
+def attach_thumbnail(score_data, thumbnail_dir, ingest=None):
+    """サムネイルを生成し、成功すれば score_data にローカル/Web パスを書き込む。"""
+    thumb_name = f"{score_data['id']}.jpg"; thumb_p_str = str(Path(thumbnail_dir) / thumb_name)
+    with perf_stats_module.timed("thumbnail"): thumbnail_ok = generate_thumbnail(score_data["path"], thumb_p_str, ingest=ingest)
+    if thumbnail_ok:
+        score_data["thumbnail_path_local"] = thumb_p_str
+        score_data["thumbnail_web_path"] = f"{THUMBNAIL_WEB_PREFIX}/{thumb_name}"
+    return score_data
+
+# --- 内容ハッシュによるスコアキャッシュ ---
+_UNCACHEABLE_TAGS = {"dummy_model_not_init", "custom_err", "aesthetic_predictor_unavailable", "deepdanbooru_unavailable"}
+
+def compute_content_hash(image_path, chunk_size=1 << 20):
+    """ファイル内容の高速ハッシュ (BLAKE2b 128bit)。読めない場合は None。"""
+    try:
+        h = hashlib.blake2b(digest_size=16)
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''): h.update(chunk)
+        return h.hexdigest()
+    except OSError: return None
+
+def current_scorer_identity():
+    """キャッシュキー用の (scorer_id, model_version)。モデルが変わればバージョンも変わる (しきい値はタグ確率から再計算)。"""
+    plugins = scorer_plugins_module.plugins_identity(SCORER_PLUGINS)
+    if CUSTOM_SCORER_AVAILABLE: return "custom", plugins or "custom"
+    aesthetic = aesthetic_embedding_model_id()
+    ddb = f"{DEEPDANBOORU_PROJECT_PATH.name}:{len(STD_DEEPDANBOORU_TAGS or [])}"
+    return "standard", f"{aesthetic}|ddb={ddb}" + (f"|plugins={plugins}" if plugins else "")
+
+def _active_score_cache():
+    if not (SCORE_CACHE_ENABLED and INITIALIZED_SUCCESSFULLY): return None
+    return get_score_cache()
+
+def lookup_cached_scores(content_hashes):
+    """{content_hash: エントリ} を返す。キャッシュ無効/未初期化時は空。"""
+    cache = _active_score_cache()
+    if cache is None: return {}
+    try: return cache.get_many(content_hashes, *current_scorer_identity())
+    except Exception as e_cache_get: print(f"[Scoring] スコアキャッシュ参照エラー: {e_cache_get}"); return {}
+
+def store_cached_scores(content_hashes, scores, metadata_list, extras_list=None):
+    """推論結果を保存する。画像エラーやダミースコア、カスケードの安価な段だけのスコア、v1 スコアラーの (減点を再計算できない) スコアは保存しない。"""
+    cache = _active_score_cache()
+    if cache is None: return
+    extras_list = extras_list or [{} for _ in scores]
+    entries = [(h, score[0], score[1], meta, extras.get("tag_probs")) for h, score, meta, extras in zip(content_hashes, scores, metadata_list, extras_list)
+               if h and extras.get("score_stage") not in (CASCADE_STAGE_CHEAP, CASCADE_STAGE_PRIOR, LEGACY_CUSTOM_STAGE) and not any(t in _UNCACHEABLE_TAGS or t.startswith("image_open_error") for t in score[1])]
+    try: cache.put_many(entries, *current_scorer_identity(), datetime.datetime.now(datetime.timezone.utc).isoformat())
+    except Exception as e_cache_put: print(f"[Scoring] スコアキャッシュ書込エラー: {e_cache_put}")
+
+def score_from_cache(entry, penalties_config: dict):
+    """キャッシュの基本スコアとタグ確率に、現在のしきい値と penalties を適用し直す。"""
+    return _apply_penalties(entry["score_moe"], derive_failure_tags(entry["failure_tags"], entry.get("tag_probs")), penalties_config)
+
+def register_score_cache_version():
+    """現行モデルバージョンを登録し、最近使われた score_cache.SCORE_CACHE_KEEP_VERSIONS 版より古いバージョンのキャッシュを削除する。"""
+    cache = _active_score_cache()
+    if cache is None: return
+    try:
+        scorer_id, model_version = current_scorer_identity()
+        evicted = cache.register_model_version(scorer_id, model_version, datetime.datetime.now(datetime.timezone.utc).isoformat())
+        if evicted: print(f"[Scoring] 引退したモデルバージョンのキャッシュ {evicted} 件を削除。")
+    except Exception as e_cache_reg: print(f"[Scoring] スコアキャッシュ バージョン登録エラー: {e_cache_reg}")
+
+def compute_phash(ingest):
+    """ImageIngest のデコード済み画像の知覚ハッシュ (64bit dHash)。デコードできなければ None。"""
+    img_rgb = ingest.rgb
+    if img_rgb is None: return None
+    try: return phash_index_module.dhash(img_rgb)
+    except Exception as e_phash: print(f"[Scoring] 知覚ハッシュ計算エラー ({ingest.path.name}): {e_phash}"); return None
+
+def compute_phash_for_path(image_path):
+    """スコア時と同じ解像度でデコードして知覚ハッシュを計算 (既存画像のインデックス補完用)。"""
+    with ImageIngest(image_path, decode_target_size()) as ingest: return compute_phash(ingest)
+
+def find_near_duplicate(phash_value, content_hash=None):
+    """
+    NEAR_DUP_MODE == "copy" のとき、NEAR_DUP_MAX_DISTANCE 以内でスコアキャッシュにある画像を距離順に探す。
+    Returns: (キャッシュエントリ, 一致した content_hash, 距離) または None
+    """
+    if NEAR_DUP_MODE != "copy" or phash_value is None: return None
+    matches = phash_index_module.get_phash_index().query(phash_value, NEAR_DUP_MAX_DISTANCE, exclude=content_hash)
+    cached = lookup_cached_scores([key for key, _ in matches]) if matches else {}
+    for key, distance in matches:
+        if key in cached: return cached[key], key, distance
+    return None
+
+def annotate_cache_fields(score_data, content_hash, from_cache, extras=None):
+    """content_hash / score_source / phash / score_stage と、受け取り側 (tag_store / embedding_store) 向けの一時キーを載せる。"""
+    if content_hash: score_data["content_hash"] = content_hash
+    if from_cache: score_data["score_source"] = "cache"
+    extras = extras or {}
+    if extras.get("phash") is not None: score_data[phash_index_module.PHASH_KEY] = phash_index_module.phash_to_hex(extras["phash"])
+    if extras.get("near_duplicate"):
+        score_data["score_source"] = "near_duplicate"; score_data["near_duplicate_of"], score_data["near_duplicate_distance"] = extras["near_duplicate"]
+    if extras.get("score_stage"): score_data["score_stage"] = extras["score_stage"]
+    if extras.get("tag_probs") is not None: score_data[TAG_PROBS_KEY] = extras["tag_probs"]  # {} も渡す (tag_store が古い確率を消す)
+    if extras.get("clip_embedding") is not None: score_data[CLIP_EMBEDDING_KEY] = extras["clip_embedding"]
+    return score_data
+
+def process_images_batch(image_path_strs, penalties_config: dict, batch_size=None, thumbnail_dir=None, use_cache=True):
+    """
+    複数画像のメタデータ抽出・スコアリング (・サムネイル生成) を行い、[(image_id, score_data, metadata), ...] を返す。
+    各ファイルは ImageIngest で 1 回だけ開いてデコードし、全ステージで共有します。
+    内容ハッシュがキャッシュにある画像は推論せず、保存済みのスコア/タグ/メタデータを再利用します。
+    use_cache=False (対話的な再スコア) ではキャッシュと近似重複を使わずに推論し、結果でキャッシュを上書きします。
+    """
+    image_paths = [Path(p) for p in image_path_strs]
+    target_size = decode_target_size(); ingests = [ImageIngest(p, target_size) for p in image_paths]
+    try:
+        hashes = [compute_content_hash(p) for p in image_paths]
+        cached = lookup_cached_scores(hashes) if use_cache else {}
+        n = len(image_paths); metadata_list = [None] * n; scores = [None] * n; extras_list = [{} for _ in range(n)]; miss_idx = []
+        for i, h in enumerate(hashes):
+            if h in cached:
+                metadata_list[i] = cached[h]["metadata"]; extras_list[i] = {"tag_probs": cached[h].get("tag_probs") or {}}
+                scores[i] = score_from_cache(cached[h], penalties_config)
+            else:
+                metadata_list[i] = extract_metadata_from_image(str(image_paths[i]), ingest=ingests[i]); phash = compute_phash(ingests[i])
+                near = find_near_duplicate(phash, h) if use_cache else None
+                if near:  # 近似重複: 一致した画像の基本スコアとタグ確率を流用し、現在のしきい値/ペナルティで作り直す
+                    scores[i] = score_from_cache(near[0], penalties_config); extras_list[i] = {"tag_probs": near[0].get("tag_probs") or {}, "phash": phash, "near_duplicate": (near[1], near[2])}
+                else: miss_idx.append(i); extras_list[i] = {"phash": phash}
+        if miss_idx:
+            miss_paths = [image_paths[i] for i in miss_idx]; miss_extras = []
+            miss_scores = score_batch(miss_paths, penalties_config, batch_size=batch_size, ingests=[ingests[i] for i in miss_idx], extras_out=miss_extras)
+            for i, score, extras in zip(miss_idx, miss_scores, miss_extras): scores[i] = score; extras_list[i] = {**extras, "phash": extras_list[i].get("phash")}
+            store_cached_scores([hashes[i] for i in miss_idx], miss_scores, [metadata_list[i] for i in miss_idx], miss_extras)
+        results = []
+        for image_path, score, metadata, ingest, h, extras in zip(image_paths, scores, metadata_list, ingests, hashes, extras_list):
+            score_data = annotate_cache_fields(build_score_data(image_path, *score), h, h in cached, extras)
+            if thumbnail_dir is not None: attach_thumbnail(score_data, thumbnail_dir, ingest=ingest)
+            for stage, err in ingest.errors.items(): print(f"[Scoring] {image_path.name}: {stage} ステージ失敗: {err}")
+            results.append((image_path.stem, score_data, metadata))
+        return results
+    finally:
+        for ingest in ingests: ingest.close()
+
 def process_single_image(image_path_str: str, penalties_config: dict):
-    image_path = Path(image_path_str); image_id = image_path.stem
-    metadata = extract_metadata_from_image(str(image_path))
-    if CUSTOM_SCORER_AVAILABLE:
-        try: base_s, fail_tags, final_s, applied_pen = score_one_custom(image_path, penalties_config)
-        except Exception as e_custom_score:
-            print(f"[Scoring] カスタムスコアラーエラー ({image_path.name}): {e_custom_score}。ダミーにフォールバック。")
-            base_s, fail_tags, final_s, applied_pen = round(np.random.uniform(3,7),1), ["custom_err"], round(np.random.uniform(1,6),1), {}
-    else: base_s, fail_tags, final_s, applied_pen = score_one_standard(image_path, penalties_config)
-
-    score_data = {"id": image_id, "filename": image_path.name, "path": str(image_path),
-                  "score_final": final_s, "score_moe": base_s,
-                  "score_aesthetic_clip": round(base_s / 10.0, 3) if base_s is not None else 0.0,
-                  "failure_tags": fail_tags, "penalties_applied": applied_pen,
-                  "last_scored_date": datetime.datetime.now(datetime.timezone.utc).isoformat()}
-    return image_id, score_data, metadata
+    return process_images_batch([image_path_str], penalties_config, batch_size=1)[0]
 
 def initialize_all_models(force_cpu=False, progress_callback=None):
+    global SCORER_PLUGINS, INITIALIZED_SUCCESSFULLY
     if CUSTOM_SCORER_AVAILABLE:
-        print("[Scoring] カスタムモデル初期化...");
-        try: initialize_custom_models(force_cpu=force_cpu, progress_callback=progress_callback)
-        except Exception as e_init_custom: print(f"[Scoring] カスタムモデル初期化失敗: {e_init_custom}")
-    else: print("[Scoring] 標準モデル初期化..."); initialize_standard_models(force_cpu=force_cpu, progress_callback=progress_callback)
+        print("[Scoring] カスタムモデル初期化...")
+        SCORER_PLUGINS = scorer_plugins_module.initialize_plugins(SCORER_PLUGINS, force_cpu=force_cpu, progress_callback=progress_callback)
+        # v1 (custom_scoring.py) は自分で INITIALIZED_SUCCESSFULLY を立てる約束。v2 は置き換えプラグインが 1 つでも使えれば初期化済み
+        if any(p.replaces_standard and p.api_version >= 2 for p in SCORER_PLUGINS): INITIALIZED_SUCCESSFULLY = True
+    else:
+        print("[Scoring] 標準モデル初期化..."); initialize_standard_models(force_cpu=force_cpu, progress_callback=progress_callback)
+        if SCORER_PLUGINS: SCORER_PLUGINS = scorer_plugins_module.initialize_plugins(SCORER_PLUGINS, force_cpu=force_cpu, progress_callback=progress_callback)
+    register_score_cache_version()
 
 def _parse_sd_parameters(params_str):
     metadata = {}; error_keys = []
@@ -321,12 +945,21 @@ def _parse_sd_parameters(params_str):
     if error_keys: metadata["error_keys"] = list(set(metadata.get("error_keys", []) + error_keys))
     return metadata
 
-def extract_metadata_from_image(image_path_str: str):
+def extract_metadata_from_image(image_path_str: str, ingest=None):
+    """ingest (ImageIngest) を渡すと、開いたハンドルから PNG text / EXIF を読み、再オープンしない。"""
     image_path = Path(image_path_str)
     metadata = {"extracted_by": None, "extraction_timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat()}
-    error_keys = []
+    error_keys = []; meta_start = time.perf_counter()
     try:
-        img = Image.open(image_path); metadata['width_orig'] = img.width; metadata['height_orig'] = img.height
+        if ingest is None: img = Image.open(image_path)
+        else:
+            img = ingest.image
+            if img is None:
+                if not image_path.exists(): raise FileNotFoundError(image_path_str)
+                raise OSError(ingest.stage_error("open"))
+            ingest.decode()  # IDAT 後の tEXt チャンクも読み込まれる (ピクセルはスコアリング等と共有)
+            meta_start = time.perf_counter()  # open / decode は ImageIngest 側で計測
+        metadata['width_orig'], metadata['height_orig'] = (ingest.original_size if ingest is not None and ingest.original_size else img.size)  # draft 後の img.size は縮小後
         if img.format == "PNG":
             metadata["extracted_by"] = "Pillow (PNG)"
             if img.info and "parameters" in img.info: metadata.update(_parse_sd_parameters(img.info["parameters"]))
@@ -362,16 +995,36 @@ def extract_metadata_from_image(image_path_str: str):
         else: metadata["extracted_by"] = f"Pillow ({img.format})"
     except FileNotFoundError: error_keys.append("file_not_found_for_metadata"); metadata["error"] = "File not found"
     except Exception as e_extract: error_keys.append(f"metadata_extraction_unknown_error:{str(e_extract)[:30]}"); metadata["error"] = str(e_extract)
-    if error_keys: metadata["error_keys"] = list(set(metadata.get("error_keys", []) + error_keys))
+    if error_keys:
+        metadata["error_keys"] = list(set(metadata.get("error_keys", []) + error_keys))
+        if ingest is not None: ingest.record_error("metadata", ", ".join(error_keys))
     metadata['width'] = metadata.get('width', metadata.get('width_orig')); metadata['height'] = metadata.get('height', metadata.get('height_orig'))
+    perf_stats_module.record("metadata", time.perf_counter() - meta_start)
     return metadata
 
-def load_penalties():
-    if not PENALTIES_YML_PATH.exists(): return {}
+def load_penalty_config():
+    """
+    penalties.yml を読み、(penalties, default_threshold, tag_thresholds) を返す。
+    値は数値 (減点値) か {penalty: 減点値, threshold: しきい値}。_default_threshold で全体のしきい値を指定できる。
+    """
+    penalties = {}; default_threshold = 0.5; tag_thresholds = {}
+    if not PENALTIES_YML_PATH.exists(): return penalties, default_threshold, tag_thresholds
     try:
-        with open(PENALTIES_YML_PATH, 'r', encoding='utf-8') as f: penalties = yaml.safe_load(f)
-        return {str(k): float(v) for k,v in penalties.items()} if penalties else {}
-    except Exception as e_penalty_load: print(f"Penalties YMLロード失敗: {e_penalty_load}"); return {}
+        with open(PENALTIES_YML_PATH, 'r', encoding='utf-8') as f: raw = yaml.safe_load(f) or {}
+        for k, v in raw.items():
+            if str(k) == "_default_threshold": default_threshold = float(v); continue
+            if isinstance(v, dict):
+                if v.get("penalty") is not None: penalties[str(k)] = float(v["penalty"])
+                if v.get("threshold") is not None: tag_thresholds[str(k)] = float(v["threshold"])
+            else: penalties[str(k)] = float(v)
+    except Exception as e_penalty_load: print(f"Penalties YMLロード失敗: {e_penalty_load}")
+    return penalties, default_threshold, tag_thresholds
+
+def load_penalties():
+    """減点値 {tag: penalty} を返す。しきい値設定は DEEPDANBOORU_THRESHOLD / TAG_THRESHOLDS に反映する。"""
+    global DEEPDANBOORU_THRESHOLD, TAG_THRESHOLDS
+    penalties, DEEPDANBOORU_THRESHOLD, TAG_THRESHOLDS = load_penalty_config()
+    return {**scorer_plugins_module.default_penalties(SCORER_PLUGINS), **penalties}  # penalties.yml の値が優先
 
 def update_metadata_json(new_metadata_dict):
     current_metadata = {}
@@ -385,8 +1038,23 @@ def update_metadata_json(new_metadata_dict):
         return True
     except Exception as e_meta_write: print(f"metadata.json書込エラー: {e_meta_write}"); return False
 
-def generate_thumbnail(original_path_str: str, thumbnail_path_str: str, size=(256, 256)):
+def _thumbnail_from_ingest(ingest, thumbnail_path, size):
+    img_rgb = ingest.rgb
+    if img_rgb is None:
+        print(f"サムネイル生成エラー ({ingest.path.name}): {ingest.stage_error('open', 'decode')}"); ingest.record_error("thumbnail", "decode failed"); return False
+    try:
+        # thumbnail() と同じくアスペクト比を保って縮小 (拡大はしない)。共有画像は変更しない。
+        ratio = min(size[0] / img_rgb.width, size[1] / img_rgb.height)
+        img = img_rgb.resize((max(1, round(img_rgb.width * ratio)), max(1, round(img_rgb.height * ratio))), Image.Resampling.LANCZOS, reducing_gap=2.0) if ratio < 1 else img_rgb
+        thumbnail_path.parent.mkdir(parents=True, exist_ok=True)
+        img.save(thumbnail_path, "JPEG", quality=85, optimize=True)
+        return True
+    except Exception as e_thumb:
+        print(f"サムネイル生成エラー ({ingest.path.name}): {e_thumb}"); ingest.record_error("thumbnail", e_thumb); return False
+
+def generate_thumbnail(original_path_str: str, thumbnail_path_str: str, size=THUMBNAIL_SIZE, ingest=None):
     original_path = Path(original_path_str); thumbnail_path = Path(thumbnail_path_str)
+    if ingest is not None: return _thumbnail_from_ingest(ingest, thumbnail_path, size)
     try:
         img = Image.open(original_path)
         if img.format in ["HEIF", "HEIC"]:
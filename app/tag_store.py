@@ -0,0 +1,154 @@
+# app/tag_store.py
+# 画像ごとの DeepDanbooru タグ確率 (候補タグのみ) を保存する疎行列ストアと、再ペナルティ計算エンジン。
+# penalties.yml (減点値・しきい値) を変更したとき、再推論せずにライブラリ全体の
+# score_final / failure_tags / penalties_applied を作り直すために使います。
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+BASE_DIR_TAG_STORE = Path(__file__).resolve().parent.parent
+TAG_PROB_STORE_PATH = BASE_DIR_TAG_STORE / "cache" / "tag_probs.npz"
+_QUANT_SCALE = 255.0  # 確率は uint8 に量子化して保存 (誤差 ±0.002)
+PRIOR_SCORE_STAGE = "cascade_prior"  # score_moe が推論値でない (カスケードの仮スコア) エントリの score_stage (scoring.CASCADE_STAGE_PRIOR)
+LEGACY_SCORE_STAGE = "custom_v1"  # v1 カスタムスコアラーが減点まで計算したエントリの score_stage (scoring.LEGACY_CUSTOM_STAGE)
+
+class TagProbStore:
+    """
+    CSR 形式 (indptr / indices / data) の画像×タグ確率行列。
+    行 = 画像ID、列 = タグ語彙、値 = round(p * 255) (uint8)。
+    absorb / remove は保留リストに積むだけで、repenalize / save の前にまとめて行列へ反映します。
+    """
+    def __init__(self, path=TAG_PROB_STORE_PATH):
+        self.path = Path(path); self._lock = threading.Lock()
+        self.image_ids = []; self.tags = []; self._row_of = {}; self._col_of = {}
+        self.indptr = np.zeros(1, dtype=np.int64); self.indices = np.zeros(0, dtype=np.int32); self.data = np.zeros(0, dtype=np.uint8)
+        self._pending = {}; self._removed = set(); self.dirty = False
+
+    def __len__(self):
+        with self._lock: return len((set(self._row_of) | set(self._pending)) - self._removed)
+
+    def __contains__(self, image_id):
+        with self._lock: return image_id not in self._removed and (image_id in self._pending or image_id in self._row_of)
+
+    def load(self):
+        if not self.path.exists(): return self
+        try:
+            with np.load(self.path, allow_pickle=False) as npz:
+                image_ids = [str(x) for x in npz["image_ids"]]; tags = [str(x) for x in npz["tags"]]
+                indptr = npz["indptr"].astype(np.int64); indices = npz["indices"].astype(np.int32); data = npz["data"].astype(np.uint8)
+            if len(indptr) != len(image_ids) + 1 or len(indices) != len(data): raise ValueError("行列の形状が不正です")
+        except Exception as e_load: print(f"[TagStore] {self.path.name} の読込失敗 (空のストアで続行): {e_load}"); return self
+        with self._lock:
+            self.image_ids = image_ids; self.tags = tags; self.indptr = indptr; self.indices = indices; self.data = data
+            self._row_of = {img_id: i for i, img_id in enumerate(image_ids)}; self._col_of = {t: j for j, t in enumerate(tags)}
+            self._pending.clear(); self._removed.clear(); self.dirty = False
+        return self
+
+    def save(self):
+        """保留分を反映して原子的に書き出す (変更がなければ何もしない)。"""
+        with self._lock:
+            self._compact_locked()
+            if not self.dirty: return
+            self.path.parent.mkdir(parents=True, exist_ok=True); tmp_path = self.path.with_suffix(".tmp")
+            try:
+                with open(tmp_path, "wb") as f:
+                    np.savez_compressed(f, image_ids=np.array(self.image_ids, dtype=str), tags=np.array(self.tags, dtype=str),
+                                        indptr=self.indptr, indices=self.indices, data=self.data)
+                os.replace(tmp_path, self.path); self.dirty = False
+            except Exception as e_save: print(f"[TagStore] {self.path.name} の保存失敗: {e_save}")
+
+    def absorb(self, image_id, tag_probs):
+        """
+        画像 1 枚分の {tag: prob} を登録。空 ({}: 候補タグなし) なら以前の行を消す。
+        None (タグ推論ができなかった) の場合だけ何もしない (前回の確率を残す)。
+        """
+        if tag_probs is None: return
+        if not tag_probs: self.remove(image_id); return
+        with self._lock: self._pending[image_id] = dict(tag_probs); self._removed.discard(image_id); self.dirty = True
+
+    def remove(self, image_id):
+        with self._lock:
+            self._pending.pop(image_id, None)
+            if image_id in self._row_of: self._removed.add(image_id); self.dirty = True
+
+    def get(self, image_id):
+        """{tag: prob} (量子化後の値)。未登録なら None。"""
+        with self._lock:
+            if image_id in self._removed: return None
+            if image_id in self._pending: return dict(self._pending[image_id])
+            row = self._row_of.get(image_id)
+            if row is None: return None
+            s, e = self.indptr[row], self.indptr[row + 1]
+            return {self.tags[j]: float(q) / _QUANT_SCALE for j, q in zip(self.indices[s:e], self.data[s:e])}
+
+    def _compact_locked(self):
+        if not self._pending and not self._removed: return
+        replace = set(self._pending) | self._removed
+        row_keep = np.array([img_id not in replace for img_id in self.image_ids], dtype=bool); counts = np.diff(self.indptr)
+        entry_keep = np.repeat(row_keep, counts); new_ids = [img_id for img_id, keep in zip(self.image_ids, row_keep) if keep]
+        indices_parts = [self.indices[entry_keep]]; data_parts = [self.data[entry_keep]]; count_parts = [counts[row_keep]]
+        for img_id, probs in self._pending.items():
+            cols = []
+            for tag in probs:
+                if tag not in self._col_of: self._col_of[tag] = len(self.tags); self.tags.append(tag)
+                cols.append(self._col_of[tag])
+            q = np.clip(np.rint(np.fromiter(probs.values(), dtype=np.float32, count=len(probs)) * _QUANT_SCALE), 0, 255).astype(np.uint8)
+            new_ids.append(img_id); indices_parts.append(np.array(cols, dtype=np.int32)); data_parts.append(q); count_parts.append(np.array([len(cols)], dtype=np.int64))
+        self.image_ids = new_ids; self._row_of = {img_id: i for i, img_id in enumerate(new_ids)}
+        self.indptr = np.concatenate(([0], np.cumsum(np.concatenate(count_parts)))).astype(np.int64)
+        self.indices = np.concatenate(indices_parts).astype(np.int32); self.data = np.concatenate(data_parts).astype(np.uint8)
+        self._pending.clear(); self._removed.clear()
+
+    def repenalize(self, scores_data, penalties, default_threshold=0.5, tag_thresholds=None):
+        """
+        scores_data ({image_id: score_data}) の score_final / failure_tags / penalties_applied を現在の設定で作り直す (インプレース)。
+        ストアに確率がある画像はタグ判定 (タグ別しきい値) からやり直し、ない画像は既存の failure_tags に減点値だけ適用し直す。
+        確率を持たないタグ (カスタムスコアラーのタグ、deepdanbooru_unavailable 等) はそのまま残す。変更した画像数を返す。
+        score_stage が PRIOR_SCORE_STAGE の画像は基本スコアが仮の値なので作り直さない (再スコアで本来のスコアになるまでそのまま)。
+        score_stage が LEGACY_SCORE_STAGE の画像も、v1 スコアラー自身の減点を尊重して作り直さない。
+        """
+        tag_thresholds = tag_thresholds or {}
+        with self._lock:
+            self._compact_locked()
+            tags = self.tags; indptr = self.indptr; indices = self.indices; data = self.data; row_of = self._row_of; col_of = dict(self._col_of)
+            n_tags = len(tags)
+            thr_q = np.full(n_tags, default_threshold, dtype=np.float32)
+            pen_vec = np.zeros(n_tags, dtype=np.float64)
+            for j, tag in enumerate(tags):
+                if tag in tag_thresholds: thr_q[j] = tag_thresholds[tag]
+                pen_vec[j] = max(0.0, float(penalties.get(tag, 0.0)))
+            thr_q = np.ceil(thr_q * _QUANT_SCALE - 1e-3)  # p >= thr を量子化値で比較
+            row_index = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+            hit = data >= thr_q[indices] if len(data) else np.zeros(0, dtype=bool)
+            store_penalty = np.bincount(row_index[hit], weights=pen_vec[indices[hit]], minlength=len(indptr) - 1)
+            hit_positions = np.flatnonzero(hit); hit_rows_start = np.searchsorted(hit_positions, indptr)
+        changed = 0
+        for image_id, score_data in scores_data.items():
+            base = score_data.get("score_moe")
+            if base is None or score_data.get("score_stage") in (PRIOR_SCORE_STAGE, LEGACY_SCORE_STAGE): continue
+            old_tags = list(dict.fromkeys(score_data.get("failure_tags") or [])); row = row_of.get(image_id)
+            if row is None: extras = old_tags; new_tags = list(old_tags); total = 0.0; applied = {}
+            else:
+                row_cols = set(indices[indptr[row]:indptr[row + 1]].tolist())
+                row_hits = indices[hit_positions[hit_rows_start[row]:hit_rows_start[row + 1]]]
+                extras = [t for t in old_tags if col_of.get(t) not in row_cols]
+                new_tags = extras + [tags[j] for j in row_hits]; total = float(store_penalty[row])
+                applied = {tags[j]: float(pen_vec[j]) for j in row_hits if pen_vec[j] > 0}
+            for tag in extras:
+                penalty_val = float(penalties.get(tag, 0.0))
+                if penalty_val > 0 and tag not in applied: applied[tag] = penalty_val; total += penalty_val
+            final = round(max(0.0, min(10.0, float(base) - total)), 2)
+            if score_data.get("score_final") != final or score_data.get("failure_tags") != new_tags or score_data.get("penalties_applied") != applied:
+                score_data["score_final"] = final; score_data["failure_tags"] = new_tags; score_data["penalties_applied"] = applied; changed += 1
+        return changed
+
+_store_instance = None; _store_instance_lock = threading.Lock()
+
+def get_tag_store():
+    """プロセス内で共有するストア (初回呼び出し時にディスクから読込)。"""
+    global _store_instance
+    with _store_instance_lock:
+        if _store_instance is None: _store_instance = TagProbStore(TAG_PROB_STORE_PATH).load()
+        return _store_instance
@@ -0,0 +1,2 @@
+# bench/
+# スコアリング経路のベンチマーク。python -m bench.run_bench --help を参照。
@@ -0,0 +1,79 @@
+# bench/corpus.py
+# ベンチマーク用の再現可能な合成画像コーパス。
+# 同じ seed / 設定なら同じバイト列になるので、バージョン間で同一条件の比較ができます。
+#   PNG  + A1111 "parameters" テキスト
+#   PNG  + ComfyUI "prompt" JSON
+#   JPEG + EXIF UserComment (A1111 形式)
+#   WEBP + EXIF UserComment (JSON 形式)
+#   HEIC (pillow-heif がある場合のみ)
+import json
+from pathlib import Path
+
+import numpy as np
+import piexif
+import piexif.helper
+from PIL import Image, PngImagePlugin
+
+DEFAULT_RESOLUTIONS = ((512, 512), (832, 1216), (1024, 1024), (1536, 2048))
+KINDS = ("png_a1111", "png_comfy", "jpeg_exif", "webp_exif", "heic")
+MANIFEST_NAME = "corpus.json"
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener(); HEIF_WRITE_AVAILABLE = True
+except ImportError: HEIF_WRITE_AVAILABLE = False
+
+def _a1111_parameters(rng, idx):
+    words = ["masterpiece", "best quality", "1girl", "landscape", "sunset", "city", "forest", "portrait", "detailed", "night sky"]
+    prompt = ", ".join(rng.choice(words, size=6, replace=False))
+    return (f"{prompt}\nNegative prompt: lowres, bad anatomy, bad hands, blurry\n"
+            f"Steps: {20 + idx % 20}, Sampler: DPM++ 2M Karras, CFG scale: 7, Seed: {1000 + idx}, Size: 512x512, Model: bench_model")
+
+def _comfy_prompt(idx):
+    return json.dumps({"3": {"class_type": "KSampler", "inputs": {"seed": 1000 + idx, "steps": 25, "cfg": 7.0, "sampler_name": "euler"}},
+                       "6": {"class_type": "CLIPTextEncode", "inputs": {"text": f"bench prompt {idx}"}}})
+
+def _user_comment_exif(text):
+    return piexif.dump({"0th": {piexif.ImageIFD.Software: b"bench"}, "Exif": {piexif.ExifIFD.UserComment: piexif.helper.UserComment.dump(text, encoding="unicode")}})
+
+def synth_image(rng, width, height):
+    """生成画像に近い滑らかな絵柄 (低周波ノイズの拡大 + グラデーション + 細かいノイズ)。"""
+    low = rng.random((max(2, height // 64), max(2, width // 64), 3), dtype=np.float32)
+    base = np.asarray(Image.fromarray((low * 255).astype(np.uint8)).resize((width, height), Image.Resampling.BICUBIC), dtype=np.float32)
+    gradient = np.linspace(0, 60, width, dtype=np.float32)[None, :, None]
+    noise = rng.normal(0, 6, (height, width, 3)).astype(np.float32)
+    return Image.fromarray(np.clip(base * 0.8 + gradient + noise, 0, 255).astype(np.uint8))
+
+def generate_corpus(out_dir, per_kind=4, resolutions=DEFAULT_RESOLUTIONS, seed=0, kinds=KINDS):
+    """
+    out_dir に per_kind × len(resolutions) 枚ずつ書き出し、corpus.json (ファイル一覧と設定) を返す。
+    同じ設定の corpus.json が既にあれば再生成しない。
+    """
+    out_dir = Path(out_dir); out_dir.mkdir(parents=True, exist_ok=True)
+    kinds = [k for k in kinds if k != "heic" or HEIF_WRITE_AVAILABLE]
+    config = {"per_kind": per_kind, "resolutions": [list(r) for r in resolutions], "seed": seed, "kinds": kinds}
+    manifest_path = out_dir / MANIFEST_NAME
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        if manifest.get("config") == config and all((out_dir / f["name"]).exists() for f in manifest["files"]): return manifest
+    rng = np.random.default_rng(seed); files = []; idx = 0
+    for kind in kinds:
+        for width, height in resolutions:
+            for _ in range(per_kind):
+                img = synth_image(rng, width, height); stem = f"{kind}_{width}x{height}_{idx:04d}"
+                if kind == "png_a1111":
+                    info = PngImagePlugin.PngInfo(); info.add_text("parameters", _a1111_parameters(rng, idx)); name = stem + ".png"
+                    img.save(out_dir / name, "PNG", pnginfo=info)
+                elif kind == "png_comfy":
+                    info = PngImagePlugin.PngInfo(); info.add_text("prompt", _comfy_prompt(idx)); name = stem + ".png"
+                    img.save(out_dir / name, "PNG", pnginfo=info)
+                elif kind == "jpeg_exif":
+                    name = stem + ".jpg"; img.save(out_dir / name, "JPEG", quality=92, exif=_user_comment_exif(_a1111_parameters(rng, idx)))
+                elif kind == "webp_exif":
+                    name = stem + ".webp"; img.save(out_dir / name, "WEBP", quality=90, exif=_user_comment_exif(json.dumps({"prompt": f"bench prompt {idx}", "seed": 1000 + idx})))
+                else:
+                    name = stem + ".heic"; img.save(out_dir / name, "HEIF", quality=90)
+                files.append({"name": name, "kind": kind, "width": width, "height": height, "bytes": (out_dir / name).stat().st_size}); idx += 1
+    manifest = {"config": config, "files": files, "heif_skipped": "heic" in KINDS and not HEIF_WRITE_AVAILABLE}
+    manifest_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
@@ -0,0 +1,104 @@
+# bench/decode_quality.py
+# 縮小デコード (app.ingest の target_size: JPEG draft / reduce) と従来のフル解像度デコードの比較。
+# 各画像について、モデル入力 (DeepDanbooru / CLIP) とサムネイルの差 (PSNR・最大誤差) と所要時間を測り、
+# --backend real ではスコア (Aesthetic) とタグ確率の差も報告します。
+#   python -m bench.decode_quality                      # モックの前処理で比較
+#   python -m bench.decode_quality --backend real       # 実モデルでスコア差まで比較
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from . import corpus as corpus_module
+from . import mock_backend as mock_backend_module
+from .run_bench import BASE_DIR_BENCH
+
+DEFAULT_RESOLUTIONS = ((1024, 1536), (2048, 3072))
+DEFAULT_CORPUS_DIR = BASE_DIR_BENCH / "cache" / "bench_corpus_large"
+
+def psnr(a, b, peak=1.0):
+    mse = float(np.mean((np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)) ** 2))
+    return float("inf") if mse == 0 else 10.0 * np.log10(peak * peak / mse)
+
+def _thumbnail_array(img_rgb, size):
+    ratio = min(size[0] / img_rgb.width, size[1] / img_rgb.height)
+    thumb = img_rgb.resize((max(1, round(img_rgb.width * ratio)), max(1, round(img_rgb.height * ratio))), Image.Resampling.LANCZOS, reducing_gap=2.0) if ratio < 1 else img_rgb
+    return np.asarray(thumb, dtype=np.float32) / 255.0
+
+def _decode_and_prepare(scoring_module, path, target_size):
+    from app.ingest import ImageIngest
+    start = time.perf_counter()
+    with ImageIngest(path, target_size) as ingest:
+        img = ingest.rgb; inputs = scoring_module.preprocess_for_models(img)
+        thumb = _thumbnail_array(img, scoring_module.THUMBNAIL_SIZE); decoded_size = img.size
+    return inputs, thumb, decoded_size, time.perf_counter() - start
+
+def compare_image(scoring_module, path, target_size, with_scores=False):
+    full_inputs, full_thumb, full_size, full_s = _decode_and_prepare(scoring_module, path, None)
+    red_inputs, red_thumb, red_size, red_s = _decode_and_prepare(scoring_module, path, target_size)
+    row = {"name": Path(path).name, "full_size": list(full_size), "reduced_size": list(red_size),
+           "full_ms": round(full_s * 1000, 1), "reduced_ms": round(red_s * 1000, 1), "speedup": round(full_s / red_s, 2) if red_s > 0 else None,
+           "thumb_psnr": round(psnr(full_thumb, red_thumb), 2) if full_thumb.shape == red_thumb.shape else None}
+    for key in ("ddb", "clip"):
+        a, b = full_inputs.get(key), red_inputs.get(key)
+        if a is None or b is None: continue
+        peak = 1.0 if key == "ddb" else float(np.ptp(a)) or 1.0  # CLIP 入力は正規化済みなので値域で PSNR を取る
+        row[f"{key}_psnr"] = round(psnr(a, b, peak), 2); row[f"{key}_max_abs"] = round(float(np.max(np.abs(a - b))), 4)
+    if with_scores:
+        full_extras, red_extras = [], []
+        (full_base, full_tags, _, _), = scoring_module.score_preprocessed_batch([full_inputs], [row["name"]], {}, extras_out=full_extras)
+        (red_base, red_tags, _, _), = scoring_module.score_preprocessed_batch([red_inputs], [row["name"]], {}, extras_out=red_extras)
+        fp, rp = full_extras[0].get("tag_probs") or {}, red_extras[0].get("tag_probs") or {}
+        row["aesthetic_abs_diff"] = round(abs(full_base - red_base), 4)
+        row["tag_prob_max_diff"] = round(max([abs(fp.get(t, 0.0) - rp.get(t, 0.0)) for t in set(fp) | set(rp)] or [0.0]), 4)
+        row["tag_set_changed"] = sorted(set(full_tags) ^ set(red_tags))
+    return row
+
+def summarize(rows):
+    def stat(key, fn):
+        values = [r[key] for r in rows if r.get(key) is not None and np.isfinite(r[key])]
+        return round(float(fn(values)), 3) if values else None
+    summary = {"images": len(rows), "median_speedup": stat("speedup", np.median), "min_thumb_psnr": stat("thumb_psnr", np.min),
+               "min_ddb_psnr": stat("ddb_psnr", np.min), "min_clip_psnr": stat("clip_psnr", np.min)}
+    if any("aesthetic_abs_diff" in r for r in rows):
+        summary.update({"max_aesthetic_abs_diff": stat("aesthetic_abs_diff", np.max), "max_tag_prob_diff": stat("tag_prob_max_diff", np.max),
+                        "images_with_tag_changes": sum(1 for r in rows if r.get("tag_set_changed"))})
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.decode_quality", description="縮小デコードと従来デコードの品質・速度比較")
+    parser.add_argument("--backend", choices=("mock", "real"), default="mock"); parser.add_argument("--force-cpu", action="store_true")
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS_DIR)); parser.add_argument("--per-kind", type=int, default=2)
+    parser.add_argument("--resolutions", default=",".join(f"{w}x{h}" for w, h in DEFAULT_RESOLUTIONS))
+    parser.add_argument("--images", nargs="*", default=None, help="合成コーパスの代わりに使う実画像")
+    parser.add_argument("--output", default=None, help="結果 JSON の保存先")
+    args = parser.parse_args(argv)
+
+    if args.images: paths = [Path(p) for p in args.images]
+    else:
+        resolutions = [tuple(int(v) for v in r.lower().split("x")) for r in args.resolutions.split(",") if r]
+        manifest = corpus_module.generate_corpus(args.corpus, args.per_kind, resolutions)
+        paths = [Path(args.corpus) / f["name"] for f in manifest["files"]]
+    from app import scoring as scoring_module
+    if args.backend == "mock": mock_backend_module.install(scoring_module, {"clip_inference": 0.0, "ddb_inference": 0.0, "batch_overhead": 0.0})
+    else:
+        scoring_module.initialize_all_models(force_cpu=args.force_cpu, progress_callback=None)
+        if not scoring_module.INITIALIZED_SUCCESSFULLY: print("[DecodeQuality] モデル初期化に失敗しました。", file=sys.stderr); return 2
+    scoring_module.REDUCED_DECODE = True; target_size = scoring_module.decode_target_size()
+    print(f"[DecodeQuality] 目標解像度 {target_size[0]}x{target_size[1]}, {len(paths)}枚")
+    rows = []
+    for path in paths:
+        row = compare_image(scoring_module, path, target_size, with_scores=args.backend == "real"); rows.append(row)
+        print(f"  {row['name']:<36} {row['full_size'][0]}x{row['full_size'][1]} -> {row['reduced_size'][0]}x{row['reduced_size'][1]}  "
+              f"{row['full_ms']:>7.1f} -> {row['reduced_ms']:>6.1f} ms (x{row['speedup']})  PSNR ddb {row.get('ddb_psnr')} / clip {row.get('clip_psnr')} / thumb {row['thumb_psnr']} dB"
+              + (f"  Δaesthetic {row['aesthetic_abs_diff']}  Δtag {row['tag_prob_max_diff']}" if "aesthetic_abs_diff" in row else ""))
+    summary = summarize(rows); print("\n[DecodeQuality] " + json.dumps(summary, ensure_ascii=False))
+    if args.output: Path(args.output).write_text(json.dumps({"target_size": target_size, "summary": summary, "images": rows}, indent=2, ensure_ascii=False), encoding="utf-8")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
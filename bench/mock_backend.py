@@ -0,0 +1,66 @@
+# bench/mock_backend.py
+# 実モデルなしでスコアリング経路を通すための決定的なモックバックエンド。
+# app.scoring のモデル用グローバル (前処理 / Aesthetic / DeepDanbooru) を差し替えるだけなので、
+# 前処理・バッチ化・ペナルティ計算・キャッシュ注記などのアプリ側のコードはそのまま計測されます。
+# 推論は画素値から決まる出力を返し、所要時間は実モデルの計測値 (logs/perf_stats.jsonl) などに合わせて sleep で再現します。
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# 1 枚あたりの推論時間 (秒) の既定値 (CPU での実測の目安)。バッチ固定費 + 枚数比例。
+DEFAULT_LATENCY = {"clip_inference": 0.120, "ddb_inference": 0.080, "batch_overhead": 0.005}
+CLIP_SIZE = 224; DDB_SIZE = 512; EMBED_DIM = 768; N_TAGS = 64
+_CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32); _CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+def latency_from_perf_log(path):
+    """perf_stats の JSONL の最後のレコードから clip_inference / ddb_inference の p50 (秒/枚) を取る。"""
+    latency = dict(DEFAULT_LATENCY); last = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip(): last = json.loads(line)
+    for stage in ("clip_inference", "ddb_inference"):
+        if last and stage in last.get("stages", {}): latency[stage] = last["stages"][stage]["p50_ms"] / 1000.0
+    return latency
+
+class MockClipProcessor:
+    """CLIPProcessor と同じ呼び方で、短辺リサイズ + 中央クロップ + 正規化を行う (前処理コストも実物に近い)。"""
+    def __call__(self, images, return_tensors="np"):
+        img = images; scale = CLIP_SIZE / min(img.width, img.height)
+        img = img.resize((max(CLIP_SIZE, round(img.width * scale)), max(CLIP_SIZE, round(img.height * scale))), Image.Resampling.BICUBIC)
+        left = (img.width - CLIP_SIZE) // 2; top = (img.height - CLIP_SIZE) // 2
+        arr = (np.asarray(img.crop((left, top, left + CLIP_SIZE, top + CLIP_SIZE)), dtype=np.float32) / 255.0 - _CLIP_MEAN) / _CLIP_STD
+        return {"pixel_values": arr.transpose(2, 0, 1)[None]}
+
+class MockAestheticRunner:
+    """OnnxAestheticRunner と同じ run(pixel_values) -> (logits, 埋め込み)。"""
+    def __init__(self, latency):
+        self.latency = latency; self._proj = np.random.default_rng(1).standard_normal((3, EMBED_DIM)).astype(np.float32)
+    def run(self, pixel_values):
+        n = len(pixel_values); time.sleep(self.latency["batch_overhead"] + self.latency["clip_inference"] * n)
+        feats = pixel_values.reshape(n, 3, -1).mean(axis=2)
+        embeds = feats @ self._proj; embeds /= np.linalg.norm(embeds, axis=1, keepdims=True) + 1e-6
+        return feats.sum(axis=1, keepdims=True), embeds
+
+class MockDeepDanbooru:
+    """Keras モデル / OnnxDeepDanbooru と同じ input_shape / predict。"""
+    input_shape = (None, DDB_SIZE, DDB_SIZE, 3)
+    def __init__(self, latency):
+        self.latency = latency; self._proj = np.random.default_rng(2).standard_normal((3, N_TAGS)).astype(np.float32)
+    def predict(self, batch, batch_size=None, verbose=0):
+        n = len(batch); time.sleep(self.latency["batch_overhead"] + self.latency["ddb_inference"] * n)
+        feats = batch.reshape(n, -1, 3).mean(axis=1)
+        return 1.0 / (1.0 + np.exp(-(feats - 0.5) @ self._proj * 4.0))
+
+def install(scoring_module, latency=None):
+    """scoring のモデルをモックに差し替え、初期化済み扱いにする。"""
+    latency = {**DEFAULT_LATENCY, **(latency or {})}
+    scoring_module.CUSTOM_SCORER_AVAILABLE = False; scoring_module.SCORER_PLUGINS = [p for p in scoring_module.SCORER_PLUGINS if not p.replaces_standard]
+    scoring_module.STD_CLIP_PROCESSOR_AESTHETIC = MockClipProcessor()
+    scoring_module.STD_AESTHETIC_ONNX = MockAestheticRunner(latency); scoring_module.STD_AESTHETIC_PREDICTOR = scoring_module.STD_CLIP_MODEL_AESTHETIC = None
+    scoring_module.STD_DEEPDANBOORU_MODEL = MockDeepDanbooru(latency)
+    scoring_module.STD_DEEPDANBOORU_TAGS = ["bad_hands", "blurry", "lowres", "extra_digits"] + [f"tag_{i:02d}" for i in range(N_TAGS - 4)]
+    scoring_module.INITIALIZED_SUCCESSFULLY = True
+    return latency
@@ -0,0 +1,164 @@
+# bench/run_bench.py
+# スコアリング経路のベンチマーク。合成コーパスに対してステージごとに images/sec とメモリピークを測り、
+# bench/baseline.json と比べて性能低下 (回帰) を表示します。
+#   python -m bench.run_bench                       # モックバックエンドで計測し、ベースラインと比較
+#   python -m bench.run_bench --backend real        # 実モデル (models/ 以下) で計測
+#   python -m bench.run_bench --update-baseline     # 結果をベースラインとして保存
+#   python -m bench.run_bench --latency-from logs/perf_stats.jsonl   # モックの推論時間を実測値に合わせる
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from . import corpus as corpus_module
+from . import mock_backend as mock_backend_module
+
+BENCH_DIR = Path(__file__).resolve().parent
+BASE_DIR_BENCH = BENCH_DIR.parent
+DEFAULT_BASELINE_PATH = BENCH_DIR / "baseline.json"
+DEFAULT_CORPUS_DIR = BASE_DIR_BENCH / "cache" / "bench_corpus"
+DEFAULT_TOLERANCE = 0.15  # images/sec が 15% 以上低下、またはメモリピークが 15% 以上増加で回帰
+
+def _max_rss_mb():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(rss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+    except ImportError:
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 2**20, 1)  # Windows
+        except Exception: return None
+
+def _git_revision():
+    try: return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=BASE_DIR_BENCH, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception: return None
+
+def _measure(fn, items, repeat, memory):
+    """fn(items) を repeat 回実行した最速の時間と、(memory なら) tracemalloc で測った 1 回分のピーク (MB)。"""
+    best = None
+    for _ in range(repeat):
+        gc.collect(); start = time.perf_counter(); fn(items); elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    peak_mb = None
+    if memory:
+        gc.collect(); tracemalloc.start()
+        try: fn(items); peak_mb = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        finally: tracemalloc.stop()
+    return {"images": len(items), "seconds": round(best, 4), "images_per_sec": round(len(items) / best, 2) if best > 0 else None, "peak_traced_mb": peak_mb}
+
+def run_stages(scoring_module, paths, work_dir, repeat=1, memory=True, batch_size=None):
+    """
+    ステージ別 (metadata / thumbnail / preprocess / inference / end_to_end) に計測した結果の dict。
+    inference_concurrent は CLIP と DeepDanbooru を同時に推論するモード (CONCURRENT_INFERENCE) での inference。
+    """
+    from PIL import Image
+    thumb_dir = Path(work_dir) / "thumbnails"; thumb_dir.mkdir(parents=True, exist_ok=True)
+    batch_size = max(1, int(batch_size or scoring_module.SCORING_BATCH_SIZE)); results = {}
+    def metadata_stage(items):
+        for p in items: scoring_module.extract_metadata_from_image(str(p))
+    def thumbnail_stage(items):
+        for p in items: scoring_module.generate_thumbnail(str(p), str(thumb_dir / f"{p.stem}.jpg"))
+    def preprocess_stage(items):
+        for p in items:
+            with Image.open(p) as img: scoring_module.preprocess_for_models(img.convert("RGB"))
+    preprocessed = []
+    for p in paths:
+        with Image.open(p) as img: preprocessed.append(scoring_module.preprocess_for_models(img.convert("RGB")))
+    names = [p.name for p in paths]
+    def inference_stage(items):
+        for start in range(0, len(items), batch_size):
+            scoring_module.score_preprocessed_batch(items[start:start + batch_size], names[start:start + batch_size], {})
+    def inference_concurrent_stage(items):
+        previous = scoring_module.CONCURRENT_INFERENCE; scoring_module.CONCURRENT_INFERENCE = True
+        try: inference_stage(items)
+        finally: scoring_module.CONCURRENT_INFERENCE = previous
+    def end_to_end_stage(items):
+        scoring_module.process_images_batch([str(p) for p in items], {}, batch_size=batch_size, thumbnail_dir=str(thumb_dir))
+    for name, fn, items in [("metadata", metadata_stage, paths), ("thumbnail", thumbnail_stage, paths), ("decode_preprocess", preprocess_stage, paths),
+                            ("inference", inference_stage, preprocessed), ("inference_concurrent", inference_concurrent_stage, preprocessed),
+                            ("end_to_end", end_to_end_stage, paths)]:
+        print(f"[Bench] {name} ({len(items)}枚)...", flush=True)
+        results[name] = _measure(fn, items, repeat, memory)
+    return results
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ベースラインとの比較行と回帰の有無を返す。"""
+    lines = []; regressions = []
+    base_stages = (baseline or {}).get("stages", {})
+    for stage, cur in report["stages"].items():
+        base = base_stages.get(stage); line = f"  {stage:<18}{cur['images_per_sec'] or 0:>9.2f} img/s  {cur['peak_traced_mb'] if cur['peak_traced_mb'] is not None else '-':>8} MB"
+        if base and base.get("images_per_sec") and cur.get("images_per_sec"):
+            ratio = cur["images_per_sec"] / base["images_per_sec"]; line += f"   x{ratio:.2f} (基準 {base['images_per_sec']:.2f})"
+            if ratio < 1.0 - tolerance: regressions.append(f"{stage}: images/sec {base['images_per_sec']} -> {cur['images_per_sec']}"); line += "  << 回帰"
+        if base and base.get("peak_traced_mb") and cur.get("peak_traced_mb") and cur["peak_traced_mb"] > base["peak_traced_mb"] * (1.0 + tolerance):
+            regressions.append(f"{stage}: peak {base['peak_traced_mb']}MB -> {cur['peak_traced_mb']}MB"); line += "  << メモリ増"
+        lines.append(line)
+    if baseline and baseline.get("machine") != report.get("machine"): lines.append("  (注意: ベースラインと計測マシン/環境が異なります)")
+    if baseline and baseline.get("backend") != report.get("backend"): lines.append(f"  (注意: ベースラインのバックエンドは {baseline.get('backend')} です)")
+    return lines, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.run_bench", description="スコアリング経路のベンチマーク")
+    parser.add_argument("--backend", choices=("mock", "real"), default="mock")
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS_DIR), help="合成コーパスの出力先 (同じ設定なら再利用)")
+    parser.add_argument("--per-kind", type=int, default=2, help="種類×解像度ごとの枚数")
+    parser.add_argument("--resolutions", default=",".join(f"{w}x{h}" for w, h in corpus_module.DEFAULT_RESOLUTIONS))
+    parser.add_argument("--seed", type=int, default=0); parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=None); parser.add_argument("--force-cpu", action="store_true")
+    parser.add_argument("--no-memory", action="store_true", help="tracemalloc によるメモリピーク計測を省略")
+    parser.add_argument("--latency-from", default=None, help="モックの推論時間を perf_stats の JSONL から設定")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE_PATH)); parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE); parser.add_argument("--output", default=None, help="結果 JSON の保存先")
+    args = parser.parse_args(argv)
+
+    resolutions = [tuple(int(v) for v in r.lower().split("x")) for r in args.resolutions.split(",") if r]
+    manifest = corpus_module.generate_corpus(args.corpus, args.per_kind, resolutions, args.seed)
+    paths = [Path(args.corpus) / f["name"] for f in manifest["files"]]
+    if manifest.get("heif_skipped"): print("[Bench] pillow-heif がないため HEIC は省略しました。")
+    print(f"[Bench] コーパス: {len(paths)}枚 ({args.corpus})")
+
+    from app import scoring as scoring_module
+    scoring_module.SCORE_CACHE_ENABLED = False  # キャッシュヒットで推論が飛ばされないように
+    latency = None
+    if args.backend == "mock":
+        latency = mock_backend_module.latency_from_perf_log(args.latency_from) if args.latency_from else None
+        latency = mock_backend_module.install(scoring_module, latency)
+    else:
+        scoring_module.initialize_all_models(force_cpu=args.force_cpu, progress_callback=None)
+        if not scoring_module.INITIALIZED_SUCCESSFULLY: print("[Bench] モデル初期化に失敗しました。", file=sys.stderr); return 2
+
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_"))
+    try: stages = run_stages(scoring_module, paths, work_dir, repeat=max(1, args.repeat), memory=not args.no_memory, batch_size=args.batch_size)
+    finally: shutil.rmtree(work_dir, ignore_errors=True)
+    report = {"created": datetime.datetime.now(datetime.timezone.utc).isoformat(), "revision": _git_revision(), "backend": args.backend,
+              "mock_latency": latency, "batch_size": args.batch_size or scoring_module.SCORING_BATCH_SIZE,
+              "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpu_count": os.cpu_count()},
+              "corpus": manifest["config"], "stages": stages, "max_rss_mb": _max_rss_mb()}
+
+    baseline_path = Path(args.baseline); baseline = None
+    if baseline_path.exists():
+        try: baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        except Exception as e_base: print(f"[Bench] ベースライン読込失敗: {e_base}")
+    if baseline and baseline.get("corpus") != report["corpus"]: print("[Bench] ベースラインとコーパス設定が異なるため比較しません。"); baseline = None
+    lines, regressions = compare(report, baseline, args.tolerance)
+    print(f"\n[Bench] 結果 (backend={args.backend}, 最大RSS {report['max_rss_mb']} MB)" + ("" if baseline else " (ベースラインなし)"))
+    print("\n".join(lines))
+    if args.output: Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n", encoding="utf-8"); print(f"[Bench] ベースラインを更新: {baseline_path}")
+    elif regressions:
+        print("\n[Bench] 回帰を検出:\n  " + "\n  ".join(regressions)); return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -44,7 +44,7 @@ python -m pip install --upgrade pip || (
 
 echo [3/7] 基本パッケージ install...
 REM ── torch, torchvision, torchaudio はここに含めず後で分岐インストール ──
-set "BASE_PKGS=PySide6 Pillow watchdog PyYAML pandas matplotlib piexif python-dotenv google-generativeai pillow-heif tensorflow tensorflow-io scipy scikit-image scikit-learn tqdm click simple-aesthetics-predictor open-clip-torch ftfy transformers huggingface_hub Jinja2"
+set "BASE_PKGS=PySide6 Pillow watchdog PyYAML pandas matplotlib piexif python-dotenv google-generativeai pillow-heif tensorflow tensorflow-io scipy scikit-image scikit-learn tqdm click simple-aesthetics-predictor open-clip-torch ftfy transformers huggingface_hub Jinja2 onnx onnxruntime tf2onnx"
 pip install %BASE_PKGS%
 if errorlevel 1 (
     echo ERROR: 基本パッケージのインストールに失敗しました。
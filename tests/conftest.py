@@ -0,0 +1,50 @@
+# tests/conftest.py
+# 共通フィクスチャ: bench のモックバックエンドで scoring を初期化済みにする (実モデル・torch・Qt は不要)。
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path: sys.path.insert(0, str(ROOT_DIR))
+
+NO_LATENCY = {"clip_inference": 0.0, "ddb_inference": 0.0, "batch_overhead": 0.0}
+# mock_backend.install が書き換える scoring のモジュール変数 (テスト後に元へ戻す)
+_MOCKED_NAMES = ("CUSTOM_SCORER_AVAILABLE", "SCORER_PLUGINS", "STD_CLIP_PROCESSOR_AESTHETIC", "STD_AESTHETIC_ONNX", "STD_AESTHETIC_PREDICTOR",
+                 "STD_CLIP_MODEL_AESTHETIC", "STD_DEEPDANBOORU_MODEL", "STD_DEEPDANBOORU_TAGS", "INITIALIZED_SUCCESSFULLY")
+
+@pytest.fixture
+def mock_scoring(monkeypatch):
+    """モックのモデルを載せた app.scoring。スコアキャッシュ・統計ログはリポジトリに書かないよう無効にする。"""
+    from app import scoring, perf_stats
+    from bench import mock_backend
+    for name in _MOCKED_NAMES: monkeypatch.setattr(scoring, name, getattr(scoring, name))
+    monkeypatch.setattr(scoring, "SCORE_CACHE_ENABLED", False); monkeypatch.setattr(perf_stats, "PERF_STATS_ENABLED", False)
+    mock_backend.install(scoring, NO_LATENCY)
+    return scoring
+
+@pytest.fixture
+def corpus_paths(tmp_path):
+    """合成コーパス (種類ごとに 1 枚、小さめの解像度) のパス。"""
+    from bench import corpus
+    manifest = corpus.generate_corpus(tmp_path / "corpus", 1, [(320, 240)])
+    return [tmp_path / "corpus" / f["name"] for f in manifest["files"]]
+
+@pytest.fixture
+def score_services(mock_scoring, corpus_paths, tmp_path, monkeypatch):
+    """別スレッドのイベントループで ScoringService を 127.0.0.1:0 に立てる。start(**kwargs) で起動、stop(service) で停止 (ワーカーが落ちたときの再現)。"""
+    from app import score_service
+    monkeypatch.setattr(score_service, "SERVICE_UPLOAD_DIR", tmp_path / "uploads")
+    loop = asyncio.new_event_loop(); thread = threading.Thread(target=loop.run_forever, daemon=True); thread.start(); running = []
+    class Services:
+        def start(self, **kwargs):
+            service = score_service.ScoringService("127.0.0.1", 0, path_roots=[corpus_paths[0].parent], **kwargs)
+            asyncio.run_coroutine_threadsafe(service.start(), loop).result(10); running.append(service)
+            return service
+        def stop(self, service):
+            running.remove(service); asyncio.run_coroutine_threadsafe(service.stop(), loop).result(10)
+    yield Services()
+    for service in list(running): Services().stop(service)
+    loop.call_soon_threadsafe(loop.stop); thread.join(5); loop.close()
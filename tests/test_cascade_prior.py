@@ -0,0 +1,30 @@
+import pytest
+
+from app import tag_store
+
+@pytest.fixture
+def ddb_cascade(mock_scoring, monkeypatch):
+    """"ddb" カスケードで、全画像が削除の目安を下回る (ViT-L を省いて仮スコアになる) 設定。"""
+    monkeypatch.setattr(mock_scoring, "CASCADE_MODE", "ddb"); monkeypatch.setattr(mock_scoring, "STD_CASCADE_PREDICTOR", None)
+    monkeypatch.setattr(mock_scoring, "CASCADE_DELETE_THRESHOLD", 20.0); monkeypatch.setattr(mock_scoring, "CASCADE_BAND", 1.0)
+    return mock_scoring
+
+def test_prior_stage_constant_matches_tag_store(mock_scoring):
+    assert mock_scoring.CASCADE_STAGE_PRIOR == tag_store.PRIOR_SCORE_STAGE
+
+def test_skipped_images_are_marked_as_prior(ddb_cascade, corpus_paths):
+    results = ddb_cascade.process_images_batch([str(p) for p in corpus_paths], ddb_cascade.load_penalties())
+    assert {d["score_stage"] for _, d, _ in results} == {ddb_cascade.CASCADE_STAGE_PRIOR}
+    assert all(d["score_moe"] == ddb_cascade.CASCADE_DDB_PRIOR_SCORE and ddb_cascade.CLIP_EMBEDDING_KEY not in d for _, d, _ in results)
+
+def test_repenalize_leaves_prior_entries_alone(ddb_cascade, corpus_paths, tmp_path):
+    results = ddb_cascade.process_images_batch([str(p) for p in corpus_paths], ddb_cascade.load_penalties())
+    store = tag_store.TagProbStore(tmp_path / "tag_probs.npz"); scores_data = {}
+    for image_id, score_data, _ in results: store.absorb(image_id, score_data.pop(ddb_cascade.TAG_PROBS_KEY, None)); scores_data[image_id] = score_data
+    prior_id = max(scores_data, key=lambda k: sum(scores_data[k]["penalties_applied"].values())); full_id = next(k for k in sorted(scores_data) if k != prior_id)
+    assert scores_data[prior_id]["score_final"] < ddb_cascade.CASCADE_DDB_PRIOR_SCORE  # 減点が入っている画像で確かめる
+    scores_data[full_id]["score_stage"] = ddb_cascade.CASCADE_STAGE_FULL
+    before = {k: dict(v) for k, v in scores_data.items()}
+    store.repenalize(scores_data, {}, 0.5)  # 減点なし: 作り直した画像は score_final = score_moe
+    assert scores_data[prior_id] == before[prior_id]
+    assert scores_data[full_id]["score_final"] == round(before[full_id]["score_moe"], 2)
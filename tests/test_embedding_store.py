@@ -0,0 +1,31 @@
+import numpy as np
+
+from app import embedding_store
+
+def test_round_trip_through_memmap_reopen(tmp_path):
+    rng = np.random.default_rng(0); dim = 8; count = embedding_store._INITIAL_CAPACITY + 100  # 1 回は行列を伸ばす
+    vectors = {f"h{i:05d}": rng.normal(size=dim).astype(np.float32) for i in range(count)}
+    store = embedding_store.ClipEmbeddingStore(tmp_path / "emb")
+    for content_hash, vector in vectors.items(): store.add(content_hash, vector, "model-a")
+    store.add("h00000", vectors["h00000"] * 2, "model-a")  # 同じキーは同じ行を上書き
+    vectors["h00000"] = vectors["h00000"] * 2
+    assert store.capacity > embedding_store._INITIAL_CAPACITY and len(store) == count
+    keep = [h for i, h in enumerate(vectors) if i % 3]; assert store.prune(keep) == count - len(keep)
+    store.flush(); del store
+
+    reopened = embedding_store.ClipEmbeddingStore(tmp_path / "emb").load()
+    assert reopened.model_id == "model-a" and reopened.dim == dim and len(reopened) == len(keep) and "h00000" not in reopened
+    found, matrix = reopened.get_matrix(list(reversed(keep)) + ["missing"])
+    assert found == list(reversed(keep)) and matrix.dtype == np.float16
+    np.testing.assert_array_equal(matrix, np.stack([vectors[h] for h in found]).astype(np.float16))
+
+def test_model_change_discards_rows(tmp_path):
+    store = embedding_store.ClipEmbeddingStore(tmp_path / "emb")
+    store.add("a", np.ones(4), "model-a"); store.add("b", np.ones(6), "model-b"); store.flush()
+    reopened = embedding_store.ClipEmbeddingStore(tmp_path / "emb").load()
+    assert reopened.model_id == "model-b" and "a" not in reopened and reopened.get_matrix(["b"])[1].shape == (1, 6)
+
+def test_size_mismatch_loads_empty(tmp_path):
+    store = embedding_store.ClipEmbeddingStore(tmp_path / "emb"); store.add("a", np.ones(4), "model-a"); store.flush()
+    with open(store.data_path, "ab") as f: f.write(b"\0\0")  # 行列ファイルが index と合わない
+    assert len(embedding_store.ClipEmbeddingStore(tmp_path / "emb").load()) == 0
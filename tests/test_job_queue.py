@@ -0,0 +1,29 @@
+from app import job_queue
+
+def _queue(tmp_path): return job_queue.ScoringJobQueue(tmp_path / "jobs.jsonl").load()
+
+def test_reenqueue_while_in_flight_survives_mark_done(tmp_path):
+    queue = _queue(tmp_path)
+    queue.enqueue(["a", "b"], job_queue.PRIORITY_RESCAN, "rescan"); assert queue.take(10) == ["a", "b"]
+    assert queue.enqueue(["a"], job_queue.PRIORITY_WATCHER, "watcher") == 1  # 処理中に書き換えられた
+    assert queue.enqueue(["b"], job_queue.PRIORITY_INTERACTIVE, "interactive") == 1  # 処理中に再スコアが押された
+    queue.mark_done(["a", "b"])
+    assert len(queue) == 2 and queue.take(10, priority=job_queue.PRIORITY_INTERACTIVE) == ["b"] and queue.take(10) == ["a"]
+    queue.mark_done(["a", "b"]); assert len(queue) == 0
+    assert len(_queue(tmp_path)) == 0  # ジャーナルも完了
+
+def test_reenqueue_survives_crash_before_mark_done(tmp_path):
+    queue = _queue(tmp_path); queue.enqueue(["a"], job_queue.PRIORITY_RESCAN, "rescan"); queue.take(10)
+    queue.enqueue(["a"], job_queue.PRIORITY_INTERACTIVE, "interactive")
+    assert _queue(tmp_path).take(10, priority=job_queue.PRIORITY_INTERACTIVE) == ["a"]
+
+def test_release_without_retry_defers_to_next_session(tmp_path):
+    queue = _queue(tmp_path); queue.enqueue(["a", "b"], job_queue.PRIORITY_RESCAN, "rescan"); queue.take(10)
+    queue.mark_done(["a"]); queue.release(["b"], retry=False)
+    assert queue.pending_count() == 0 and len(queue) == 1 and queue.take(10) == []
+    assert queue.enqueue(["b"], job_queue.PRIORITY_INTERACTIVE, "interactive") == 1 and queue.take(10) == ["b"]  # 明示的に追加し直せば再試行
+    assert _queue(tmp_path).take(10) == ["b"]  # 次回起動時は再開する
+
+def test_release_with_retry_returns_to_queue(tmp_path):
+    queue = _queue(tmp_path); queue.enqueue(["a"]); queue.take(10); queue.release(["a"])
+    assert queue.pending_count() == 1 and queue.take(10) == ["a"]
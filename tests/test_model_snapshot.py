@@ -0,0 +1,43 @@
+import threading
+import time
+from pathlib import Path
+
+from app import model_snapshot
+
+MODEL_IDS = {"clip": "clip-id", "aesthetic_predictor": "predictor-id", "aesthetic_class": "AestheticsPredictorV2Linear"}
+
+class FakePretrained:
+    """save_pretrained でファイルを書き出すだけのモデル (書き込みの途中で読まれるよう少し待つ)。"""
+    def __init__(self, filename, payload): self.filename = filename; self.payload = payload
+    def save_pretrained(self, path, **kwargs):
+        Path(path).mkdir(parents=True, exist_ok=True); time.sleep(0.01); (Path(path) / self.filename).write_text(self.payload, encoding="utf-8")
+
+def _write(snapshot_dir, payload="v"):
+    return model_snapshot.write_snapshot(MODEL_IDS, FakePretrained("preprocessor_config.json", payload), FakePretrained("config.json", payload),
+                                         FakePretrained("model.safetensors", payload), snapshot_dir)
+
+def test_rewrite_keeps_previous_generation_readable(tmp_path):
+    first = _write(tmp_path, "first"); assert model_snapshot.valid_snapshot(MODEL_IDS, tmp_path) == first
+    second = _write(tmp_path, "second")
+    assert model_snapshot.valid_snapshot(MODEL_IDS, tmp_path)["dir"] == second["dir"] != first["dir"]
+    assert (model_snapshot.predictor_dir(first, tmp_path) / "model.safetensors").read_text(encoding="utf-8") == "first"  # 読み込み中のプロセスの世代は残す
+    model_snapshot.invalidate(first, tmp_path); assert model_snapshot.valid_snapshot(MODEL_IDS, tmp_path) is not None  # 古い世代の失敗で新しい世代を消さない
+
+def test_stale_generations_are_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_snapshot, "STALE_GENERATION_SEC", 0.0)
+    first = _write(tmp_path); second = _write(tmp_path); third = _write(tmp_path)
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_dir()) == sorted([second["dir"], third["dir"]])
+    assert not model_snapshot.generation_dir(first, tmp_path).exists()
+
+def test_concurrent_writers_and_readers_never_see_partial_snapshot(tmp_path):
+    errors = []; stop = threading.Event()
+    def reader():
+        while not stop.is_set():
+            manifest = model_snapshot.load_manifest(tmp_path)
+            if manifest and any(not (model_snapshot.generation_dir(manifest, tmp_path) / f).exists() for f in manifest["files"]): errors.append(manifest["dir"])
+    readers = [threading.Thread(target=reader) for _ in range(2)]; writers = [threading.Thread(target=_write, args=(tmp_path, str(i))) for i in range(4)]
+    for t in readers + writers: t.start()
+    for t in writers: t.join()
+    stop.set()
+    for t in readers: t.join()
+    assert errors == [] and model_snapshot.valid_snapshot(MODEL_IDS, tmp_path) is not None
@@ -0,0 +1,46 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from app import phash_index
+
+def _hamming(a, b): return bin(a ^ b).count("1")
+
+@pytest.fixture(params=["in_memory", "reloaded"])
+def populated(tmp_path, request):
+    """近い画像の塊を含むインデックスと、それと同じ内容の {key: ハッシュ}。削除・更新を通したもの (とそれを保存/読込したもの)。"""
+    rng = np.random.default_rng(0); hashes = {}
+    for c in range(40):
+        base = int(rng.integers(0, 2**63)) << 1 | int(rng.integers(0, 2))
+        for m in range(6):
+            value = base
+            for bit in rng.choice(64, size=int(rng.integers(0, 9)), replace=False): value ^= 1 << int(bit)
+            hashes[f"c{c:02d}_{m}"] = value
+    index = phash_index.PerceptualHashIndex(tmp_path / "phash.npz")
+    for key, value in hashes.items(): index.add(key, value)
+    for key in list(hashes)[::7]: index.remove(key); del hashes[key]  # 欠番の行は候補から外れる
+    for key in list(hashes)[1::11]: hashes[key] ^= 0b1011; index.add(key, hashes[key])  # 更新は古いバケットから外れる
+    if request.param == "in_memory": return index, hashes
+    index.save()
+    return phash_index.PerceptualHashIndex(tmp_path / "phash.npz").load(), hashes
+
+@pytest.mark.parametrize("radius", [0, 1, 3, phash_index.MAX_INDEXED_RADIUS, phash_index.MAX_INDEXED_RADIUS + 1, 10, 20])
+def test_query_matches_brute_force(populated, radius):
+    index, hashes = populated
+    for probe_key in list(hashes)[::5]:
+        probe = hashes[probe_key]; result = index.query(probe, radius, exclude=probe_key)
+        expected = {(k, _hamming(probe, v)) for k, v in hashes.items() if k != probe_key and _hamming(probe, v) <= radius}
+        assert set(result) == expected and len(result) == len(expected)
+        assert [d for _, d in result] == sorted(d for _, d in result)
+
+@pytest.mark.parametrize("radius", range(phash_index.MAX_INDEXED_RADIUS + 1))
+def test_duplicate_pairs_match_brute_force(populated, radius):
+    index, hashes = populated
+    expected = {(min(a, b), max(a, b), _hamming(hashes[a], hashes[b])) for a, b in itertools.combinations(hashes, 2) if _hamming(hashes[a], hashes[b]) <= radius}
+    result = index.duplicate_pairs(radius)
+    if radius == phash_index.MAX_INDEXED_RADIUS: assert len(expected) > 20  # 塊の中の近いペアが実際に含まれている
+    assert {(min(a, b), max(a, b), d) for a, b, d in result} == expected and len(result) == len(expected)
+
+def test_duplicate_pairs_rejects_radius_above_index(populated):
+    with pytest.raises(ValueError): populated[0].duplicate_pairs(phash_index.MAX_INDEXED_RADIUS + 1)
@@ -0,0 +1,45 @@
+import shutil
+import threading
+
+import pytest
+
+from app import pipeline
+
+@pytest.fixture
+def many_paths(corpus_paths, tmp_path):
+    """キューが詰まるだけの枚数 (合成コーパスを複製)。"""
+    out_dir = tmp_path / "many"; out_dir.mkdir(); paths = []
+    for i in range(24):
+        src = corpus_paths[i % len(corpus_paths)]; dst = out_dir / f"{i:03d}_{src.name}"; shutil.copyfile(src, dst); paths.append(str(dst))
+    return paths
+
+def _run(ingest_pipeline, timeout=30):
+    result = {}; thread = threading.Thread(target=lambda: result.setdefault("done", ingest_pipeline.run()), daemon=True); thread.start(); thread.join(timeout)
+    assert not thread.is_alive(), "IngestPipeline.run が終わりませんでした"
+    return result["done"]
+
+def _pipeline(mock_scoring, paths, **kwargs):
+    return pipeline.IngestPipeline(paths, mock_scoring.load_penalties(), batch_size=2, decode_workers=2, ready_queue_size=1, persist_queue_size=1, **kwargs)
+
+def test_failing_sink_does_not_hang(mock_scoring, many_paths):
+    def failing_sink(image_id, score_data, metadata): raise OSError("No space left on device")
+    ingest_pipeline = _pipeline(mock_scoring, many_paths, on_result=failing_sink)
+    assert _run(ingest_pipeline) == len(many_paths)
+    assert sorted(ingest_pipeline.failed_paths) == sorted(many_paths) and ingest_pipeline.error is None
+
+def test_inference_error_stops_all_stages(mock_scoring, many_paths, monkeypatch):
+    def failing_batch(*args, **kwargs): raise RuntimeError("CUDA out of memory")
+    monkeypatch.setattr(mock_scoring, "score_ingested_batch", failing_batch)
+    results = []; ingest_pipeline = _pipeline(mock_scoring, many_paths, on_result=lambda *r: results.append(r))
+    _run(ingest_pipeline)
+    assert results == [] and "CUDA out of memory" in ingest_pipeline.error
+
+def test_unreadable_file_skips_only_that_image(mock_scoring, many_paths, monkeypatch):
+    bad_path = many_paths[3]; original_hash = mock_scoring.compute_content_hash
+    def flaky_hash(path):
+        if str(path) == bad_path: raise PermissionError("denied")
+        return original_hash(path)
+    monkeypatch.setattr(mock_scoring, "compute_content_hash", flaky_hash)
+    results = []; ingest_pipeline = _pipeline(mock_scoring, many_paths, on_result=lambda image_id, *_: results.append(image_id))
+    assert _run(ingest_pipeline) == len(many_paths)
+    assert ingest_pipeline.failed_paths == [bad_path] and len(results) == len(many_paths) - 1 and ingest_pipeline.error is None
@@ -0,0 +1,40 @@
+import pytest
+
+from app import job_queue, pipeline, score_cache
+
+@pytest.fixture
+def cached_scoring(mock_scoring, tmp_path, monkeypatch):
+    """一時ディレクトリの SQLite をスコアキャッシュにした scoring。"""
+    cache = score_cache.ScoreCache(tmp_path / "scores.db")
+    monkeypatch.setattr(mock_scoring, "SCORE_CACHE_ENABLED", True); monkeypatch.setattr(mock_scoring, "get_score_cache", lambda: cache)
+    return mock_scoring
+
+def _sources(results): return {image_id: score_data.get("score_source", "inference") for image_id, score_data, _ in results}
+
+def test_process_images_batch_use_cache_false_reinfers(cached_scoring, corpus_paths):
+    paths = [str(p) for p in corpus_paths]; penalties = cached_scoring.load_penalties()
+    assert set(_sources(cached_scoring.process_images_batch(paths, penalties)).values()) == {"inference"}
+    assert set(_sources(cached_scoring.process_images_batch(paths, penalties)).values()) == {"cache"}
+    assert set(_sources(cached_scoring.process_images_batch(paths, penalties, use_cache=False)).values()) == {"inference"}
+
+def test_pipeline_use_cache_false_reinfers(cached_scoring, corpus_paths):
+    paths = [str(p) for p in corpus_paths]; penalties = cached_scoring.load_penalties()
+    def run(**kwargs):
+        results = []; pipeline.IngestPipeline(paths, penalties, on_result=lambda *r: results.append(r), **kwargs).run()
+        return _sources(results)
+    assert set(run().values()) == {"inference"} and set(run().values()) == {"cache"}
+    assert set(run(use_cache=False).values()) == {"inference"}
+
+def test_take_by_priority(tmp_path):
+    queue = job_queue.ScoringJobQueue(tmp_path / "jobs.jsonl")
+    queue.enqueue(["a", "b"], job_queue.PRIORITY_RESCAN, "rescan"); queue.enqueue(["c"], job_queue.PRIORITY_INTERACTIVE, "interactive")
+    assert queue.take(10, priority=job_queue.PRIORITY_INTERACTIVE) == ["c"]
+    assert queue.take(10, priority=job_queue.PRIORITY_INTERACTIVE) == [] and queue.take(10) == ["a", "b"]
+
+def test_register_keeps_recent_versions(tmp_path):
+    cache = score_cache.ScoreCache(tmp_path / "scores.db"); put = lambda version: cache.put_many([("h", 5.0, [], {}, {})], "standard", version, "t")
+    for i, version in enumerate(["gui", "gui|onnx_int8", "cli"]): put(version); assert cache.register_model_version("standard", version, f"2026-01-0{i + 1}", keep=3) == 0
+    assert all(cache.get("h", "standard", v) for v in ("gui", "gui|onnx_int8", "cli"))  # 別構成のプロセスが互いのキャッシュを消さない
+    assert cache.register_model_version("standard", "gui", "2026-01-04", keep=3) == 0  # 再登録で gui が最新になる
+    put("new"); assert cache.register_model_version("standard", "new", "2026-01-05", keep=3) == 1
+    assert cache.get("h", "standard", "gui|onnx_int8") is None and all(cache.get("h", "standard", v) for v in ("gui", "cli", "new"))
@@ -0,0 +1,21 @@
+import json
+
+from app import score_cli
+
+def test_single_process_jsonl(mock_scoring, corpus_paths, tmp_path, monkeypatch):
+    """既定の単一プロセス (パイプライン) 経路: 初期化の進捗通知 (emit) を含めて最後まで通る。"""
+    emitted = []
+    def fake_initialize_all_models(force_cpu=False, progress_callback=None):
+        progress_callback.emit("モック初期化", 100); emitted.append(force_cpu)  # 実物と同じく emit(msg, pct) で呼ぶ
+    monkeypatch.setattr(mock_scoring, "initialize_all_models", fake_initialize_all_models)
+    out_path = tmp_path / "out.jsonl"
+
+    assert score_cli.main([str(corpus_paths[0].parent), "--jsonl", str(out_path), "--device", "cpu"]) == 0
+    assert emitted == [True]
+    rows = [json.loads(line) for line in out_path.read_text(encoding="utf-8").splitlines()]
+    assert sorted(r["id"] for r in rows) == sorted(p.stem for p in corpus_paths)
+    assert all(0.0 <= r["score"]["score_final"] <= 10.0 and "_clip_embedding" not in r["score"] for r in rows)
+
+    # --skip-existing: 同じ出力先なら全件スキップ
+    assert score_cli.main([str(corpus_paths[0].parent), "--jsonl", str(out_path), "--skip-existing"]) == 0
+    assert len(out_path.read_text(encoding="utf-8").splitlines()) == len(rows)
@@ -0,0 +1,52 @@
+import json
+import threading
+
+from app import score_cli, score_cluster
+
+def _run(coordinator, paths, timeout=30):
+    """run() が戻らない (スレッドが待ち続ける) ときもテストが止まらないよう、別スレッドで待つ。"""
+    thread = threading.Thread(target=lambda: coordinator.run(paths), daemon=True); thread.start(); thread.join(timeout)
+    assert not thread.is_alive(), "coordinator.run が終わりませんでした"
+
+def test_dead_worker_shards_are_retried(score_services, corpus_paths, tmp_path, monkeypatch):
+    alive, doomed = score_services.start(), score_services.start()
+    doomed_url = f"http://127.0.0.1:{doomed.bound_port}"; original_wait_ready = score_cluster.WorkerNode.wait_ready
+    def wait_ready_then_kill(node, timeout):
+        ready = original_wait_ready(node, timeout)
+        if node.url == doomed_url: score_services.stop(doomed)  # 準備完了を返した直後に落ちる
+        return ready
+    monkeypatch.setattr(score_cluster.WorkerNode, "wait_ready", wait_ready_then_kill)
+    out_path = tmp_path / "out.jsonl"; sink = score_cli.JsonlSink(str(out_path)); paths = [str(p) for p in corpus_paths]
+    coordinator = score_cluster.ClusterCoordinator([f"http://127.0.0.1:{alive.bound_port}", doomed_url], sink, shard_size=1, inflight=1)
+    try: _run(coordinator, paths)
+    finally: sink.close()
+
+    rows = [json.loads(line) for line in out_path.read_text(encoding="utf-8").splitlines()]
+    assert sorted(r["id"] for r in rows) == sorted(p.stem for p in corpus_paths)
+    assert {r["score"]["path"] for r in rows} == set(paths) and all(0.0 <= r["score"]["score_final"] <= 10.0 for r in rows)
+    assert coordinator.done_images == len(paths) and coordinator.failed_paths == [] and coordinator.missing_paths == []
+    assert coordinator.retried_shards == 1  # 落ちたワーカーは 1 回失敗したあと休止し、そのシャードは生きているワーカーが処理する
+    live_node, dead_node = coordinator.workers
+    assert live_node.images == len(paths) and dead_node.images == 0 and dead_node.failures == 1
+
+def test_sink_error_fails_shard_without_hanging(score_services, mock_scoring, corpus_paths):
+    worker = score_services.start(); bad_id = corpus_paths[0].stem; written = []
+    class FlakySink:
+        scoring = mock_scoring
+        def __call__(self, image_id, score_data, metadata, embedding_model_id=None):
+            if image_id == bad_id: raise OSError("disk full")
+            written.append(image_id)
+    coordinator = score_cluster.ClusterCoordinator([f"http://127.0.0.1:{worker.bound_port}"], FlakySink(), shard_size=1, inflight=2)
+    _run(coordinator, [str(p) for p in corpus_paths])
+    assert coordinator.failed_paths == [str(corpus_paths[0])] and coordinator.retried_shards == 0
+    assert sorted(written) == sorted(p.stem for p in corpus_paths[1:]) and coordinator.done_images == len(corpus_paths) - 1
+
+def test_missing_paths_count_as_failed(score_services, mock_scoring, corpus_paths):
+    worker = score_services.start(); ghost = str(corpus_paths[0].parent / "gone.png"); calls = []
+    class RecordingSink:
+        scoring = mock_scoring
+        def __call__(self, image_id, score_data, metadata, embedding_model_id=None): calls.append((image_id, embedding_model_id))
+    coordinator = score_cluster.ClusterCoordinator([f"http://127.0.0.1:{worker.bound_port}"], RecordingSink(), shard_size=2, inflight=2)
+    _run(coordinator, [str(p) for p in corpus_paths] + [ghost])
+    assert coordinator.missing_paths == [ghost] and coordinator.failed_paths == [ghost] and coordinator.done_images == len(corpus_paths)
+    assert {model_id for _, model_id in calls} == {mock_scoring.aesthetic_embedding_model_id()}  # モデルIDは共有の sink ではなく呼び出しごとに渡す
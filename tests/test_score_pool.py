@@ -0,0 +1,43 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app import score_pool
+
+class _FakeExecutor:
+    """同じプロセスで関数を実行する ProcessPoolExecutor の代わり。broken なら _worker_process をプロセス異常終了として失敗させる。"""
+    created = []; broken_pools = 0  # 先頭から broken_pools 個のプールを壊れた状態で作る
+    def __init__(self, max_workers, mp_context=None, initializer=None, initargs=()):
+        self.broken = _FakeExecutor.broken_pools > len(_FakeExecutor.created); self.shut_down = False; _FakeExecutor.created.append(self)
+    def submit(self, fn, *args):
+        future = Future()
+        if self.broken and fn is score_pool._worker_process: future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+        else: future.set_result(fn(*args))
+        return future
+    def shutdown(self, wait=True, cancel_futures=False): self.shut_down = True
+
+@pytest.fixture
+def fake_executor(mock_scoring, monkeypatch):
+    monkeypatch.setattr(score_pool, "ProcessPoolExecutor", _FakeExecutor); monkeypatch.setattr(_FakeExecutor, "created", [])
+    return _FakeExecutor
+
+def _score(pool, mock_scoring, paths):
+    scored, progress = [], []
+    done = pool.score(paths, mock_scoring.load_penalties(), batch_size=2, on_result=lambda image_id, *_: scored.append(image_id), on_progress=lambda d, t: progress.append((d, t)))
+    return done, scored, progress
+
+def test_broken_pool_is_restarted_and_chunks_resubmitted(fake_executor, mock_scoring, corpus_paths, monkeypatch):
+    monkeypatch.setattr(fake_executor, "broken_pools", 1)
+    pool = score_pool.ScoringProcessPool(2); paths = [str(p) for p in corpus_paths]
+    done, scored, progress = _score(pool, mock_scoring, paths)
+    assert len(fake_executor.created) == 2 and fake_executor.created[0].shut_down  # 壊れたプールは閉じて作り直す
+    assert sorted(scored) == sorted(p.stem for p in corpus_paths) and done == len(paths) and pool.lost_paths == []
+    assert progress[-1] == (len(paths), len(paths))
+
+def test_broken_pool_twice_reports_lost_paths(fake_executor, mock_scoring, corpus_paths, monkeypatch):
+    monkeypatch.setattr(fake_executor, "broken_pools", 2)
+    pool = score_pool.ScoringProcessPool(2); paths = [str(p) for p in corpus_paths]
+    done, scored, progress = _score(pool, mock_scoring, paths)
+    assert len(fake_executor.created) == 2 and scored == []  # 再投入は 1 回だけ
+    assert sorted(pool.lost_paths) == sorted(paths) and done == len(paths) and progress[-1] == (len(paths), len(paths))
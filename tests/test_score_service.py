@@ -0,0 +1,95 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import score_service
+
+_OPENER = urllib.request.build_opener(urllib.request.ProxyHandler({}))  # 環境のプロキシ設定を 127.0.0.1 に効かせない
+
+def _request(port, path, body=None, content_type="application/json", timeout=10):
+    """(ステータス, JSON 本文, ヘッダー) を返す。4xx/5xx も例外にしない。"""
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=body, headers={"Content-Type": content_type} if body is not None else {})
+    try:
+        with _OPENER.open(request, timeout=timeout) as response: return response.status, json.loads(response.read()), response.headers
+    except urllib.error.HTTPError as e_http: return e_http.code, json.loads(e_http.read()), e_http.headers
+
+def _score_json(port, path):
+    return _request(port, "/score", json.dumps({"path": str(path)}).encode("utf-8"))
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline: return False
+        time.sleep(0.01)
+    return True
+
+@pytest.fixture
+def gate(mock_scoring, monkeypatch):
+    """process_images_batch を release() まで止める。entered は推論スレッドが入ったら立つ。"""
+    class Gate:
+        def __init__(self): self.open = threading.Event(); self.entered = threading.Event(); self.open.set()
+        def hold(self): self.open.clear(); self.entered.clear()
+        def release(self): self.open.set()
+    state = Gate(); original = mock_scoring.process_images_batch
+    def gated_process_images_batch(*args, **kwargs):
+        state.entered.set(); state.open.wait(10)
+        return original(*args, **kwargs)
+    monkeypatch.setattr(mock_scoring, "process_images_batch", gated_process_images_batch)
+    yield state
+    state.release()  # 停止 (executor.shutdown) が止まったままの推論を待ち続けないように
+
+@pytest.fixture
+def start_service(score_services, gate):
+    yield score_services.start
+    gate.release()  # 止めたままだとサービス停止 (executor.shutdown) が終わらない
+
+def test_health(start_service):
+    service = start_service()
+    status, body, _ = _request(service.bound_port, "/health")
+    assert status == 200 and body["status"] == "ok" and body["models_initialized"] is True and body["queue_depth"] == 0
+    assert _request(service.bound_port, "/nowhere")[0] == 404
+
+def test_concurrent_requests_share_one_batch(start_service, corpus_paths):
+    service = start_service(batch_size=8, batch_window_ms=300)
+    with ThreadPoolExecutor(max_workers=len(corpus_paths)) as executor:
+        responses = list(executor.map(lambda p: _score_json(service.bound_port, p), corpus_paths))
+    assert [status for status, _, _ in responses] == [200] * len(corpus_paths)
+    assert sorted(body["filename"] for _, body, _ in responses) == sorted(p.name for p in corpus_paths)
+    assert all(0.0 <= body["score_final"] <= 10.0 for _, body, _ in responses)
+    counters = _request(service.bound_port, "/metrics")[1]["counters"]
+    assert counters["batches"] == 1 and counters["succeeded"] == len(corpus_paths)
+
+def test_full_queue_returns_503(start_service, corpus_paths, gate):
+    service = start_service(batch_size=1, batch_window_ms=0, max_queue=1)
+    gate.hold()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        running = executor.submit(_score_json, service.bound_port, corpus_paths[0])
+        assert gate.entered.wait(5)  # 1 件目は推論中 (待ち行列は空)
+        queued = executor.submit(_score_json, service.bound_port, corpus_paths[1])
+        assert _wait_until(lambda: _request(service.bound_port, "/health")[1]["queue_depth"] == 1)
+        status, body, headers = _score_json(service.bound_port, corpus_paths[2])
+        assert status == 503 and headers["Retry-After"] == "1" and "error" in body
+        gate.release()
+        assert running.result(10)[0] == 200 and queued.result(10)[0] == 200
+    assert _request(service.bound_port, "/metrics")[1]["counters"]["rejected"] == 1
+
+def test_timeout_returns_504_and_removes_upload(start_service, corpus_paths, gate, tmp_path):
+    service = start_service(batch_size=1, batch_window_ms=0, request_timeout=0.3)
+    upload_dir = tmp_path / "uploads"; png_path = next(p for p in corpus_paths if p.suffix == ".png")
+    gate.hold()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        running = executor.submit(_score_json, service.bound_port, corpus_paths[0])
+        assert gate.entered.wait(5)
+        # 推論が詰まっている間に届いたアップロードは待ち行列のままタイムアウトする
+        status, body, _ = _request(service.bound_port, f"/score?filename={png_path.name}", png_path.read_bytes(), "image/png")
+        assert status == 504 and "error" in body
+        assert running.result(10)[0] == 504
+        assert len(list(upload_dir.iterdir())) == 1
+        gate.release()
+        assert _wait_until(lambda: not any(upload_dir.iterdir()))  # バッチャーが読み飛ばすときに一時ファイルを消す
+    assert _request(service.bound_port, "/metrics")[1]["counters"]["timeouts"] == 2
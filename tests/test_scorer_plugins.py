@@ -0,0 +1,46 @@
+import threading
+import types
+
+import pytest
+
+from app import scorer_plugins, tag_store
+
+V1_RESULT = (7.0, ["custom_blur"], 4.2, {"custom_blur": 2.8})
+
+class TagPlugin(scorer_plugins.ScorerPlugin):
+    """タグだけを返す v2 プラグイン (v1 と併用したときの確認用)。"""
+    name = "tagger"; needs_pixels = False
+    def score_batch(self, images, paths): return [{"tag_probs": {"custom_blur": 0.9}} for _ in paths]
+
+@pytest.fixture
+def v1_module():
+    """score_one_custom が受け取った penalties_dict を記録し、決まった結果を返す v1 スコアラー。"""
+    module = types.ModuleType("custom_scoring"); module.received = []
+    module.initialize_custom_models = lambda force_cpu=False, progress_callback=None: None
+    def score_one_custom(image_path, penalties_dict): module.received.append(dict(penalties_dict)); return V1_RESULT
+    module.score_one_custom = score_one_custom
+    return module
+
+def _use_plugins(scoring, monkeypatch, plugins):
+    for plugin in plugins: plugin._call_lock = threading.Lock()
+    monkeypatch.setattr(scoring, "SCORER_PLUGINS", plugins); monkeypatch.setattr(scoring, "CUSTOM_SCORER_AVAILABLE", True)
+
+def test_v1_scorer_gets_penalties_and_keeps_its_result(mock_scoring, monkeypatch, v1_module, corpus_paths):
+    _use_plugins(mock_scoring, monkeypatch, [scorer_plugins.LegacyScorerAdapter(v1_module)])
+    penalties = {"custom_blur": 1.0, "bad_hands": 2.0}; extras = []
+    assert mock_scoring.score_batch(corpus_paths, penalties, extras_out=extras) == [V1_RESULT] * len(corpus_paths)
+    assert v1_module.received == [penalties] * len(corpus_paths)
+    assert {e["score_stage"] for e in extras} == {mock_scoring.LEGACY_CUSTOM_STAGE}
+
+def test_v1_with_v2_plugin_recomputes_penalties(mock_scoring, monkeypatch, v1_module, corpus_paths):
+    _use_plugins(mock_scoring, monkeypatch, [scorer_plugins.LegacyScorerAdapter(v1_module), TagPlugin()])
+    base, tags, final, applied = mock_scoring.score_batch(corpus_paths[:1], {"custom_blur": 1.0})[0]
+    assert (base, tags, final, applied) == (7.0, ["custom_blur"], 6.0, {"custom_blur": 1.0})
+
+def test_repenalize_leaves_v1_entries_alone(mock_scoring, v1_module, tmp_path):
+    assert mock_scoring.LEGACY_CUSTOM_STAGE == tag_store.LEGACY_SCORE_STAGE
+    base, tags, final, applied = V1_RESULT
+    scores_data = {"a": {"score_moe": base, "score_final": final, "failure_tags": list(tags), "penalties_applied": dict(applied), "score_stage": tag_store.LEGACY_SCORE_STAGE}}
+    before = {k: dict(v) for k, v in scores_data.items()}
+    assert tag_store.TagProbStore(tmp_path / "tag_probs.npz").repenalize(scores_data, {"custom_blur": 5.0}) == 0
+    assert scores_data == before
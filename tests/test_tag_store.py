@@ -0,0 +1,51 @@
+import numpy as np
+
+from app import scoring, tag_store
+
+def _random_library(rng, n_images=300, n_tags=40):
+    """確率は量子化の格子 (k/255) 上に置く (ストアの uint8 量子化で値が変わらないように)。"""
+    tags = [f"tag_{j:02d}" for j in range(n_tags)]; probs = {}; scores_data = {}
+    for i in range(n_images):
+        image_id = f"img_{i:04d}"; chosen = rng.choice(n_tags, size=int(rng.integers(0, 12)), replace=False)
+        probs[image_id] = {tags[j]: int(rng.integers(0, 256)) / 255.0 for j in chosen}
+        old_tags = [tags[j] for j in chosen[:2]] + (["custom_low"] if i % 5 == 0 else [])  # custom_low は確率を持たないタグ
+        scores_data[image_id] = {"score_moe": round(float(rng.uniform(0, 10)), 2), "failure_tags": old_tags, "score_final": None, "penalties_applied": {}}
+    return tags, probs, scores_data
+
+def test_csr_repenalize_matches_per_image_path(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0); tags, probs, scores_data = _random_library(rng)
+    penalties = {t: float(rng.choice([0.0, 0.5, 1.25, 2.0])) for t in tags}; penalties["custom_low"] = 1.5  # 2 進で正確な値 (合計の順序で丸めが変わらない)
+    tag_thresholds = {tags[0]: 0.2, tags[1]: 0.8, tags[2]: 1.0}
+    monkeypatch.setattr(scoring, "DEEPDANBOORU_THRESHOLD", 0.5); monkeypatch.setattr(scoring, "TAG_THRESHOLDS", tag_thresholds)
+
+    store = tag_store.TagProbStore(tmp_path / "tag_probs.npz")
+    for image_id, image_probs in probs.items(): store.absorb(image_id, image_probs)
+    store.remove("img_0001"); del probs["img_0001"]  # ストアから消えた画像は既存の failure_tags だけで計算し直す
+    store.save(); store = tag_store.TagProbStore(tmp_path / "tag_probs.npz").load()
+    store.absorb("img_0002", {tags[3]: 1.0}); probs["img_0002"] = {tags[3]: 1.0}  # 保存後の保留分も反映される
+
+    assert store.repenalize(scores_data, penalties, 0.5, tag_thresholds) > 0
+    for image_id, score_data in scores_data.items():
+        entry = {"score_moe": score_data["score_moe"], "failure_tags": score_data["failure_tags"], "tag_probs": probs.get(image_id) or None}
+        _base, expected_tags, expected_final, expected_applied = scoring.score_from_cache(entry, penalties)
+        assert score_data["score_final"] == expected_final, image_id
+        assert sorted(score_data["failure_tags"]) == sorted(expected_tags) and score_data["penalties_applied"] == expected_applied, image_id
+    assert store.repenalize(scores_data, penalties, 0.5, tag_thresholds) == 0  # 2 回目は変化なし
+
+def test_save_load_round_trip(tmp_path):
+    store = tag_store.TagProbStore(tmp_path / "tag_probs.npz")
+    store.absorb("a", {"blurry": 0.5, "lowres": 1.0}); store.absorb("b", {"bad_hands": 0.25}); store.save()
+    reopened = tag_store.TagProbStore(tmp_path / "tag_probs.npz").load()
+    assert len(reopened) == 2 and reopened.get("a") == {"blurry": 128 / 255.0, "lowres": 1.0} and abs(reopened.get("b")["bad_hands"] - 0.25) <= 0.5 / 255.0
+
+def test_absorb_empty_probs_drops_stale_row(tmp_path):
+    store = tag_store.TagProbStore(tmp_path / "tag_probs.npz")
+    store.absorb("a", {"blurry": 1.0}); store.absorb("b", {"lowres": 1.0}); store.save()
+    store.absorb("a", {}); store.absorb("b", None)  # a は再スコアで候補タグなし、b はタグ推論ができなかった
+    assert "a" not in store and store.get("b") == {"lowres": 1.0}
+    store.save(); assert tag_store.TagProbStore(tmp_path / "tag_probs.npz").load().get("a") is None
+
+def test_empty_probs_reach_the_store(mock_scoring, corpus_paths, monkeypatch):
+    monkeypatch.setattr(mock_scoring, "TAG_PROB_STORE_FLOOR", 2.0)  # どの確率も候補に残らない
+    results = mock_scoring.process_images_batch([str(p) for p in corpus_paths], mock_scoring.load_penalties())
+    assert all(d[mock_scoring.TAG_PROBS_KEY] == {} for _, d, _ in results)